@@ -0,0 +1,176 @@
+"""
+Windowed aggregation of readings
+
+For the configured topics, running minimum, maximum, sum and count of each field
+are kept in preallocated table so that the memory use does not depend on the number
+of readings. When the window closes, the aggregates are published.
+"""
+
+import time
+
+import adafruit_logging as logging
+
+from packet import FIELD_NAMES
+
+# Index of each field in the table row of a topic.
+_FIELD_INDEX = {name: idx for idx, name in enumerate(FIELD_NAMES)}
+
+
+class WindowAggregator:  # pylint: disable=too-many-instance-attributes
+    """
+    Aggregates the readings of given topics in fixed time windows.
+    The window of a topic starts with its first reading and is closed by poll()
+    once the window duration elapsed.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, topics, window=60, suffix="/aggregate", raw=True, max_topics=16):
+        """
+        :param topics: iterable of MQTT topics to aggregate
+        :param window: window duration in seconds
+        :param suffix: suffix appended to the MQTT topic to publish the aggregates to
+        :param raw: whether to publish also the readings of the aggregated topics
+        :param max_topics: maximum number of aggregated topics, the table is preallocated
+        for this many topics
+        """
+        self._topics = set(topics)
+        self._window_ns = window * 1_000_000_000
+        self._suffix = suffix
+        self.raw = raw
+
+        width = len(FIELD_NAMES)
+        self._slots = {}  # MQTT topic to row of the table
+        self._slot_topics = [None] * max_topics
+        # monotonic_ns() of the first reading of the window
+        self._starts = [None] * max_topics
+        self._mins = [0] * (max_topics * width)
+        self._maxs = [0] * (max_topics * width)
+        self._sums = [0] * (max_topics * width)
+        self._counts = [0] * (max_topics * width)
+        # Schema to tuple of (index in table row, is float) for each of its fields.
+        self._layouts = {}
+
+        # Counters.
+        self.aggregated = 0
+        self.published = 0
+
+    def __contains__(self, topic):
+        return topic in self._topics
+
+    def _slot(self, topic):
+        """
+        :return: table row for the topic, None if the table is full
+        """
+        slot = self._slots.get(topic)
+        if slot is None:
+            if len(self._slots) == len(self._slot_topics):
+                logger = logging.getLogger("")
+                logger.warning(f"aggregation table full, not aggregating {topic}")
+                self._topics.discard(topic)
+                return None
+            slot = len(self._slots)
+            self._slots[topic] = slot
+            self._slot_topics[slot] = topic
+
+        return slot
+
+    def _layout(self, schema):
+        """
+        :return: table row indexes of the schema fields, computed on first use
+        """
+        layout = self._layouts.get(schema)
+        if layout is None:
+            layout = tuple(
+                (_FIELD_INDEX[name], is_float) for name, is_float in schema.fields
+            )
+            self._layouts[schema] = layout
+
+        return layout
+
+    def add(self, topic, schema, values):
+        """
+        Add reading to the running aggregates of the topic.
+        The values that were not measured (same as in Schema.to_dict()) are skipped.
+        :return: True if the reading was aggregated, False if the topic is not aggregated
+        """
+        if topic not in self._topics:
+            return False
+
+        slot = self._slot(topic)
+        if slot is None:
+            return False
+        if self._starts[slot] is None:
+            self._starts[slot] = time.monotonic_ns()
+
+        base = slot * len(FIELD_NAMES)
+        i = 0
+        for field_idx, is_float in self._layout(schema):
+            value = values[i]
+            i += 1
+            # NaN is the only value not equal to itself.
+            # pylint: disable=comparison-with-itself
+            if (is_float and value != value) or (not is_float and value == 0):
+                continue
+            idx = base + field_idx
+            if self._counts[idx] == 0:
+                self._mins[idx] = value
+                self._maxs[idx] = value
+                self._sums[idx] = value
+            else:
+                self._mins[idx] = min(self._mins[idx], value)
+                self._maxs[idx] = max(self._maxs[idx], value)
+                self._sums[idx] += value
+            self._counts[idx] += 1
+
+        self.aggregated += 1
+        return True
+
+    def _aggregates(self, slot, now):
+        """
+        :return: dictionary with the window duration and the aggregates of each field
+        """
+        data = {"window": (now - self._starts[slot]) // 1_000_000_000}
+        base = slot * len(FIELD_NAMES)
+        for field_idx, name in enumerate(FIELD_NAMES):
+            idx = base + field_idx
+            count = self._counts[idx]
+            if count == 0:
+                continue
+            data[name] = {
+                "min": self._mins[idx],
+                "max": self._maxs[idx],
+                "mean": self._sums[idx] / count,
+                "count": count,
+            }
+
+        return data
+
+    def _reset(self, slot):
+        """
+        Start new window of the topic.
+        """
+        base = slot * len(FIELD_NAMES)
+        for idx in range(base, base + len(FIELD_NAMES)):
+            self._counts[idx] = 0
+        self._starts[slot] = None
+
+    def poll(self, publish_func):
+        """
+        Close the windows that elapsed and publish their aggregates.
+        The window is reset only once publish_func returned, so that the aggregate
+        is not lost if it raises an exception.
+        :param publish_func: function accepting MQTT topic and dictionary with the aggregates
+        :return: number of published aggregates
+        """
+        now = time.monotonic_ns()
+        count = 0
+        for slot, start in enumerate(self._starts):
+            if start is None or now - start < self._window_ns:
+                continue
+            topic = self._slot_topics[slot]
+            publish_func(topic + self._suffix, self._aggregates(slot, now))
+            self._reset(slot)
+            count += 1
+
+        self.published += count
+        return count
@@ -0,0 +1,158 @@
+"""
+asyncio based main loop
+
+The radio reception, MQTT I/O, Neopixel blinking and watchdog feeding run as separate tasks
+that cooperate through the queue of readings and events, so that neither side
+waits for the other to finish its blocking timeout.
+"""
+
+import asyncio
+import time
+
+import adafruit_logging as logging
+
+from packetready import poll_packets
+from stats import COUNTER_LOOPS, STAGE_MQTT_LOOP, STAGE_RECEIVE
+
+
+class AsyncLoop:
+    """
+    Holds the tasks of the asyncio based main loop.
+    """
+
+    def __init__(
+        self,
+        receive_packets=poll_packets,
+        radio_poll_interval=0.01,
+        mqtt_loop_interval=1,
+        stats=None,
+    ):
+        """
+        :param receive_packets: function accepting RFM69 object and timeout,
+        returning iterable of received packets
+        :param radio_poll_interval: how long to sleep when there is no packet, in seconds
+        :param mqtt_loop_interval: how often to run the MQTT client loop (keep alive
+        handling), in seconds
+        :param stats: optional Stats object to record the durations of the stages
+        """
+        self._stats = stats
+        self._receive_packets = receive_packets
+        self._radio_poll_interval = radio_poll_interval
+        self._mqtt_loop_interval = mqtt_loop_interval
+
+        self._reading_event = asyncio.Event()
+        self._pixel_event = asyncio.Event()
+
+    async def radio_task(self, rfm69, handle_packet):
+        """
+        Poll the radio without blocking. Hand over each packet and wake up the other tasks.
+        :param rfm69: RFM69 object
+        :param handle_packet: function to decode and enqueue packet
+        """
+        while True:
+            received = False
+            start_ns = time.monotonic_ns()
+            for packet in self._receive_packets(rfm69, 0):
+                if not received and self._stats is not None:
+                    self._stats.record(STAGE_RECEIVE, start_ns)
+                handle_packet(packet)
+                received = True
+            if self._stats is not None:
+                self._stats.increment(COUNTER_LOOPS)
+            if not received:
+                await asyncio.sleep(self._radio_poll_interval)
+                continue
+
+            self._reading_event.set()
+            self._pixel_event.set()
+            await asyncio.sleep(0)
+
+    async def mqtt_task(self, mqtt_client, publish_stage):
+        """
+        Publish the readings as soon as they are queued,
+        run the MQTT client loop periodically.
+        While not connected, the loop (which takes the steps of establishing the connection)
+        runs as often as the radio is polled rather than once per the MQTT loop interval,
+        so that the connection and publishing of the readings queued meanwhile
+        are not delayed.
+        :param mqtt_client: MQTT client object or ConnectionSupervisor (with the loop()
+        and is_connected() methods)
+        :param publish_stage: function to publish the queued readings
+        """
+        mqtt_loop_stamp = None
+        while True:
+            connected = mqtt_client.is_connected()
+            if (
+                mqtt_loop_stamp is None
+                or not connected
+                or time.monotonic() - mqtt_loop_stamp >= self._mqtt_loop_interval
+            ):
+                start_ns = time.monotonic_ns()
+                mqtt_client.loop(0.1)
+                if self._stats is not None:
+                    self._stats.record(STAGE_MQTT_LOOP, start_ns)
+                mqtt_loop_stamp = time.monotonic()
+                connected = mqtt_client.is_connected()
+
+            publish_stage()
+
+            try:
+                await asyncio.wait_for(
+                    self._reading_event.wait(),
+                    (
+                        self._mqtt_loop_interval
+                        if connected
+                        else self._radio_poll_interval
+                    ),
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._reading_event.clear()
+
+    async def pixel_task(self, pixel_received, pixel_idle, interval=0.05):
+        """
+        Blink the Neopixel upon packet reception.
+        :param pixel_received: function to call when packet was received
+        :param pixel_idle: function to call periodically to finish the blink
+        :param interval: how often to call pixel_idle, in seconds
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._pixel_event.wait(), interval)
+                self._pixel_event.clear()
+                pixel_received()
+            except asyncio.TimeoutError:
+                pixel_idle()
+
+    @staticmethod
+    async def watchdog_task(watchdog, interval=1):
+        """
+        Feed the watchdog. If any of the other tasks blocks for too long,
+        the watchdog will not be fed.
+        """
+        while True:
+            watchdog.feed()
+            await asyncio.sleep(interval)
+
+    async def run(self, watchdog, rfm69, mqtt_client, stages, pixel_funcs=None):
+        """
+        Run the tasks until one of them fails.
+        :param watchdog: watchdog object
+        :param rfm69: RFM69 object
+        :param mqtt_client: MQTT client object or ConnectionSupervisor (with the loop() method)
+        :param stages: tuple of functions handling received packet and publishing readings
+        :param pixel_funcs: optional tuple of functions for Neopixel reception and idle
+        """
+        logger = logging.getLogger("")
+
+        handle_packet, publish_stage = stages
+        tasks = [
+            asyncio.create_task(self.watchdog_task(watchdog)),
+            asyncio.create_task(self.radio_task(rfm69, handle_packet)),
+            asyncio.create_task(self.mqtt_task(mqtt_client, publish_stage)),
+        ]
+        if pixel_funcs is not None:
+            tasks.append(asyncio.create_task(self.pixel_task(*pixel_funcs)))
+
+        logger.info(f"Running {len(tasks)} asyncio tasks")
+        await asyncio.gather(*tasks)
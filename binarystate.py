@@ -8,6 +8,8 @@ import time
 
 import adafruit_logging as logging
 
+from logutil import debug_enabled
+
 
 class BinaryState:
     """
@@ -25,23 +27,27 @@ class BinaryState:
         self.cur_state = None  # opaque current state
         self.state_duration = 0  # duration of current state in milliseconds
         self.stamp = time.monotonic_ns()  # use _ns() to avoid losing precision
+        self._logger = logging.getLogger(__name__)
 
     def update(self, cur_state) -> float:
         """
         :param cur_state: current state
         :return: duration of the state in milliseconds
         """
-        logger = logging.getLogger(__name__)
+        logger = self._logger
+        debug_level = debug_enabled(logger)
 
         # Record the duration.
         if self.cur_state is not None:
             if self.cur_state == cur_state:
                 self.state_duration += (time.monotonic_ns() - self.stamp) // 1_000_000
-                logger.debug(
-                    f"state '{cur_state}' preserved (for {self.state_duration} msec)"
-                )
+                if debug_level:
+                    logger.debug(
+                        f"state '{cur_state}' preserved (for {self.state_duration} msec)"
+                    )
             else:
-                logger.debug(f"state changed {self.cur_state} -> {cur_state}")
+                if debug_level:
+                    logger.debug(f"state changed {self.cur_state} -> {cur_state}")
                 self.state_duration = 0
 
         self.cur_state = cur_state
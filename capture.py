@@ -0,0 +1,168 @@
+"""
+Capture of the received packets
+
+The raw packets are appended, together with the monotonic timestamp and RSSI
+of their reception, to a buffer of length-prefixed records. The buffer is periodically
+written to a file on the flash or published to MQTT capture topic.
+The captures can be replayed on a host computer with tools/replay.py.
+
+The capture is a sequence of records, in the file preceded by the magic.
+Each record consists of (big-endian):
+  - length of the packet (1 byte)
+  - monotonic timestamp in milliseconds, modulo 2**32 (4 bytes)
+  - RSSI in units of 0.5 dBm (signed, 2 bytes)
+  - the packet
+"""
+
+import os
+import struct
+import time
+
+import adafruit_logging as logging
+
+from spool import remount
+
+MAGIC = b"R2MC"
+RECORD_HEADER_FMT = ">BIh"
+RECORD_HEADER_LEN = struct.calcsize(RECORD_HEADER_FMT)
+
+
+def iter_records(capture):
+    """
+    Generator yielding the records of a capture.
+    :param capture: the capture (bytes), possibly concatenated from multiple captures
+    :return: tuples of timestamp in milliseconds, RSSI and the packet (memoryview)
+    Raises ValueError if the capture is truncated.
+    """
+    view = memoryview(capture)
+    offset = 0
+    while offset < len(view):
+        if view[offset : offset + len(MAGIC)] == MAGIC:
+            offset += len(MAGIC)
+            continue
+        if offset + RECORD_HEADER_LEN > len(view):
+            raise ValueError(f"truncated record header at offset {offset}")
+        length, stamp_ms, rssi = struct.unpack_from(RECORD_HEADER_FMT, view, offset)
+        offset += RECORD_HEADER_LEN
+        if offset + length > len(view):
+            raise ValueError(f"truncated packet at offset {offset}")
+        yield stamp_ms, rssi / 2, view[offset : offset + length]
+        offset += length
+
+
+class PacketCapture:  # pylint: disable=too-many-instance-attributes
+    """
+    Preallocated buffer of capture records, handed over to the write function
+    when full or when the interval elapses. If the write function fails,
+    the records are kept and the new records are dropped once the buffer is full.
+    """
+
+    def __init__(self, write_func, size=512, interval=5):
+        """
+        :param write_func: function accepting the records (memoryview),
+        returning True if they were written
+        :param size: size of the buffer in bytes
+        :param interval: maximum time the records are kept in the buffer, in seconds
+        """
+        self._write_func = write_func
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._len = 0
+        self._interval = interval
+        self._stamp = time.monotonic()
+
+        # Counters.
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0  # bytes
+
+    def add(self, packet, rssi):
+        """
+        Append record of received packet.
+        :param packet: the packet
+        :param rssi: RSSI of the packet
+        """
+        record_len = RECORD_HEADER_LEN + len(packet)
+        if self._len + record_len > len(self._buf):
+            self.flush()
+            if self._len + record_len > len(self._buf):
+                self.dropped += 1
+                return
+
+        struct.pack_into(
+            RECORD_HEADER_FMT,
+            self._buf,
+            self._len,
+            len(packet),
+            (time.monotonic_ns() // 1_000_000) & 0xFFFFFFFF,
+            round(rssi * 2),
+        )
+        self._len += RECORD_HEADER_LEN
+        self._view[self._len : self._len + len(packet)] = packet
+        self._len += len(packet)
+        self.captured += 1
+
+    def poll(self):
+        """
+        Write the records if the interval elapsed.
+        """
+        if self._len > 0 and time.monotonic() - self._stamp >= self._interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the records.
+        """
+        self._stamp = time.monotonic()
+        if self._len == 0:
+            return
+
+        if self._write_func(self._view[: self._len]):
+            self.written += self._len
+            self._len = 0
+
+
+class CaptureFile:  # pylint: disable=too-few-public-methods
+    """
+    Write function of PacketCapture appending to a file on the flash.
+    The file system is remounted for writing only for the duration of the writes,
+    same as in spool.py.
+    """
+
+    def __init__(self, path, max_size=65536):
+        """
+        :param path: path of the capture file
+        :param max_size: maximum size of the file in bytes, the capture stops once reached
+        """
+        self._path = path
+        self._max_size = max_size
+        try:
+            self._size = os.stat(path)[6]
+        except OSError:
+            self._size = 0
+
+    def __call__(self, data):
+        """
+        Append the records to the file.
+        :return: True if written
+        """
+        logger = logging.getLogger("")
+
+        header = MAGIC if self._size == 0 else b""
+        if self._size + len(header) + len(data) > self._max_size:
+            return False
+
+        try:
+            remount(False)  # writeable by CircuitPython
+            try:
+                with open(self._path, "ab") as file_obj:
+                    file_obj.write(header)
+                    file_obj.write(data)
+            finally:
+                remount(True)  # writeable by USB host
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"failed to write to the capture {self._path}: {e}")
+            return False
+
+        self._size += len(header) + len(data)
+        return True
@@ -3,39 +3,102 @@ Receive packets over radio using RFM69 and if they fit certain form,
 replay their content to a MQTT topic to specified MQTT broker.
 
 Assumes Adafruit Feather ESP32 V2 and certain wiring of 433 MHz Radio FeatherWing.
+The gateway loop itself is in gateway.py, this is the entry point on the microcontroller.
 """
 
-import json
-import math
-import struct
 import time
+
+# Start of the boot, for the boot milestones in the statistics.
+BOOT_NS = time.monotonic_ns()
+
+# pylint: disable=wrong-import-position
 import traceback
 
-import adafruit_logging as logging
-import adafruit_rfm69
 import board
-import busio
-import digitalio
 import microcontroller
-import neopixel
-
-# pylint: disable=import-error
-import socketpool
 
 # pylint: disable=import-error
 import supervisor
-import wifi
 
 # pylint: disable=no-name-in-module
 from microcontroller import watchdog
-from watchdog import WatchDogMode, WatchDogTimeout
-
-from binarystate import BinaryState
-from confchecks import check_bytes, check_int, check_list, check_string
-from hexdump import Hexdump
-from logutil import get_log_level
-from mqtt import mqtt_client_setup
-from mqtt_handler import MQTTHandler
+from watchdog import WatchDogTimeout
+
+import gateway
+from confchecks import (
+    bail,
+    check_bool,
+    check_bytes,
+    check_choice,
+    check_dict,
+    check_int,
+    check_list,
+    check_string,
+)
+from devicehal import DeviceHardware
+from packet import FIELD_NAMES
+from ratelimit import POLICIES as RATE_LIMIT_POLICIES
+from ringbuffer import COALESCE, OVERFLOW_POLICIES
+from topicacl import TopicACL
+from tunables import (
+    AGGREGATE_RAW,
+    AGGREGATE_SUFFIX,
+    AGGREGATE_TOPICS,
+    AGGREGATE_WINDOW,
+    ALLOWED_TOPICS,
+    BATCH_PUBLISH,
+    BROKER,
+    BROKER_PORT,
+    CAPTURE_INTERVAL,
+    CAPTURE_MAX_SIZE,
+    CAPTURE_PATH,
+    CAPTURE_TOPIC,
+    COORDINATION_TOPIC,
+    DEADBAND_HEARTBEAT,
+    DEADBANDS,
+    DEDUP_SIZE,
+    DEDUP_TTL,
+    DIO0_PIN,
+    ENCRYPTION_KEY,
+    GATEWAY_ID,
+    INFLIGHT_WINDOW,
+    LINK_STATS_SIZE,
+    LOG_BUFFER_SIZE,
+    LOG_FLUSH_INTERVAL,
+    LOG_LEVEL,
+    LOG_TOPIC,
+    MQTT_QOS,
+    NODE_ADDRESS,
+    PASSWORD,
+    PUBLISH_BUDGET,
+    QUEUE_OVERFLOW,
+    QUEUE_SIZE,
+    RATE_LIMIT,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_POLICY,
+    RATE_LIMITS,
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_MAX_FAILURES,
+    RETRANSMIT_TIMEOUT,
+    SPOOL_PATH,
+    SPOOL_REPLAY_BATCH,
+    SPOOL_REPLAY_INTERVAL,
+    SPOOL_SLOTS,
+    SSID,
+    STATS_INTERVAL,
+    STATS_TOPIC,
+    TOPIC_IDS,
+    USE_ASYNCIO,
+    WARM_START,
+)
+from warmstart import (
+    RESET_CONNECTION,
+    RESET_MEMORY,
+    RESET_RELOAD,
+    RESET_WATCHDOG,
+    WarmStart,
+    config_key,
+)
 
 try:
     from secrets import secrets
@@ -46,36 +109,70 @@ except ImportError:
     raise
 
 
-BROKER_PORT = "broker_port"
-LOG_TOPIC = "log_topic"
-BROKER = "broker"
-PASSWORD = "password"
-SSID = "ssid"
-LOG_LEVEL = "log_level"
-ENCRYPTION_KEY = "encryption_key"
-ALLOWED_TOPICS = "allowed_topics"
-
-
-class PacketDecodingError(Exception):
+def check_reading_tunables(topic_acl):
     """
-    Exception raised when a packet cannot be decoded.
+    Check the tunables of the per topic processing of the readings.
+    Will exit the program on error.
+    :param topic_acl: TopicACL with the allowed topics
     """
-
-
-def blink(pixel):
+    check_dict(DEADBANDS, str, dict, mandatory=False)
+    for topic, bands in secrets.get(DEADBANDS, {}).items():
+        if not topic_acl.is_allowed(topic):
+            bail(f"topic with deadbands is not allowed: {topic}")
+        for field_name, band in bands.items():
+            if field_name not in FIELD_NAMES:
+                bail(f"unknown field in {DEADBANDS} for {topic}: {field_name}")
+            if not isinstance(band, (int, float)) or band < 0:
+                bail(f"invalid deadband for {field_name} of {topic}: {band}")
+    check_int(DEADBAND_HEARTBEAT, mandatory=False, min_val=1, max_val=86400)
+
+    check_list(AGGREGATE_TOPICS, str, mandatory=False)
+    for topic in secrets.get(AGGREGATE_TOPICS, []):
+        if not topic_acl.is_allowed(topic):
+            bail(f"topic to aggregate is not allowed: {topic}")
+    check_int(AGGREGATE_WINDOW, mandatory=False, min_val=1, max_val=86400)
+    check_string(AGGREGATE_SUFFIX, mandatory=False)
+    check_bool(AGGREGATE_RAW, mandatory=False)
+
+    check_int(RATE_LIMIT, mandatory=False, min_val=1, max_val=60000)
+    check_dict(RATE_LIMITS, str, int, mandatory=False)
+    for topic, rate in secrets.get(RATE_LIMITS, {}).items():
+        if not topic_acl.is_allowed(topic):
+            bail(f"topic with rate limit is not allowed: {topic}")
+        if not 1 <= rate <= 60000:
+            bail(f"rate limit of {topic} not within 1,60000: {rate}")
+    check_int(RATE_LIMIT_BURST, mandatory=False, min_val=1, max_val=100)
+    check_choice(RATE_LIMIT_POLICY, RATE_LIMIT_POLICIES, mandatory=False)
+
+
+def check_storage_tunables():
     """
-    Blink the Neo pixel blue.
+    Check the tunables of the packet capture and the spool.
+    Will exit the program on error.
     """
-    pixel.brightness = 0.3
-    pixel.fill((0, 0, 255))
-    time.sleep(0.5)
-    pixel.brightness = 0
+    check_string(CAPTURE_PATH, mandatory=False)
+    check_string(CAPTURE_TOPIC, mandatory=False)
+    if secrets.get(CAPTURE_PATH) and secrets.get(CAPTURE_TOPIC):
+        bail(f"only one of {CAPTURE_PATH} and {CAPTURE_TOPIC} can be set")
+    check_int(CAPTURE_MAX_SIZE, mandatory=False, min_val=1024)
+    check_int(CAPTURE_INTERVAL, mandatory=False, min_val=1, max_val=3600)
+
+    check_string(SPOOL_PATH, mandatory=False)
+    check_int(SPOOL_SLOTS, mandatory=False, min_val=1, max_val=65535)
+    check_int(SPOOL_REPLAY_BATCH, mandatory=False, min_val=1, max_val=100)
+    check_int(SPOOL_REPLAY_INTERVAL, mandatory=False, min_val=1, max_val=3600)
+    # The replayed batch has to fit the in-flight window.
+    if secrets.get(MQTT_QOS, 0) == 1 and secrets.get(
+        SPOOL_REPLAY_BATCH, 10
+    ) > secrets.get(INFLIGHT_WINDOW, 16):
+        bail(f"{SPOOL_REPLAY_BATCH} cannot be bigger than {INFLIGHT_WINDOW}")
 
 
 def check_tunables():
     """
     Check that tunables are present and of correct type.
     Will exit the program on error.
+    :return: TopicACL compiled from the allowed topics
     """
     check_string(LOG_LEVEL)
 
@@ -86,215 +183,105 @@ def check_tunables():
     check_string(PASSWORD)
     check_string(BROKER)
     check_string(LOG_TOPIC, mandatory=False)
+    check_int(LOG_BUFFER_SIZE, mandatory=False, min_val=1, max_val=256)
+    check_int(LOG_FLUSH_INTERVAL, mandatory=False, min_val=1, max_val=3600)
+    check_string(STATS_TOPIC, mandatory=False)
+    check_string(COORDINATION_TOPIC, mandatory=False)
+    check_string(GATEWAY_ID, mandatory=False)
+    check_int(STATS_INTERVAL, mandatory=False, min_val=1, max_val=86400)
     check_int(BROKER_PORT, min_val=0, max_val=65535)
+    check_int(RECONNECT_BACKOFF_MAX, mandatory=False, min_val=1, max_val=3600)
+    check_int(RECONNECT_MAX_FAILURES, mandatory=False, min_val=1, max_val=1000)
 
     check_list(ALLOWED_TOPICS, str)
+    try:
+        topic_acl = TopicACL(secrets[ALLOWED_TOPICS])
+    except ValueError as e:
+        bail(f"invalid value of {ALLOWED_TOPICS}: {e}")
+
+    check_dict(TOPIC_IDS, int, str, mandatory=False)
+    for topic_id, topic in secrets.get(TOPIC_IDS, {}).items():
+        if not 0 <= topic_id <= 65535:
+            bail(f"topic ID not within 0,65535: {topic_id}")
+        if not topic_acl.is_allowed(topic):
+            bail(f"topic for topic ID {topic_id} is not allowed: {topic}")
+
+    check_choice(BATCH_PUBLISH, ("records", "array"), mandatory=False)
+
+    check_reading_tunables(topic_acl)
+
+    check_int(QUEUE_SIZE, mandatory=False, min_val=1, max_val=1024)
+    check_choice(QUEUE_OVERFLOW, OVERFLOW_POLICIES, mandatory=False)
+    # All the receptions are published to the same topic so they cannot be coalesced.
+    if secrets.get(COORDINATION_TOPIC) and secrets.get(QUEUE_OVERFLOW) == COALESCE:
+        bail(f"{QUEUE_OVERFLOW} cannot be {COALESCE} with {COORDINATION_TOPIC}")
+    check_int(PUBLISH_BUDGET, mandatory=False, min_val=1, max_val=3000)
+    check_int(MQTT_QOS, mandatory=False, min_val=0, max_val=1)
+    check_int(INFLIGHT_WINDOW, mandatory=False, min_val=1, max_val=64)
+    check_int(RETRANSMIT_TIMEOUT, mandatory=False, min_val=1, max_val=60)
+    check_int(DEDUP_SIZE, mandatory=False, min_val=0, max_val=256)
+    check_int(DEDUP_TTL, mandatory=False, min_val=1, max_val=60000)
+    check_int(LINK_STATS_SIZE, mandatory=False, min_val=0, max_val=256)
+
+    check_bool(USE_ASYNCIO, mandatory=False)
+    check_bool(WARM_START, mandatory=False)
+    check_int(NODE_ADDRESS, mandatory=False, min_val=0, max_val=254)
+    check_string(DIO0_PIN, mandatory=False)
+    if secrets.get(DIO0_PIN) and not hasattr(board, secrets[DIO0_PIN]):
+        bail(f"no such pin for {DIO0_PIN}: {secrets[DIO0_PIN]}")
+
+    check_storage_tunables()
 
     check_bytes(ENCRYPTION_KEY, 16, mandatory=False)
 
+    return topic_acl
 
-# pylint: disable=too-many-locals,too-many-statements
-def main():
+
+def get_warm_start():
     """
-    main loop: collect messages via radio, decode and publish to MQTT
+    :return: WarmStart object backed by the non-volatile memory, None if disabled
     """
+    if not secrets.get(WARM_START, True):
+        return None
+
+    key = config_key(secrets.get(SSID), secrets.get(BROKER), secrets.get(BROKER_PORT))
+    return WarmStart(microcontroller.nvm, key)  # pylint: disable=no-member
+
 
-    check_tunables()
-
-    log_level = get_log_level(secrets[LOG_LEVEL])
-    logger = logging.getLogger("")
-    logger.setLevel(log_level)
-
-    # The initialization code below should not take long and the endless loop is quite tight,
-    # so 5 seconds should be more than enough.
-    watchdog.timeout = 5
-    watchdog.mode = WatchDogMode.RAISE
-
-    logger.info("Running")
-
-    # Assumes certain wiring of the Radio FeatherWing.
-    cs = digitalio.DigitalInOut(board.D5)
-    reset = digitalio.DigitalInOut(board.D6)
-
-    spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
-
-    rfm69 = adafruit_rfm69.RFM69(spi, cs, reset, 433)  # Europe
-
-    encryption_key = secrets.get(ENCRYPTION_KEY)
-    if encryption_key:
-        logger.debug("Setting encryption key")
-        rfm69.encryption_key = encryption_key
-
-    mqtt_client = get_mqtt_client()
-
-    logger.debug(f"allowed topics: {secrets.get(ALLOWED_TOPICS)}")
-
-    logger.info(f"Temperature: {rfm69.temperature}C")
-    logger.info(f"Frequency: {rfm69.frequency_mhz}mhz")
-    logger.info(f"Bit rate: {rfm69.bitrate / 1000}kbit/s")
-    logger.info(f"Frequency deviation: {rfm69.frequency_deviation}hz")
-
-    # The Neopixel will blink only then logging level is set to DEBUG however initialize it anyway.
-    pixel = neopixel.NeoPixel(board.NEOPIXEL, 1)
-    pixel.brightness = 0
-    pixel_state = BinaryState()
-    pixel_state.update("off")
-
-    # Assumes tight loop below. The value is approximate. If there is high frequency of packets
-    # (i.e. more frequent than this delay), the blinking will degrade into solid light.
-    pixel_blink_delay = 300  # in milliseconds
-
-    # Wait to receive packets.  Note that this library can't receive data at a fast
-    # rate, in fact it can only receive and process one 60 byte packet at a time.
-    # This means you should only use this for low bandwidth scenarios, like sending
-    # and receiving a single message at a time.
-    logger.info("Waiting for packets...")
-    while True:
-        watchdog.feed()
-
-        mqtt_client.loop(0.1)
-
-        packet = rfm69.receive(timeout=0.1)
-        if packet is None:
-            if logger.getEffectiveLevel() == logging.DEBUG:  # pylint: disable=no-member
-                if pixel_state.cur_state == "on":
-                    # Finish the blink if the Neopixel is on.
-                    on_ms = pixel_state.update("on")
-                    logger.debug(f"neopixel has been on for {on_ms} ms")
-                    if on_ms > pixel_blink_delay:
-                        logger.debug("turning the neopixel off")
-                        pixel.brightness = 0
-                        pixel_state.update("off")
-
-            continue
-
-        # See the strength of the radio signal being received.
-        # This is updated when packets are received and returns a value in decibels
-        # (typically negative, so the smaller the number and closer to 0,
-        # the higher the strength / better the signal).
-        logger.debug(f"RSSI: {rfm69.last_rssi}")
-
-        logger.debug(f"Received packet of {len(packet)} bytes:\n{Hexdump(packet)}")
-
-        if logger.getEffectiveLevel() == logging.DEBUG:  # pylint: disable=no-member
-            on_ms = pixel_state.update("on")
-            logger.debug(f"neopixel has been on for {on_ms} ms")
-            if on_ms < pixel_blink_delay:
-                logger.debug("turning the neopixel on")
-                pixel.brightness = 1
-                pixel.fill((0, 0, 255))
-            else:
-                logger.debug("turning the neopixel off")
-                pixel.brightness = 0
-                pixel_state.update("off")
-
-        try:
-            mqtt_topic, pub_data_dict = decode_packet(packet)
-        except PacketDecodingError as packet_exc:
-            logger.warning(str(packet_exc))
-            continue
-        try:
-            pub_data = json.dumps(pub_data_dict)
-        except TypeError:
-            logger.warning(f"failed to convert to JSON: {pub_data_dict}")
-            continue
-
-        logger.info(f"Publishing to {mqtt_topic}: {pub_data}")
-        mqtt_client.publish(mqtt_topic, pub_data)
-
-
-def decode_packet(packet):
+def count_reset(cause):
     """
-    Decode packet, return MQTT topic and dictionary of items.
-    Raises PacketDecodingError on error.
+    Record the cause of the reset that is about to be performed, if enabled.
     """
-    logger = logging.getLogger("")
+    warm_start = get_warm_start()
+    if warm_start is not None:
+        warm_start.count_reset(cause)
 
-    mqtt_prefix = "MQTT:"
-    max_mqtt_topic_len = 32
-    fmt = f">{len(mqtt_prefix)}s{max_mqtt_topic_len}sffIff"
-    if struct.calcsize(fmt) > 60:
-        logger.warning("the format for structure packing is bigger than 60 bytes")
-    try:
-        data = struct.unpack(fmt, packet)
-    except RuntimeError as e:
-        raise PacketDecodingError("failed to unpack data") from e
-    if len(data) != 7:
-        raise PacketDecodingError(f"invalid data: {data}")
-    try:
-        prefix = data[0].decode("ascii")
-    except UnicodeError as unicode_exc:
-        raise PacketDecodingError(f"failed to decode data: {data}") from unicode_exc
-    if prefix != mqtt_prefix:
-        raise PacketDecodingError(f"not a MQTT prefix: {prefix}")
-
-    mqtt_topic = data[1].decode("ascii")
-    nul_idx = mqtt_topic.find("\x00")
-    if nul_idx > 0:
-        mqtt_topic = mqtt_topic[:nul_idx]
-    logger.debug(f"MQTT topic: {mqtt_topic}")
-    if mqtt_topic not in secrets.get(ALLOWED_TOPICS):
-        raise PacketDecodingError(f"not allowed topic: '{mqtt_topic}'")
-
-    data = data[2:]
-
-    pub_data_dict = {}
-    if not math.isnan(data[0]):
-        pub_data_dict["humidity"] = data[0]
-    if not math.isnan(data[1]):
-        pub_data_dict["temperature"] = data[1]
-    if data[2] != 0:
-        pub_data_dict["co2_ppm"] = data[2]
-    if not math.isnan(data[3]):
-        pub_data_dict["battery_level"] = data[3]
-    if not math.isnan(data[4]):
-        pub_data_dict["lux"] = data[4]
-
-    return mqtt_topic, pub_data_dict
-
-
-def get_mqtt_client():
+
+def main():
     """
-    Connect to Wi-Fi and initialize MQTT client
+    Check the tunables and run the gateway loop on the microcontroller.
     """
-    logger = logging.getLogger("")
-
-    logger.info("Connecting to wifi")
-    wifi.radio.connect(secrets[SSID], secrets[PASSWORD], timeout=10)
-    logger.info(f"Connected to {secrets['ssid']}")
-    logger.debug(f"IP: {wifi.radio.ipv4_address}")
+    topic_acl = check_tunables()
 
-    pool = socketpool.SocketPool(wifi.radio)  # pylint: disable=no-member
+    warm_start = get_warm_start()
+    if warm_start is not None:
+        warm_start.count_boot()
 
-    broker_addr = secrets[BROKER]
-    broker_port = secrets[BROKER_PORT]
-    mqtt_client = mqtt_client_setup(
-        pool, broker_addr, broker_port, logger.getEffectiveLevel(), socket_timeout=0.1
+    gateway.run(
+        DeviceHardware(secrets[SSID], secrets[PASSWORD], warm_start=warm_start),
+        secrets,
+        topic_acl,
+        boot_ns=BOOT_NS,
     )
 
-    try:
-        log_topic = secrets[LOG_TOPIC]
-        # Log both to the console and via MQTT messages.
-        # Up to now the logger was using the default (built-in) handler,
-        # now it is necessary to add the Stream handler explicitly as
-        # with a non-default handler set only the non-default handlers will be used.
-        logger.addHandler(logging.StreamHandler())
-        logger.addHandler(MQTTHandler(mqtt_client, log_topic))
-    except KeyError:
-        pass
-
-    logger.info(f"Attempting to connect to MQTT broker {broker_addr}:{broker_port}")
-    mqtt_client.connect()
-
-    return mqtt_client
-
 
-def hard_reset(exception):
+def hard_reset(exception, cause):
     """
     Sometimes soft reset is not enough. Perform hard reset.
     """
     watchdog.mode = None
     print(f"Got exception: {exception}")
+    count_reset(cause)
     reset_time = 15
     print(f"Performing hard reset in {reset_time} seconds")
     time.sleep(reset_time)
@@ -306,14 +293,14 @@ try:
 except ConnectionError as e:
     # When this happens, it usually means that the microcontroller's wifi/networking is botched.
     # The only way to recover is to perform hard reset.
-    hard_reset(e)
+    hard_reset(e, RESET_CONNECTION)
 except MemoryError as e:
     # This is usually the case of delayed exception from the 'import wifi' statement,
     # possibly caused by a bug (resource leak) in CircuitPython that manifests
     # after a sequence of ConnectionError exceptions thrown from withing the wifi module.
     # Should not happen given the above 'except ConnectionError',
     # however adding that here just in case.
-    hard_reset(e)
+    hard_reset(e, RESET_MEMORY)
 except Exception as e:  # pylint: disable=broad-except
     # This assumes that such exceptions are quite rare.
     # Otherwise, this would drain the battery quickly by restarting
@@ -321,9 +308,10 @@ except Exception as e:  # pylint: disable=broad-except
     watchdog.mode = None
     print("Code stopped by unhandled exception:")
     print(traceback.format_exception(None, e, e.__traceback__))
+    count_reset(RESET_RELOAD)
     RELOAD_TIME = 10
     print(f"Performing a supervisor reload in {RELOAD_TIME} seconds")
     time.sleep(RELOAD_TIME)
     supervisor.reload()
 except WatchDogTimeout as e:
-    hard_reset(e)
+    hard_reset(e, RESET_WATCHDOG)
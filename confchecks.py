@@ -33,21 +33,48 @@ def check_string(name, mandatory=True):
         bail(f"not a string value for {name}: {value}")
 
 
-def check_int(name, mandatory=True, min_val=None, max_val=None):
+def check_bool(name, mandatory=True):
     """
-    Check is integer with given name is present in secrets.
+    Check is boolean with given name is present in secrets.
     """
     value = secrets.get(name)
     if value is None and mandatory:
         bail(f"{name} is missing")
 
-    if value and not isinstance(value, int):
+    if value is not None and not isinstance(value, bool):
+        bail(f"not a boolean value for {name}: {value}")
+
+
+def check_int(name, mandatory=True, min_val=None, max_val=None):
+    """
+    Check is integer with given name is present in secrets.
+    """
+    value = secrets.get(name)
+    if value is None:
+        if mandatory:
+            bail(f"{name} is missing")
+        return
+
+    if not isinstance(value, int):
         bail(f"not a integer value for {name}: {value}")
 
-    if value < min_val or value > max_val:
+    if (min_val is not None and value < min_val) or (
+        max_val is not None and value > max_val
+    ):
         bail(f"{name} value not within {min_val},{max_val}: {value}")
 
 
+def check_choice(name, choices, mandatory=True):
+    """
+    Check whether string with given name is present in secrets and is one of the choices.
+    """
+    check_string(name, mandatory=mandatory)
+
+    value = secrets.get(name)
+    if value is not None and value not in choices:
+        bail(f"{name} has to be one of {choices}: {value}")
+
+
 def check_list(name, subtype, mandatory=True):
     """
     Check whether list with given name is present in secrets.
@@ -64,6 +91,27 @@ def check_list(name, subtype, mandatory=True):
             bail(f"not a {subtype}: {item}")
 
 
+def check_dict(name, key_type, value_type, mandatory=True):
+    """
+    Check whether dictionary with given name is present in secrets
+    and its keys and values are of given types.
+    """
+    value = secrets.get(name)
+    if value is None:
+        if mandatory:
+            bail(f"{name} is missing")
+        return
+
+    if not isinstance(value, dict):
+        bail(f"not a dictionary value for {name}: {value}")
+
+    for key, item in value.items():
+        if not isinstance(key, key_type):
+            bail(f"not a {key_type} key in {name}: {key}")
+        if not isinstance(item, value_type):
+            bail(f"not a {value_type} value in {name}: {item}")
+
+
 def check_bytes(name, length, mandatory=True):
     """
     Check is bytes with given name is present in secrets.
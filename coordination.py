@@ -0,0 +1,139 @@
+"""
+Coordination of multiple gateways
+
+In the multi-gateway deployment, each gateway publishes the raw receptions together with
+their RSSI to shared coordination topic instead of decoding them. The selection stage
+(see tools/coordinator.py) keeps only the copy with the best RSSI of each packet
+received within a short window, and decodes and publishes that one.
+"""
+
+import binascii
+import json
+import time
+
+from dedup import DedupCache, packet_key
+
+
+def reception_payload(gateway, rssi, packet):
+    """
+    :param gateway: gateway identifier
+    :param rssi: RSSI of the packet
+    :param packet: raw packet
+    :return: JSON payload (bytes) describing the reception
+    """
+    packet_hex = str(binascii.hexlify(packet), "ascii")
+    return json.dumps({"gateway": gateway, "rssi": rssi, "packet": packet_hex}).encode(
+        "utf-8"
+    )
+
+
+def parse_reception(payload):
+    """
+    :param payload: JSON payload produced by reception_payload()
+    :return: tuple of gateway identifier, RSSI and the raw packet
+    Raises ValueError if the payload is not valid.
+    """
+    try:
+        data = json.loads(payload)
+        return data["gateway"], data["rssi"], binascii.unhexlify(data["packet"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid reception: {e}") from e
+
+
+class BestRssiSelector:  # pylint: disable=too-many-instance-attributes
+    """
+    Selects the copy with the best RSSI of each packet received by multiple gateways.
+
+    The window of a packet starts with its first copy. Once it elapses, the best copy
+    is selected. The copies arriving later (within the TTL of the recently selected packets)
+    are dropped.
+    """
+
+    def __init__(self, window_ms=200, size=32, ttl_ms=2000):
+        """
+        :param window_ms: how long to wait for the copies of a packet, in milliseconds
+        :param size: maximum number of packets waiting for the selection
+        :param ttl_ms: how long to remember the selected packets, in milliseconds
+        """
+        self._window_ns = window_ms * 1_000_000
+        self._keys = [None] * size
+        self._starts = [0] * size  # monotonic_ns() of the first copy
+        self._receptions = [None] * size  # the best copy as (gateway, RSSI, packet)
+        # The selected packets are remembered for longer than the window
+        # so there has to be more of them.
+        self._seen = DedupCache(size * 4, ttl_ms)
+
+        # Counters.
+        self.offered = 0
+        self.selected = 0
+        self.dropped = 0
+
+    def offer(self, gateway, rssi, packet):
+        """
+        Add reception of a packet.
+        :param gateway: gateway identifier
+        :param rssi: RSSI of the packet
+        :param packet: raw packet
+        :return: reception (gateway, RSSI, packet) that had to be selected early
+        because there was no room, None otherwise
+        """
+        self.offered += 1
+        key = packet_key(packet)
+
+        for idx, pending_key in enumerate(self._keys):
+            if pending_key == key:
+                if rssi > self._receptions[idx][1]:
+                    self._receptions[idx] = (gateway, rssi, packet)
+                self.dropped += 1
+                return None
+
+        if self._seen.is_duplicate(key):
+            # Late copy of already selected packet.
+            self.dropped += 1
+            return None
+
+        early = None
+        idx = self._free_slot()
+        if idx is None:
+            idx = min(range(len(self._keys)), key=lambda i: self._starts[i])
+            early = self._select(idx)
+        self._keys[idx] = key
+        self._starts[idx] = time.monotonic_ns()
+        self._receptions[idx] = (gateway, rssi, packet)
+
+        return early
+
+    def _free_slot(self):
+        """
+        :return: index of unused slot, None if there is none
+        """
+        for idx, key in enumerate(self._keys):
+            if key is None:
+                return idx
+
+        return None
+
+    def _select(self, idx):
+        """
+        Release the slot.
+        :return: the best reception of the packet
+        """
+        reception = self._receptions[idx]
+        self._keys[idx] = None
+        self._receptions[idx] = None
+        self.selected += 1
+
+        return reception
+
+    def poll(self):
+        """
+        :return: list of the best receptions (gateway, RSSI, packet) of the packets
+        whose window elapsed
+        """
+        now = time.monotonic_ns()
+        selected = []
+        for idx, key in enumerate(self._keys):
+            if key is not None and now - self._starts[idx] >= self._window_ns:
+                selected.append(self._select(idx))
+
+        return selected
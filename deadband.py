@@ -0,0 +1,110 @@
+"""
+Report-by-exception filtering of readings
+
+Reading for a topic is published only if one of its fields moved beyond the configured
+deadband since the last published reading or if the heartbeat interval expired.
+The reading becomes the last published one only once it is queued for publishing
+(see commit()) so that the reading dropped later on (by rate limiting or because the queue
+is full) does not suppress the following readings.
+"""
+
+import time
+
+
+class DeadbandFilter:  # pylint: disable=too-few-public-methods
+    """
+    Keeps the last published values for each topic with deadband configuration.
+    """
+
+    def __init__(self, deadbands, heartbeat=300):
+        """
+        :param deadbands: dictionary of MQTT topic to dictionary of field name to deadband,
+        i.e. minimal absolute change of the value. The fields without deadband
+        do not trigger publishing. The topics without deadbands are always published.
+        :param heartbeat: maximum interval between published readings of a topic, in seconds
+        """
+        self._deadbands = deadbands
+        self._heartbeat_ns = heartbeat * 1_000_000_000
+        # (topic, Schema) to tuple of deadbands for the schema fields (None for no deadband)
+        self._bands = {}
+        # topic to list of Schema, values and monotonic_ns() of the last published reading
+        self._last = {}
+
+        # Counters of readings.
+        self.passed = 0
+        self.suppressed = 0
+
+    def _schema_bands(self, topic, schema):
+        """
+        :return: deadbands aligned with the schema fields, computed on first use
+        """
+        key = (topic, schema)
+        bands = self._bands.get(key)
+        if bands is None:
+            topic_bands = self._deadbands[topic]
+            bands = tuple(topic_bands.get(name) for name in schema.field_names)
+            self._bands[key] = bands
+
+        return bands
+
+    @staticmethod
+    def _changed(bands, old_values, values):
+        """
+        :return: True if any field with deadband changed beyond the deadband
+        """
+        for idx, band in enumerate(bands):
+            if band is None:
+                continue
+            old = old_values[idx]
+            new = values[idx]
+            # NaN (not measured) is the only value not equal to itself.
+            # pylint: disable=comparison-with-itself
+            if (old != old) != (new != new):
+                return True
+            if new == new and abs(new - old) > band:
+                return True
+
+        return False
+
+    def check(self, topic, schema, values):
+        """
+        :param topic: MQTT topic
+        :param schema: Schema of the values
+        :param values: tuple of the values
+        :return: True if the reading should be published, False if it should be suppressed
+        """
+        if topic not in self._deadbands:
+            return True
+
+        last = self._last.get(topic)
+        if (
+            last is None
+            or last[0] is not schema
+            or time.monotonic_ns() - last[2] >= self._heartbeat_ns
+            or self._changed(self._schema_bands(topic, schema), last[1], values)
+        ):
+            self.passed += 1
+            return True
+
+        self.suppressed += 1
+        return False
+
+    def commit(self, topic, schema, values):
+        """
+        Remember the reading as the last published reading of the topic.
+        To be called once the reading that passed check() is queued for publishing.
+        :param topic: MQTT topic
+        :param schema: Schema of the values
+        :param values: tuple of the values
+        """
+        if topic not in self._deadbands:
+            return
+
+        now = time.monotonic_ns()
+        last = self._last.get(topic)
+        if last is None:
+            self._last[topic] = [schema, values, now]
+        else:
+            last[0] = schema
+            last[1] = values
+            last[2] = now
@@ -0,0 +1,66 @@
+"""
+Suppression of duplicate packets
+
+Retransmissions and RF reflections result in identical packets received within
+a short time. These are detected using small table of recently seen packet keys
+so that they are not decoded and published again. The packets are compared
+by their contents, not just by hash, so that colliding packets are not lost.
+"""
+
+import time
+
+from packet import COMPACT_SEQ_HEADER_LEN, FRAME_COMPACT_SEQ
+
+
+def packet_key(packet):
+    """
+    :param packet: raw packet (bytes or bytearray)
+    :return: key of the packet: the header (i.e. the topic ID and the sequence number)
+    of the compact packet with sequence number, the whole contents of other packets
+    """
+    if len(packet) >= COMPACT_SEQ_HEADER_LEN and packet[0] == FRAME_COMPACT_SEQ:
+        return bytes(packet[:COMPACT_SEQ_HEADER_LEN])
+
+    return bytes(packet)
+
+
+class DedupCache:  # pylint: disable=too-few-public-methods
+    """
+    Fixed size table of recently seen keys with time-to-live.
+    When the table is full, the oldest entry is replaced.
+    """
+
+    def __init__(self, size=16, ttl_ms=1000):
+        """
+        :param size: number of entries
+        :param ttl_ms: how long is a key considered as recently seen, in milliseconds
+        """
+        if size < 1:
+            raise ValueError(f"invalid size: {size}")
+
+        self._keys = [None] * size
+        self._stamps = [0] * size  # monotonic_ns() of the insertion
+        self._next = 0  # slot to be overwritten next, i.e. the oldest one
+        self._ttl_ns = ttl_ms * 1_000_000
+
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+
+    def is_duplicate(self, key):
+        """
+        Check whether the key was seen within the TTL. If not, remember it.
+        :param key: hashable key, e.g. from packet_key()
+        :return: True if the key was seen recently
+        """
+        now = time.monotonic_ns()
+        for idx, stored_key in enumerate(self._keys):
+            if stored_key == key and now - self._stamps[idx] < self._ttl_ns:
+                self.hits += 1
+                return True
+
+        self._keys[self._next] = key
+        self._stamps[self._next] = now
+        self._next = (self._next + 1) % len(self._keys)
+        self.misses += 1
+        return False
@@ -0,0 +1,169 @@
+"""
+Hardware abstraction layer implementation for the microcontroller
+
+Assumes Adafruit Feather ESP32 V2 and certain wiring of 433 MHz Radio FeatherWing.
+"""
+
+import time
+
+import adafruit_logging as logging
+import adafruit_rfm69
+import board
+import busio
+import digitalio
+import microcontroller
+import neopixel
+
+# pylint: disable=import-error
+import socketpool
+import wifi
+
+# pylint: disable=no-name-in-module
+from microcontroller import watchdog
+from watchdog import WatchDogMode
+
+from hal import Hardware
+from mqtt import mqtt_client_setup
+from packetready import PacketReady
+from reconnect import CONNECTION_ERRORS
+from warmstart import FLAG_BROKER, FLAG_NETWORK
+
+MQTT_TLS_PORT = 8883
+
+
+class DeviceHardware(Hardware):  # pylint: disable=too-many-instance-attributes
+    """
+    The hardware of the gateway.
+    """
+
+    def __init__(self, ssid, password, warm_start=None):
+        """
+        :param ssid: WiFi SSID
+        :param password: WiFi password
+        :param warm_start: optional WarmStart object with the cached connection data
+        """
+        self._ssid = ssid
+        self._password = password
+        self._warm_start = warm_start
+        self._pool = None
+        self._broker = None
+        self._port = None
+        self._tls = False
+        # Time spent connecting in this boot and whether the cached access point was used.
+        self._connect_ns = 0
+        self._fast = False
+
+    def watchdog(self, timeout):
+        watchdog.timeout = timeout
+        watchdog.mode = WatchDogMode.RAISE
+        return watchdog
+
+    def radio(self):
+        # Assumes certain wiring of the Radio FeatherWing.
+        cs = digitalio.DigitalInOut(board.D5)
+        reset = digitalio.DigitalInOut(board.D6)
+
+        spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+
+        return adafruit_rfm69.RFM69(spi, cs, reset, 433)  # Europe
+
+    def packet_ready(self, pin_name):
+        return PacketReady(getattr(board, pin_name))
+
+    def network_connected(self):
+        return wifi.radio.connected
+
+    def connect_network(self, timeout=3):
+        logger = logging.getLogger("")
+
+        start_ns = time.monotonic_ns()
+        cached = None
+        if self._warm_start is not None:
+            cached = self._warm_start.network()
+        try:
+            if cached is not None:
+                # Join the access point directly, without scanning all the channels.
+                channel, bssid = cached
+                logger.info(f"Connecting to wifi on channel {channel}")
+                wifi.radio.connect(
+                    self._ssid,
+                    self._password,
+                    channel=channel,
+                    bssid=bssid,
+                    timeout=timeout,
+                )
+            else:
+                logger.info("Connecting to wifi")
+                wifi.radio.connect(self._ssid, self._password, timeout=timeout)
+        except ConnectionError:
+            if cached is not None:
+                logger.warning("cached access point is not available, will scan")
+                self._warm_start.invalidate(FLAG_NETWORK)
+                # The duration of the full path is measured from scratch.
+                self._connect_ns = 0
+                self._fast = False
+            else:
+                self._connect_ns += time.monotonic_ns() - start_ns
+            raise
+        self._connect_ns += time.monotonic_ns() - start_ns
+        self._fast = cached is not None
+
+        logger.info(f"Connected to {self._ssid}")
+        logger.debug(f"IP: {wifi.radio.ipv4_address}")
+        if self._warm_start is not None:
+            ap_info = wifi.radio.ap_info
+            self._warm_start.set_network(ap_info.channel, ap_info.bssid)
+
+    def connect_mqtt(self, mqtt_client):
+        logger = logging.getLogger("")
+
+        start_ns = time.monotonic_ns()
+        address = None
+        # With TLS, the certificate is verified against the broker name,
+        # so the cached address cannot be used.
+        if self._warm_start is not None and not self._tls:
+            address = self._warm_start.broker_address()
+        try:
+            # The cached address saves the DNS lookup.
+            mqtt_client.connect(host=address if address is not None else self._broker)
+        except CONNECTION_ERRORS:
+            self._connect_ns += time.monotonic_ns() - start_ns
+            if address is not None:
+                logger.warning(f"cached broker address {address} failed, will resolve")
+                self._warm_start.invalidate(FLAG_BROKER)
+            raise
+        self._connect_ns += time.monotonic_ns() - start_ns
+
+        if self._warm_start is None:
+            return
+        if address is None and not self._tls:
+            try:
+                addr_info = self._pool.getaddrinfo(self._broker, self._port)
+                self._warm_start.set_broker_address(addr_info[0][4][0])
+            except OSError as e:
+                logger.debug(f"cannot resolve {self._broker}: {e}")
+        self._warm_start.connected(self._connect_ns // 1_000_000, self._fast)
+
+    def warm_start_metrics(self):
+        if self._warm_start is None:
+            return None
+
+        return self._warm_start.metrics()
+
+    def mqtt_client(self, broker, port, log_level):
+        self._broker = broker
+        self._port = port
+        self._pool = socketpool.SocketPool(wifi.radio)  # pylint: disable=no-member
+
+        mqtt_client = mqtt_client_setup(
+            self._pool, broker, port, log_level, socket_timeout=0.1
+        )
+        self._tls = port == MQTT_TLS_PORT or getattr(mqtt_client, "_is_ssl", False)
+
+        return mqtt_client
+
+    def pixel(self):
+        return neopixel.NeoPixel(board.NEOPIXEL, 1)
+
+    def uid(self):
+        return microcontroller.cpu.uid  # pylint: disable=no-member
@@ -0,0 +1,826 @@
+"""
+The gateway loop: receive packets over radio using RFM69 and if they fit certain form,
+replay their content to a MQTT topic to specified MQTT broker.
+
+The hardware is accessed via the hardware abstraction layer (see hal.py).
+
+The boot is staged so that the radio is receiving as soon as possible: the network
+and the MQTT session are brought up by the main loop while the readings are queued,
+the radio diagnostics are logged once connected and the modules of the optional
+features are imported only when enabled.
+"""
+
+import binascii
+import json
+import time
+
+import adafruit_logging as logging
+
+from binarystate import BinaryState
+from dedup import DedupCache, packet_key
+from hexdump import Hexdump
+from logutil import debug_enabled, get_log_level
+from mqtt_handler import MQTTHandler
+from packet import PacketDecoder, PacketDecodingError, TopicNotAllowedError, is_batch
+from packetready import poll_packets
+from payload import serialize
+from reconnect import CONNECTION_ERRORS, ConnectionSupervisor, is_message_error
+from ringbuffer import DROP_OLDEST, ReadingQueue
+from stats import (
+    BOOT_CONNECTED,
+    BOOT_FIRST_PUBLISH,
+    BOOT_FIRST_RECEIVE,
+    BOOT_RADIO,
+    COUNTER_DECODE_FAILURES,
+    COUNTER_LOOPS,
+    COUNTER_PACKETS,
+    COUNTER_PUBLISH_DROPS,
+    COUNTER_TOPIC_REJECTIONS,
+    STAGE_DECODE,
+    STAGE_JSON,
+    STAGE_LOOP,
+    STAGE_MQTT_LOOP,
+    STAGE_PUBLISH,
+    STAGE_RECEIVE,
+    BootTimes,
+    Stats,
+)
+from tunables import (
+    AGGREGATE_RAW,
+    AGGREGATE_SUFFIX,
+    AGGREGATE_TOPICS,
+    AGGREGATE_WINDOW,
+    ALLOWED_TOPICS,
+    BATCH_PUBLISH,
+    BROKER,
+    BROKER_PORT,
+    CAPTURE_INTERVAL,
+    CAPTURE_MAX_SIZE,
+    CAPTURE_PATH,
+    CAPTURE_TOPIC,
+    COORDINATION_TOPIC,
+    DEADBAND_HEARTBEAT,
+    DEADBANDS,
+    DEDUP_SIZE,
+    DEDUP_TTL,
+    DIO0_PIN,
+    ENCRYPTION_KEY,
+    GATEWAY_ID,
+    INFLIGHT_WINDOW,
+    LINK_STATS_SIZE,
+    LOG_BUFFER_SIZE,
+    LOG_FLUSH_INTERVAL,
+    LOG_LEVEL,
+    LOG_TOPIC,
+    MQTT_QOS,
+    NODE_ADDRESS,
+    PUBLISH_BUDGET,
+    QUEUE_OVERFLOW,
+    QUEUE_SIZE,
+    RATE_LIMIT,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_POLICY,
+    RATE_LIMITS,
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_MAX_FAILURES,
+    RETRANSMIT_TIMEOUT,
+    SPOOL_PATH,
+    SPOOL_REPLAY_BATCH,
+    SPOOL_REPLAY_INTERVAL,
+    SPOOL_SLOTS,
+    STATS_INTERVAL,
+    STATS_TOPIC,
+    TOPIC_IDS,
+    USE_ASYNCIO,
+)
+
+
+def blink(pixel):
+    """
+    Blink the Neo pixel blue.
+    """
+    pixel.brightness = 0.3
+    pixel.fill((0, 0, 255))
+    time.sleep(0.5)
+    pixel.brightness = 0
+
+
+def pixel_idle(pixel, pixel_state, pixel_blink_delay):
+    """
+    Finish the blink if the Neopixel is on.
+    """
+    logger = logging.getLogger("")
+
+    if pixel_state.cur_state == "on":
+        on_ms = pixel_state.update("on")
+        logger.debug(f"neopixel has been on for {on_ms} ms")
+        if on_ms > pixel_blink_delay:
+            logger.debug("turning the neopixel off")
+            pixel.brightness = 0
+            pixel_state.update("off")
+
+
+def pixel_received(pixel, pixel_state, pixel_blink_delay):
+    """
+    Blink the Neopixel upon packet reception.
+    """
+    logger = logging.getLogger("")
+
+    on_ms = pixel_state.update("on")
+    logger.debug(f"neopixel has been on for {on_ms} ms")
+    if on_ms < pixel_blink_delay:
+        logger.debug("turning the neopixel on")
+        pixel.brightness = 1
+        pixel.fill((0, 0, 255))
+    else:
+        logger.debug("turning the neopixel off")
+        pixel.brightness = 0
+        pixel_state.update("off")
+
+
+def log_radio_diagnostics(rfm69):
+    """
+    Log the parameters of the radio. Reading the temperature stops the reception
+    so the radio is put back to the receive mode afterwards.
+    """
+    logger = logging.getLogger("")
+
+    logger.info(f"Temperature: {rfm69.temperature}C")
+    rfm69.listen()
+    logger.info(f"Frequency: {rfm69.frequency_mhz}mhz")
+    logger.info(f"Bit rate: {rfm69.bitrate / 1000}kbit/s")
+    logger.info(f"Frequency deviation: {rfm69.frequency_deviation}hz")
+
+
+# pylint: disable=too-many-locals,too-many-statements,too-many-branches
+# The modules of the optional features are imported only when the feature is enabled
+# to shorten the time to the first received packet.
+# pylint: disable=import-outside-toplevel
+def run(hw, secrets, topic_acl, boot_ns=None):
+    """
+    main loop: collect messages via radio, decode and publish to MQTT
+    :param hw: Hardware object
+    :param secrets: the secrets dictionary with checked tunables
+    :param topic_acl: TopicACL compiled from the allowed topics
+    :param boot_ns: monotonic_ns() of the start of the boot, defaults to now
+    """
+    boot = BootTimes(boot_ns if boot_ns is not None else time.monotonic_ns())
+
+    log_level = get_log_level(secrets[LOG_LEVEL])
+    logger = logging.getLogger("")
+    logger.setLevel(log_level)
+    debug_level = debug_enabled(logger)
+
+    # The initialization code below should not take long and the endless loop is quite tight,
+    # so 5 seconds should be more than enough.
+    watchdog = hw.watchdog(5)
+
+    logger.info("Running")
+
+    rfm69 = hw.radio()
+    # Receive into the FIFO already while the rest is being set up.
+    rfm69.listen()
+    boot.mark(BOOT_RADIO)
+
+    # Read the FIFO only when the DIO0 (PayloadReady) line signals packet, if wired.
+    packet_ready = get_packet_ready(hw, secrets.get(DIO0_PIN))
+    receive_packets = packet_ready if packet_ready is not None else poll_packets
+
+    # Accept only packets addressed to the gateway (or broadcast) and acknowledge them.
+    reliable = None
+    if secrets.get(NODE_ADDRESS) is not None:
+        from reliable import ReliableReceiver
+
+        reliable = ReliableReceiver(secrets[NODE_ADDRESS], receive_packets)
+        receive_packets = reliable
+
+    encryption_key = secrets.get(ENCRYPTION_KEY)
+    if encryption_key:
+        logger.debug("Setting encryption key")
+        rfm69.encryption_key = encryption_key
+
+    mqtt_client, log_handler = get_mqtt_client(hw, secrets)
+
+    # Brings up the network and the MQTT session in the main loop
+    # and keeps them up without resetting.
+    connection = ConnectionSupervisor(
+        hw,
+        mqtt_client,
+        watchdog,
+        backoff_max=secrets.get(RECONNECT_BACKOFF_MAX, 60),
+        max_failures=secrets.get(RECONNECT_MAX_FAILURES, 10),
+    )
+    logger.info(f"Using MQTT broker {secrets[BROKER]}:{secrets[BROKER_PORT]}")
+
+    logger.debug(f"allowed topics: {secrets.get(ALLOWED_TOPICS)}")
+    decoder = PacketDecoder(topic_ids=secrets.get(TOPIC_IDS))
+    batch_array = secrets.get(BATCH_PUBLISH) == "array"
+    # Decouples the radio reception from (possibly slow) publishing.
+    queue = ReadingQueue(
+        secrets.get(QUEUE_SIZE, 32), secrets.get(QUEUE_OVERFLOW, DROP_OLDEST)
+    )
+    # Keep this well below the watchdog timeout.
+    publish_budget = secrets.get(PUBLISH_BUDGET, 500)
+
+    stats = Stats()
+    stats_topic = secrets.get(STATS_TOPIC)
+    stats_interval = secrets.get(STATS_INTERVAL, 60)
+    stats_stamp = time.monotonic()
+
+    # In the multi-gateway deployment, the raw receptions are published
+    # for the selection stage instead of the readings.
+    coordination_topic = secrets.get(COORDINATION_TOPIC)
+    if coordination_topic:
+        from coordination import reception_payload
+    gateway_id = secrets.get(GATEWAY_ID)
+    if gateway_id is None:
+        gateway_id = str(binascii.hexlify(hw.uid()), "ascii")
+
+    # Aggregation of readings in time windows.
+    aggregator = None
+    if secrets.get(AGGREGATE_TOPICS):
+        from aggregate import WindowAggregator
+
+        aggregator = WindowAggregator(
+            secrets[AGGREGATE_TOPICS],
+            window=secrets.get(AGGREGATE_WINDOW, 60),
+            suffix=secrets.get(AGGREGATE_SUFFIX, "/aggregate"),
+            raw=secrets.get(AGGREGATE_RAW, True),
+        )
+
+    def queue_aggregate(mqtt_topic, data):
+        # Published (or spooled) the same way as the readings.
+        pub_data = json.dumps(data)
+        logger.info(f"Queueing aggregate for {mqtt_topic}: {pub_data}")
+        if not queue.put(mqtt_topic, pub_data.encode("utf-8")):
+            logger.warning(f"queue full, dropped aggregate for {mqtt_topic}")
+
+    # Report-by-exception.
+    deadband = None
+    if secrets.get(DEADBANDS):
+        from deadband import DeadbandFilter
+
+        deadband = DeadbandFilter(
+            secrets[DEADBANDS], secrets.get(DEADBAND_HEARTBEAT, 300)
+        )
+
+    # Protection of the broker from senders transmitting too often.
+    limiter = None
+    if secrets.get(RATE_LIMIT) or secrets.get(RATE_LIMITS):
+        from ratelimit import DROP as RATE_LIMIT_DROP
+        from ratelimit import TopicRateLimiter
+
+        limiter = TopicRateLimiter(
+            secrets.get(RATE_LIMIT, 60000),
+            burst=secrets.get(RATE_LIMIT_BURST, 5),
+            rates=secrets.get(RATE_LIMITS),
+            policy=secrets.get(RATE_LIMIT_POLICY, RATE_LIMIT_DROP),
+        )
+
+    def release_reading(mqtt_topic, reading):
+        # The pending reading was checked against the deadbands when received.
+        put_reading(queue, mqtt_topic, reading, deadband)
+
+    # Link quality of each sender, published with the statistics.
+    links = None
+    if stats_topic and secrets.get(LINK_STATS_SIZE, 16) > 0:
+        from linkstats import LinkStats
+
+        links = LinkStats(secrets.get(LINK_STATS_SIZE, 16))
+
+    # Suppression of retransmitted/reflected packets.
+    dedup = None
+    if secrets.get(DEDUP_SIZE, 16) > 0:
+        dedup = DedupCache(secrets.get(DEDUP_SIZE, 16), secrets.get(DEDUP_TTL, 1000))
+
+    # Capture of the raw packets for later replay.
+    capture = None
+    if secrets.get(CAPTURE_TOPIC):
+        from capture import PacketCapture
+
+        capture_topic = secrets[CAPTURE_TOPIC]
+
+        def publish_capture(data):
+            if not mqtt_client.is_connected():
+                return False
+            try:
+                mqtt_client.publish(capture_topic, bytes(data))
+            except CONNECTION_ERRORS as e:
+                connection.lost(e)
+                return False
+            return True
+
+        capture = PacketCapture(
+            publish_capture, interval=secrets.get(CAPTURE_INTERVAL, 5)
+        )
+    elif secrets.get(CAPTURE_PATH):
+        from capture import CaptureFile, PacketCapture
+
+        capture = PacketCapture(
+            CaptureFile(
+                secrets[CAPTURE_PATH], max_size=secrets.get(CAPTURE_MAX_SIZE, 65536)
+            ),
+            interval=secrets.get(CAPTURE_INTERVAL, 5),
+        )
+
+    # QoS 1 publishing of the readings with bounded number of messages waiting for PUBACK.
+    window = None
+    if secrets.get(MQTT_QOS, 0) == 1:
+        from inflight import InFlightWindow
+
+        window = InFlightWindow(
+            mqtt_client,
+            size=secrets.get(INFLIGHT_WINDOW, 16),
+            retransmit_timeout=secrets.get(RETRANSMIT_TIMEOUT, 5),
+        )
+    publisher = window if window is not None else mqtt_client
+
+    def publish_reading(mqtt_topic, reading):
+        publish(publisher, mqtt_topic, reading, stats)
+        boot.mark(BOOT_FIRST_PUBLISH)
+
+    # Store-and-forward of the readings that cannot be published.
+    spool = None
+    if secrets.get(SPOOL_PATH):
+        from spool import Spool
+
+        spool = Spool(
+            secrets[SPOOL_PATH],
+            slots=secrets.get(SPOOL_SLOTS, 256),
+            replay_batch=secrets.get(SPOOL_REPLAY_BATCH, 10),
+            replay_interval=secrets.get(SPOOL_REPLAY_INTERVAL, 1),
+        )
+
+    def replay_reading(mqtt_topic, reading):
+        pub_data = serialize(reading)
+        logger.info(f"Replaying to {mqtt_topic}: {str(pub_data, 'utf-8')}")
+        publisher.publish(mqtt_topic, pub_data)
+
+    def publish_stats():
+        extra = {
+            "queue": {
+                "enqueued": queue.enqueued,
+                "dropped": queue.dropped,
+                "coalesced": queue.coalesced,
+                "published": queue.published,
+                "latency_avg_ms": queue.latency_avg_ms(),
+                "latency_max_ms": queue.latency_ns_max / 1_000_000,
+            }
+        }
+        extra["boot"] = boot.milestones
+        if spool is not None:
+            extra["spool"] = spool.metrics()
+        extra["connection"] = connection.metrics()
+        warm_start = hw.warm_start_metrics()
+        if warm_start is not None:
+            extra["warm_start"] = warm_start
+        if window is not None:
+            extra["inflight"] = {
+                "occupancy": len(window),
+                "occupancy_max": window.occupancy_max,
+                "acked": window.acked,
+                "retransmits": window.retransmits,
+                "ack_latency_avg_ms": window.ack_latency_avg_ms(),
+                "ack_latency_max_ms": window.ack_latency_ns_max / 1_000_000,
+            }
+        if packet_ready is not None:
+            extra["dio0"] = {
+                "edges": packet_ready.edges,
+                "packets": packet_ready.packets,
+                "missed_edges": packet_ready.missed_edges,
+            }
+        if reliable is not None:
+            extra["reliable"] = {
+                "acks": reliable.acks,
+                "retries": reliable.retries,
+                "foreign": reliable.foreign,
+                "ack_latency_avg_ms": reliable.ack_latency_avg_ms(),
+                "ack_latency_max_ms": reliable.ack_latency_ns_max / 1_000_000,
+            }
+        if limiter is not None:
+            extra["rate_limit"] = {
+                "limited": limiter.limited,
+                "dropped": limiter.dropped,
+            }
+        if links is not None:
+            extra["links"] = links.summary()
+        if aggregator is not None:
+            extra["aggregate"] = {
+                "aggregated": aggregator.aggregated,
+                "published": aggregator.published,
+            }
+        if deadband is not None:
+            extra["deadband"] = {
+                "passed": deadband.passed,
+                "suppressed": deadband.suppressed,
+            }
+        if dedup is not None:
+            extra["dedup"] = {"hits": dedup.hits, "misses": dedup.misses}
+        if capture is not None:
+            extra["capture"] = {
+                "captured": capture.captured,
+                "dropped": capture.dropped,
+                "written": capture.written,
+            }
+        if log_handler is not None:
+            extra["log"] = {
+                "dropped": log_handler.dropped,
+                "coalesced": log_handler.coalesced,
+                "published": log_handler.published,
+            }
+        mqtt_client.publish(stats_topic, json.dumps(stats.summary(extra)))
+
+    diagnostics_logged = False
+
+    def publish_stage():
+        nonlocal stats_stamp, diagnostics_logged
+
+        if capture is not None:
+            capture.poll()
+        if aggregator is not None:
+            aggregator.poll(queue_aggregate)
+
+        if not mqtt_client.is_connected():
+            # Until connected for the first time, the readings wait in the queue.
+            if spool is not None and connection.connected_once:
+                if window is not None:
+                    window.requeue(queue.put)
+                spool.save_queue(queue)
+            return
+
+        boot.mark(BOOT_CONNECTED)
+        # Deferred from the boot. Not while a packet is waiting in the FIFO
+        # as reading the temperature stops the reception.
+        if not diagnostics_logged and not rfm69.payload_ready():
+            log_radio_diagnostics(rfm69)
+            diagnostics_logged = True
+
+        try:
+            if log_handler is not None:
+                log_handler.poll()
+            if limiter is not None:
+                limiter.release(release_reading)
+            if window is not None:
+                window.poll()
+                queue.drain(publish_reading, publish_budget, limit=window.free())
+            else:
+                queue.drain(publish_reading, publish_budget)
+            if spool is not None and (
+                window is None or window.free() >= secrets.get(SPOOL_REPLAY_BATCH, 10)
+            ):
+                spool.replay(replay_reading)
+
+            if stats_topic and time.monotonic() - stats_stamp >= stats_interval:
+                stats_stamp = time.monotonic()
+                publish_stats()
+        except CONNECTION_ERRORS as e:
+            connection.lost(e)
+
+    def handle_packet(packet):
+        # See the strength of the radio signal being received.
+        # This is updated when packets are received and returns a value in decibels
+        # (typically negative, so the smaller the number and closer to 0,
+        # the higher the strength / better the signal).
+        if debug_level:
+            logger.debug(f"RSSI: {rfm69.last_rssi}")
+            logger.debug(f"Received packet of {len(packet)} bytes:\n{Hexdump(packet)}")
+
+        stats.increment(COUNTER_PACKETS)
+        boot.mark(BOOT_FIRST_RECEIVE)
+        if capture is not None:
+            capture.add(packet, rfm69.last_rssi)
+        if dedup is not None and dedup.is_duplicate(packet_key(packet)):
+            if debug_level:
+                logger.debug("ignoring duplicate packet")
+            # The packet was accepted before.
+            if reliable is not None:
+                reliable.ack(rfm69)
+            return
+
+        if coordination_topic:
+            queue.put(
+                coordination_topic,
+                reception_payload(gateway_id, rfm69.last_rssi, packet),
+            )
+            if reliable is not None:
+                reliable.ack(rfm69)
+            return
+
+        start_ns = time.monotonic_ns()
+        try:
+            enqueue_packet(
+                queue,
+                decoder,
+                topic_acl,
+                packet,
+                batch_array,
+                deadband=deadband,
+                aggregator=aggregator,
+                limiter=limiter,
+            )
+        except TopicNotAllowedError as topic_exc:
+            stats.increment(COUNTER_TOPIC_REJECTIONS)
+            logger.warning(str(topic_exc))
+        except PacketDecodingError as packet_exc:
+            stats.increment(COUNTER_DECODE_FAILURES)
+            logger.warning(str(packet_exc))
+        else:
+            if reliable is not None:
+                reliable.ack(rfm69)
+            if links is not None:
+                links.update(decoder.last_topic, rfm69.last_rssi, decoder.last_seq)
+        stats.record(STAGE_DECODE, start_ns)
+
+    # The Neopixel will blink only then logging level is set to DEBUG however initialize it anyway.
+    pixel = hw.pixel()
+    pixel.brightness = 0
+    pixel_state = BinaryState()
+    pixel_state.update("off")
+
+    # Assumes tight loop below. The value is approximate. If there is high frequency of packets
+    # (i.e. more frequent than this delay), the blinking will degrade into solid light.
+    pixel_blink_delay = 300  # in milliseconds
+
+    # Wait to receive packets.  Note that this library can't receive data at a fast
+    # rate, in fact it can only receive and process one 60 byte packet at a time.
+    # This means you should only use this for low bandwidth scenarios, like sending
+    # and receiving a single message at a time.
+    logger.info("Waiting for packets...")
+    try:
+        if secrets.get(USE_ASYNCIO):
+            # Imported here so that the asyncio library is needed only in this mode.
+            import asyncio
+
+            from asyncloop import AsyncLoop
+
+            pixel_funcs = None
+            if debug_level:
+                pixel_funcs = (
+                    lambda: pixel_received(pixel, pixel_state, pixel_blink_delay),
+                    lambda: pixel_idle(pixel, pixel_state, pixel_blink_delay),
+                )
+            asyncio.run(
+                AsyncLoop(receive_packets, stats=stats).run(
+                    watchdog,
+                    rfm69,
+                    connection,
+                    (handle_packet, publish_stage),
+                    pixel_funcs,
+                )
+            )
+
+        while True:
+            loop_start_ns = time.monotonic_ns()
+            stats.increment(COUNTER_LOOPS)
+            watchdog.feed()
+
+            connection.loop(0.1)
+            start_ns = stats.record(STAGE_MQTT_LOOP, loop_start_ns)
+
+            publish_stage()
+
+            start_ns = time.monotonic_ns()
+            received = False
+            for packet in receive_packets(rfm69, 0.1):
+                if not received:
+                    stats.record(STAGE_RECEIVE, start_ns)
+                received = True
+                if debug_level:
+                    pixel_received(pixel, pixel_state, pixel_blink_delay)
+
+                handle_packet(packet)
+
+            if not received and debug_level:
+                pixel_idle(pixel, pixel_state, pixel_blink_delay)
+
+            if packet_ready is not None and received and debug_level:
+                logger.debug(
+                    f"DIO0: {packet_ready.packets} packets for {packet_ready.edges} edges "
+                    f"({packet_ready.missed_edges} missed)"
+                )
+
+            stats.record(STAGE_LOOP, loop_start_ns)
+    except Exception:
+        # Preserve the readings that could not be published yet.
+        if spool is not None:
+            if window is not None:
+                window.requeue(queue.put)
+            spool.save_queue(queue)
+        if capture is not None:
+            capture.flush()
+        # Best effort attempt to publish the last log records.
+        if log_handler is not None:
+            log_handler.flush()
+        raise
+
+
+def get_packet_ready(hw, pin_name):
+    """
+    :param hw: Hardware object
+    :param pin_name: name of the pin wired to DIO0, if any
+    :return: PacketReady object for the DIO0 pin if configured and usable, None otherwise
+    """
+    logger = logging.getLogger("")
+
+    if not pin_name:
+        return None
+
+    try:
+        packet_ready = hw.packet_ready(pin_name)
+        logger.info(f"Using DIO0 on pin {pin_name} to detect packets")
+        return packet_ready
+    except (RuntimeError, ValueError) as e:
+        logger.warning(f"cannot use DIO0 pin {pin_name}, falling back to polling: {e}")
+        return None
+
+
+# pylint: disable=too-many-arguments
+def enqueue_packet(
+    queue,
+    decoder,
+    topic_acl,
+    packet,
+    batch_array,
+    *,
+    deadband=None,
+    aggregator=None,
+    limiter=None,
+):
+    """
+    Decode the packet and put its records to the queue for publishing. The records
+    of a batch frame are queued either one by one or as an array in single reading.
+    The records are added to the WindowAggregator (if any), the records suppressed
+    by the DeadbandFilter (if any) are not queued and the TopicRateLimiter (if any)
+    is applied to the rest. The DeadbandFilter remembers the records only once
+    they are queued, see put_reading().
+    Raises PacketDecodingError on error.
+    """
+    readings = decode_packet(decoder, topic_acl, packet)
+    if aggregator is not None:
+        readings = aggregate_readings(aggregator, readings)
+    if deadband is not None:
+        readings = (
+            (mqtt_topic, reading)
+            for mqtt_topic, reading in readings
+            if deadband.check(mqtt_topic, reading[0], reading[1])
+        )
+
+    if batch_array and is_batch(packet):
+        readings = join_records(readings)
+
+    if limiter is not None:
+        readings = (
+            (mqtt_topic, reading)
+            for mqtt_topic, reading in readings
+            if limiter.allow(mqtt_topic, reading)
+        )
+
+    for mqtt_topic, reading in readings:
+        put_reading(queue, mqtt_topic, reading, deadband)
+
+
+def put_reading(queue, mqtt_topic, reading, deadband=None):
+    """
+    Put the reading (or list of readings) to the queue. Once queued, it is committed
+    as the last published reading of the topic to the DeadbandFilter (if any).
+    """
+    logger = logging.getLogger("")
+
+    queued = queue.accepts()
+    if not queue.put(mqtt_topic, reading):
+        logger.warning(
+            f"queue full, dropped reading "
+            f"(enqueued {queue.enqueued}, dropped {queue.dropped}, "
+            f"coalesced {queue.coalesced}, published {queue.published})"
+        )
+    if not queued or deadband is None:
+        return
+
+    for schema, values, _ in reading if isinstance(reading, list) else (reading,):
+        deadband.commit(mqtt_topic, schema, values)
+
+
+def join_records(readings):
+    """
+    Join the records of batch frame into single reading with list of the records,
+    to be published as JSON array.
+    :return: tuple with the joined reading, empty if there are no records
+    """
+    mqtt_topic = None
+    reading_list = []
+    for mqtt_topic, reading in readings:
+        reading_list.append(reading)
+    if not reading_list:
+        return ()
+
+    return ((mqtt_topic, reading_list),)
+
+
+def aggregate_readings(aggregator, readings):
+    """
+    Add the readings to the aggregates, yield those that should be published as well.
+    """
+    for mqtt_topic, reading in readings:
+        if aggregator.add(mqtt_topic, reading[0], reading[1]) and not aggregator.raw:
+            continue
+        yield mqtt_topic, reading
+
+
+def publish(publisher, mqtt_topic, reading, stats):
+    """
+    Convert the reading to JSON and publish it to the MQTT topic
+    using the publisher (MQTT client or InFlightWindow).
+    The reading that cannot be converted or that is refused by the MQTT client
+    (e.g. invalid topic or too big payload) is dropped and counted, so that it does not
+    stay at the head of the queue. Only the connection errors are raised.
+    """
+    logger = logging.getLogger("")
+
+    start_ns = time.monotonic_ns()
+    try:
+        pub_data = serialize(reading)
+    except ValueError as e:
+        stats.increment(COUNTER_PUBLISH_DROPS)
+        logger.warning(f"failed to convert to JSON, dropping the reading: {e}")
+        return
+    start_ns = stats.record(STAGE_JSON, start_ns)
+
+    logger.info(f"Publishing to {mqtt_topic}: {str(pub_data, 'utf-8')}")
+    try:
+        publisher.publish(mqtt_topic, pub_data)
+    except CONNECTION_ERRORS + (ValueError,) as e:
+        if not is_message_error(e):
+            raise
+        stats.increment(COUNTER_PUBLISH_DROPS)
+        logger.warning(f"failed to publish to {mqtt_topic}, dropping the reading: {e}")
+        return
+    stats.record(STAGE_PUBLISH, start_ns)
+
+
+def decode_packet(decoder, topic_acl, packet):
+    """
+    Decode packet, return iterable of tuples of MQTT topic and reading (tuple of Schema,
+    values and age), one for each record in the packet. The age is None for packets
+    with single reading. These are decoded right away, the records of batch frames lazily.
+    Raises PacketDecodingError on error.
+    """
+    if not is_batch(packet):
+        mqtt_topic, schema, values = decoder.decode(packet)
+        check_topic(topic_acl, mqtt_topic)
+        return ((mqtt_topic, (schema, values, None)),)
+
+    return decode_batch(decoder, topic_acl, packet)
+
+
+def decode_batch(decoder, topic_acl, packet):
+    """
+    Generator yielding the records of batch frame as decode_packet() does.
+    """
+    for mqtt_topic, schema, values, age in decoder.records(packet):
+        check_topic(topic_acl, mqtt_topic)
+        yield mqtt_topic, (schema, values, age)
+
+
+def check_topic(topic_acl, mqtt_topic):
+    """
+    Raises TopicNotAllowedError if the MQTT topic is not allowed.
+    """
+    logger = logging.getLogger("")
+    if debug_enabled(logger):
+        logger.debug(f"MQTT topic: {mqtt_topic}")
+    if not topic_acl.is_allowed(mqtt_topic):
+        raise TopicNotAllowedError(f"not allowed topic: '{mqtt_topic}'")
+
+
+def get_mqtt_client(hw, secrets):
+    """
+    Initialize MQTT client (not connected to the network nor to the broker yet)
+    :param hw: Hardware object
+    :param secrets: the secrets dictionary
+    :return: tuple of MQTT client and MQTTHandler (None if logging via MQTT is not configured)
+    """
+    logger = logging.getLogger("")
+
+    broker_addr = secrets[BROKER]
+    broker_port = secrets[BROKER_PORT]
+    mqtt_client = hw.mqtt_client(broker_addr, broker_port, logger.getEffectiveLevel())
+
+    log_handler = None
+    try:
+        log_topic = secrets[LOG_TOPIC]
+        # Log both to the console and via MQTT messages.
+        # Up to now the logger was using the default (built-in) handler,
+        # now it is necessary to add the Stream handler explicitly as
+        # with a non-default handler set only the non-default handlers will be used.
+        logger.addHandler(logging.StreamHandler())
+        log_handler = MQTTHandler(
+            mqtt_client,
+            log_topic,
+            capacity=secrets.get(LOG_BUFFER_SIZE, 32),
+            flush_interval=secrets.get(LOG_FLUSH_INTERVAL, 1),
+        )
+        logger.addHandler(log_handler)
+    except KeyError:
+        pass
+
+    return mqtt_client, log_handler
@@ -0,0 +1,95 @@
+"""
+Hardware abstraction layer
+
+The gateway loop (see gateway.py) accesses the radio, the network, the Neopixel
+and the watchdog only through an object with the interface of the Hardware class,
+so that it can run on the microcontroller (see devicehal.py) as well as in CPython
+(see tools/simulator.py).
+"""
+
+
+class Hardware:
+    """
+    Interface of the hardware used by the gateway loop.
+
+    The objects returned by the methods need to provide the subset of the interface
+    of the CircuitPython objects that is used by the gateway loop:
+      - radio: adafruit_rfm69.RFM69 (listen(), receive(), payload_ready(), send(),
+        last_rssi, encryption_key, temperature, frequency_mhz, bitrate, frequency_deviation)
+      - MQTT client: mqtt.PipelinedMQTT (connect(), loop(), publish(), publish_nowait(),
+        is_connected() and the callbacks)
+      - Neopixel: neopixel.NeoPixel (brightness, fill())
+      - watchdog: microcontroller.watchdog (feed())
+    """
+
+    def watchdog(self, timeout):
+        """
+        Start the watchdog that raises WatchDogTimeout if not fed within the timeout.
+        :param timeout: timeout in seconds
+        :return: watchdog object
+        """
+        raise NotImplementedError
+
+    def radio(self):
+        """
+        :return: initialized radio object
+        """
+        raise NotImplementedError
+
+    def packet_ready(self, pin_name):
+        """
+        :param pin_name: name of the pin wired to DIO0 of the radio
+        :return: PacketReady object for the pin
+        Raises RuntimeError or ValueError if the pin cannot be used.
+        """
+        raise NotImplementedError
+
+    def network_connected(self):
+        """
+        :return: True if connected to the network
+        """
+        raise NotImplementedError
+
+    def connect_network(self, timeout=3):
+        """
+        Connect to the network.
+        :param timeout: timeout in seconds
+        Raises ConnectionError on failure.
+        """
+        raise NotImplementedError
+
+    def connect_mqtt(self, mqtt_client):
+        """
+        Connect the MQTT client to the broker.
+        :param mqtt_client: MQTT client object returned by mqtt_client()
+        """
+        raise NotImplementedError
+
+    def warm_start_metrics(self):
+        """
+        :return: dictionary with the warm-restart metrics, None if not applicable
+        """
+        raise NotImplementedError
+
+    def mqtt_client(self, broker, port, log_level):
+        """
+        Set up MQTT client, without connecting to the network or to the broker
+        (that is done by the ConnectionSupervisor in the main loop).
+        :param broker: MQTT broker address
+        :param port: MQTT broker port
+        :param log_level: log level of the MQTT client
+        :return: MQTT client object
+        """
+        raise NotImplementedError
+
+    def pixel(self):
+        """
+        :return: Neopixel object
+        """
+        raise NotImplementedError
+
+    def uid(self):
+        """
+        :return: unique identifier of the board (bytes)
+        """
+        raise NotImplementedError
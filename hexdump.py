@@ -3,6 +3,33 @@ hex dumping capability
 adapted from https://gist.github.com/NeatMonster/c06c61ba4114a2b31418a364341c26c0
 """
 
+import binascii
+
+# Layout of the line: two groups of 8 bytes in hex, then the printable characters.
+# "xx xx xx xx xx xx xx xx  xx xx xx xx xx xx xx xx  |................|"
+_HEX_FIRST = 0
+_HEX_SECOND = 25
+_TEXT_START = 51
+_LINE_LEN = 68
+_BLANK_LINE = b" " * _LINE_LEN
+
+# Line buffer shared by all Hexdump objects.
+_line = bytearray(_LINE_LEN)
+
+# Translation table mapping the non-printable characters to dot.
+_PRINTABLE = bytes(x if 32 <= x < 127 else ord(".") for x in range(256))
+
+
+def _printable(chunk):
+    """
+    :return: bytes with the non-printable characters replaced by dot
+    """
+    try:
+        return chunk.translate(_PRINTABLE)
+    except AttributeError:
+        # bytes.translate() is not available in all CircuitPython builds.
+        return bytes(_PRINTABLE[x] for x in chunk)
+
 
 class Hexdump:
     """
@@ -12,16 +39,26 @@ class Hexdump:
     def __init__(self, buf):
         self.buf = buf
 
+    @staticmethod
+    def _format_line(chunk):
+        """
+        Format up to 16 bytes into the line buffer.
+        """
+        line = _line
+        line[:] = _BLANK_LINE
+        hex_first = binascii.hexlify(chunk[:8], b" ")
+        line[_HEX_FIRST : _HEX_FIRST + len(hex_first)] = hex_first
+        hex_second = binascii.hexlify(chunk[8:], b" ")
+        line[_HEX_SECOND : _HEX_SECOND + len(hex_second)] = hex_second
+        line[_TEXT_START - 1] = ord("|")
+        text = _printable(chunk)
+        line[_TEXT_START : _TEXT_START + len(text)] = text
+        line[_LINE_LEN - 1] = ord("|")
+        return str(line, "ascii")
+
     def __iter__(self):
         for i in range(0, len(self.buf), 16):
-            bs = bytearray(self.buf[i : i + 16])
-            # pylint: disable=consider-using-f-string
-            line = "{:23}  {:23}  |{:16}|".format(
-                " ".join(("{:02x}".format(x) for x in bs[:8])),
-                " ".join(("{:02x}".format(x) for x in bs[8:])),
-                "".join((chr(x) if 32 <= x < 127 else "." for x in bs)),
-            )
-            yield line
+            yield self._format_line(bytes(self.buf[i : i + 16]))
 
         yield ""
 
@@ -0,0 +1,165 @@
+"""
+Pipelined publishing with QoS 1
+
+Up to a fixed number of messages can wait for their PUBACK at the same time,
+so that the publishing does not stall for a round trip to the broker for each message.
+The PUBACKs are matched as they are received by the MQTT client loop() and the messages
+that were not acknowledged in time are retransmitted.
+"""
+
+import time
+
+
+class InFlightWindow:  # pylint: disable=too-many-instance-attributes
+    """
+    Fixed size table of the messages sent and not acknowledged yet.
+    The storage is preallocated so that no memory is allocated when publishing.
+    """
+
+    def __init__(self, mqtt_client, size=8, retransmit_timeout=5):
+        """
+        :param mqtt_client: PipelinedMQTT object
+        :param size: maximum number of messages waiting for PUBACK
+        :param retransmit_timeout: time after which unacknowledged message
+        is sent again, in seconds
+        """
+        if size < 1:
+            raise ValueError(f"invalid size: {size}")
+
+        self._mqtt_client = mqtt_client
+        self._timeout_ns = retransmit_timeout * 1_000_000_000
+        self._pids = [0] * size  # 0 marks free slot
+        self._topics = [None] * size
+        self._payloads = [None] * size
+        self._first_sent = [0] * size  # monotonic_ns() of the first transmission
+        self._last_sent = [0] * size  # monotonic_ns() of the last transmission
+        self._count = 0
+        self._next_pid = 1
+
+        mqtt_client.on_puback = self.on_puback
+
+        # Statistics.
+        self.occupancy_max = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.unknown_acks = 0
+        self.ack_latency_ns_total = 0
+        self.ack_latency_ns_max = 0
+
+    def __len__(self):
+        return self._count
+
+    def free(self):
+        """
+        :return: number of messages that can be published now
+        """
+        return len(self._pids) - self._count
+
+    def ack_latency_avg_ms(self):
+        """
+        :return: average time from the first transmission to the PUBACK in milliseconds
+        """
+        if self.acked == 0:
+            return 0
+
+        return self.ack_latency_ns_total / self.acked / 1_000_000
+
+    def _pid(self):
+        """
+        :return: next packet ID, skipping 0
+        """
+        pid = self._next_pid
+        self._next_pid = pid % 65535 + 1
+        return pid
+
+    def publish(self, topic, payload):
+        """
+        Send the message and keep it until acknowledged.
+        :param topic: MQTT topic
+        :param payload: bytes
+        :return: False if the window is full and the message was not sent, True otherwise
+        """
+        if self._count == len(self._pids):
+            return False
+
+        idx = self._pids.index(0)
+        pid = self._pid()
+        self._mqtt_client.publish_nowait(topic, payload, pid)
+        now = time.monotonic_ns()
+        self._pids[idx] = pid
+        self._topics[idx] = topic
+        self._payloads[idx] = payload
+        self._first_sent[idx] = now
+        self._last_sent[idx] = now
+        self._count += 1
+        self.occupancy_max = max(self._count, self.occupancy_max)
+
+        return True
+
+    def _release(self, idx):
+        """
+        Free the slot, releasing the references.
+        """
+        self._pids[idx] = 0
+        self._topics[idx] = None
+        self._payloads[idx] = None
+        self._count -= 1
+
+    def on_puback(self, pid):
+        """
+        Callback for the MQTT client, called for each PUBACK received.
+        :param pid: packet ID
+        """
+        try:
+            idx = self._pids.index(pid)
+        except ValueError:
+            # Acknowledgement of retransmitted message that was acknowledged already.
+            self.unknown_acks += 1
+            return
+
+        latency = time.monotonic_ns() - self._first_sent[idx]
+        self.acked += 1
+        self.ack_latency_ns_total += latency
+        self.ack_latency_ns_max = max(latency, self.ack_latency_ns_max)
+        self._release(idx)
+
+    def poll(self):
+        """
+        Retransmit the messages that were not acknowledged within the timeout.
+        :return: number of retransmitted messages
+        """
+        if self._count == 0 or not self._mqtt_client.is_connected():
+            return 0
+
+        now = time.monotonic_ns()
+        count = 0
+        for idx, pid in enumerate(self._pids):
+            if pid == 0 or now - self._last_sent[idx] < self._timeout_ns:
+                continue
+            self._mqtt_client.publish_nowait(
+                self._topics[idx], self._payloads[idx], pid, dup=True
+            )
+            self._last_sent[idx] = now
+            count += 1
+
+        self.retransmits += count
+        return count
+
+    def requeue(self, put_func):
+        """
+        Hand over the messages that were not acknowledged, e.g. when the connection is lost,
+        oldest first, and empty the window.
+        :param put_func: function accepting MQTT topic and payload
+        :return: number of messages handed over
+        """
+        count = 0
+        while self._count > 0:
+            idx = min(
+                (i for i, pid in enumerate(self._pids) if pid != 0),
+                key=lambda i: self._first_sent[i],
+            )
+            put_func(self._topics[idx], self._payloads[idx])
+            self._release(idx)
+            count += 1
+
+        return count
@@ -0,0 +1,123 @@
+"""
+Per sender link quality tracking
+
+For each MQTT topic (i.e. sender), the RSSI of the received packets, the interval between
+the packets and the packet loss (for senders that use packets with sequence numbers)
+are tracked in a fixed size table.
+"""
+
+import time
+
+# Sequence numbers are single byte and wrap around.
+SEQ_MODULO = 256
+
+
+class LinkStats:  # pylint: disable=too-many-instance-attributes
+    """
+    Fixed size table of link statistics, one row per MQTT topic.
+    """
+
+    def __init__(self, max_senders=16, alpha=0.1):
+        """
+        :param max_senders: maximum number of tracked senders, the table is preallocated
+        :param alpha: weight of the new sample in the exponential moving averages
+        """
+        self._alpha = alpha
+        self._slots = {}  # MQTT topic to row of the table
+        self._topics = [None] * max_senders
+        self._rssi_avg = [0.0] * max_senders
+        self._rssi_min = [0] * max_senders
+        self._interval_avg = [0.0] * max_senders  # in seconds
+        self._last_stamp = [0] * max_senders  # monotonic_ns() of the last packet
+        self._last_seq = [None] * max_senders
+        self._packets = [0] * max_senders
+        self._seq_packets = [0] * max_senders
+        self._lost = [0] * max_senders
+
+        # Number of packets from senders that did not fit the table.
+        self.untracked = 0
+
+    def _slot(self, topic):
+        """
+        :return: table row for the topic, None if the table is full
+        """
+        slot = self._slots.get(topic)
+        if slot is None and len(self._slots) < len(self._topics):
+            slot = len(self._slots)
+            self._slots[topic] = slot
+            self._topics[slot] = topic
+
+        return slot
+
+    def _update_seq(self, slot, seq):
+        """
+        Count the packets lost since the previous sequence number.
+        """
+        last_seq = self._last_seq[slot]
+        self._last_seq[slot] = seq
+        self._seq_packets[slot] += 1
+        if last_seq is None:
+            return
+
+        gap = (seq - last_seq) % SEQ_MODULO
+        # Gap of more than half of the sequence space means reordering or sender restart.
+        if 0 < gap <= SEQ_MODULO // 2:
+            self._lost[slot] += gap - 1
+
+    def update(self, topic, rssi, seq=None):
+        """
+        Record received packet.
+        :param topic: MQTT topic of the packet
+        :param rssi: RSSI of the packet in dBm
+        :param seq: sequence number of the packet, None if not present
+        """
+        slot = self._slot(topic)
+        if slot is None:
+            self.untracked += 1
+            return
+
+        now = time.monotonic_ns()
+        alpha = self._alpha
+        if self._packets[slot] == 0:
+            self._rssi_avg[slot] = rssi
+            self._rssi_min[slot] = rssi
+        else:
+            self._rssi_avg[slot] += alpha * (rssi - self._rssi_avg[slot])
+            self._rssi_min[slot] = min(rssi, self._rssi_min[slot])
+            interval = (now - self._last_stamp[slot]) / 1_000_000_000
+            if self._packets[slot] == 1:
+                self._interval_avg[slot] = interval
+            else:
+                self._interval_avg[slot] += alpha * (
+                    interval - self._interval_avg[slot]
+                )
+        self._last_stamp[slot] = now
+        self._packets[slot] += 1
+
+        if seq is not None:
+            self._update_seq(slot, seq)
+
+    def summary(self):
+        """
+        :return: dictionary of MQTT topic to dictionary with the average and minimum RSSI,
+        average interval between packets and time since the last packet (both in seconds),
+        number of packets and, for senders with sequence numbers, number of lost packets
+        and the loss rate
+        """
+        now = time.monotonic_ns()
+        summary = {}
+        for topic, slot in self._slots.items():
+            link = {
+                "rssi_avg": round(self._rssi_avg[slot], 1),
+                "rssi_min": self._rssi_min[slot],
+                "interval": round(self._interval_avg[slot], 1),
+                "last_seen": (now - self._last_stamp[slot]) // 1_000_000_000,
+                "packets": self._packets[slot],
+            }
+            if self._last_seq[slot] is not None:
+                lost = self._lost[slot]
+                link["lost"] = lost
+                link["loss_rate"] = round(lost / (lost + self._seq_packets[slot]), 3)
+            summary[topic] = link
+
+        return summary
@@ -49,3 +49,13 @@ def get_log_level(level):
         return None
     except AttributeError:
         return None
+
+
+def debug_enabled(logger):
+    """
+    adafruit_logging formats the message (both f-string and % args) before checking the level,
+    so debug messages with non-trivial arguments on the hot path should be guarded by this.
+    :param logger: Logger object
+    :return: whether the logger emits debug messages
+    """
+    return logger.getEffectiveLevel() <= logging.DEBUG
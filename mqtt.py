@@ -6,10 +6,65 @@ import ssl
 
 import adafruit_logging as logging
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
+from adafruit_ticks import ticks_ms
+
+from logutil import debug_enabled
 
 # Avoid infinite recursion by using non-default logger in the MQTT callbacks.
 MQTT_LOGGER_NAME = "mqtt"
 
+MQTT_PUBLISH_QOS1 = 0x32
+MQTT_PUBLISH_DUP = 0x08
+MQTT_PUBACK = 0x40
+
+
+class PipelinedMQTT(MQTT.MQTT):
+    """
+    MiniMQTT client that can publish QoS 1 messages without waiting for the PUBACK.
+
+    The PUBACKs are received in loop() and handed over to the on_puback callback
+    with the packet ID. The blocking publish() with QoS 1 cannot be used with this client
+    as it expects to receive the PUBACK itself.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_puback = None
+
+    def _wait_for_msg(self, timeout=None):
+        """
+        Complete the reading of PUBACK packets, the parent only reads their first byte.
+        """
+        rc = super()._wait_for_msg(timeout)
+        if rc == MQTT_PUBACK:
+            self._sock_exact_recv(1)  # remaining length, always 2
+            pid_buf = self._sock_exact_recv(2)
+            if self.on_puback is not None:
+                self.on_puback(pid_buf[0] << 8 | pid_buf[1])
+
+        return rc
+
+    def publish_nowait(self, topic, msg, pid, dup=False):
+        """
+        Send QoS 1 PUBLISH packet and return without waiting for the PUBACK.
+        :param topic: MQTT topic
+        :param msg: payload (bytes)
+        :param pid: packet ID (1-65535)
+        :param dup: whether this is retransmission
+        """
+        topic_bytes = topic.encode("utf-8")
+        header = bytearray((MQTT_PUBLISH_QOS1 | (MQTT_PUBLISH_DUP if dup else 0),))
+        self._encode_remaining_length(header, 2 + len(topic_bytes) + 2 + len(msg))
+        header.append(len(topic_bytes) >> 8)
+        header.append(len(topic_bytes) & 0xFF)
+        header.extend(topic_bytes)
+        header.append(pid >> 8)
+        header.append(pid & 0xFF)
+
+        self._send_bytes(header)
+        self._send_bytes(msg)
+        self._last_msg_sent_timestamp = ticks_ms()
+
 
 # pylint: disable=unused-argument, redefined-outer-name, invalid-name
 def connect(mqtt_client, userdata, flags, rc):
@@ -20,7 +75,8 @@ def connect(mqtt_client, userdata, flags, rc):
     logger = logging.getLogger(MQTT_LOGGER_NAME)
 
     logger.info("Connected to MQTT Broker!")
-    logger.debug(f"Flags: {flags}\n RC: {rc}")
+    if debug_enabled(logger):
+        logger.debug(f"Flags: {flags}\n RC: {rc}")
 
 
 # pylint: disable=unused-argument, invalid-name
@@ -50,12 +106,16 @@ def mqtt_client_setup(pool, broker, port, log_level, socket_timeout=1):
     logger = logging.getLogger(MQTT_LOGGER_NAME)
     logger.setLevel(log_level)
 
-    mqtt_client = MQTT.MQTT(
+    mqtt_client = PipelinedMQTT(
         broker=broker,
         port=port,
         socket_pool=pool,
         ssl_context=ssl.create_default_context(),
         socket_timeout=socket_timeout,
+        # Single connect attempt that does not block for too long,
+        # the reconnects are handled by ConnectionSupervisor.
+        connect_retries=1,
+        recv_timeout=3,
     )
 
     # Connect callback handlers to mqtt_client
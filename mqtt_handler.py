@@ -2,41 +2,211 @@
 # SPDX-License-Identifier: Unlicense
 """
 MQTT logging handler - log records will be published as MQTT messages
+
+The records are buffered and published in batches from the main loop (see poll())
+so that logging never waits for the broker.
 """
 
+import time
+
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
 
 # adafruit_logging defines log levels dynamically.
 # pylint: disable=no-name-in-module
-from adafruit_logging import NOTSET, Handler, LogRecord
+from adafruit_logging import ERROR, NOTSET, WARNING, Handler, LogRecord
+
+from reconnect import CONNECTION_ERRORS
 
 
-class MQTTHandler(Handler):
+class MQTTHandler(Handler):  # pylint: disable=too-many-instance-attributes
     """
     Log handler that emits log records as MQTT PUBLISH messages.
+
+    The records are kept in a bounded ring buffer. Repeated messages are coalesced
+    into single record with a count. When the buffer is full, the oldest record
+    below the drop level is evicted to make room, or the new record is dropped
+    if it is below the drop level itself.
     """
 
-    def __init__(self, mqtt_client: MQTT.MQTT, topic: str) -> None:
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        mqtt_client: MQTT.MQTT,
+        topic: str,
+        *,
+        capacity: int = 32,
+        flush_interval: float = 1,
+        batch_size: int = 8,
+        flush_level: int = ERROR,
+        drop_level: int = WARNING,
+    ) -> None:
         """
-        Assumes that the MQTT client object is already connected.
+        :param mqtt_client: MQTT client object
+        :param topic: MQTT topic to publish the log messages to
+        :param capacity: maximum number of buffered records
+        :param flush_interval: minimum interval between the publishes in seconds
+        :param batch_size: maximum number of records published in single message
+        :param flush_level: records of this level or higher are published
+        without waiting for the flush interval
+        :param drop_level: records below this level are dropped first when the buffer is full
         """
         super().__init__()
 
         self._mqtt_client = mqtt_client
         self._topic = topic
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._flush_level = flush_level
+        self._drop_level = drop_level
+
+        self._levels = [NOTSET] * capacity
+        self._msgs = [None] * capacity
+        self._counts = [0] * capacity
+        self._head = 0  # index of the oldest record
+        self._len = 0
+        self._flush_pending = False
+        self._flush_stamp = time.monotonic()
+
+        # Statistics.
+        self.dropped = 0
+        self.coalesced = 0
+        self.published = 0
+        self._dropped_unreported = 0
 
         # To make it work also in CPython.
         self.level = NOTSET
 
+    def __len__(self):
+        return self._len
+
+    def _index(self, pos):
+        """
+        :return: buffer index of the record at given position from the oldest
+        """
+        return (self._head + pos) % len(self._msgs)
+
+    def _remove(self, pos):
+        """
+        Remove the record at given position by shifting the newer records.
+        """
+        for i in range(pos, self._len - 1):
+            src = self._index(i + 1)
+            dst = self._index(i)
+            self._levels[dst] = self._levels[src]
+            self._msgs[dst] = self._msgs[src]
+            self._counts[dst] = self._counts[src]
+        self._msgs[self._index(self._len - 1)] = None
+        self._len -= 1
+
+    def _make_room(self, levelno):
+        """
+        Evict a record so that new record of given level can be stored.
+        :return: True if there is room for the new record, False if it should be dropped
+        """
+        for pos in range(self._len):
+            if self._levels[self._index(pos)] < self._drop_level:
+                self._remove(pos)
+                return True
+
+        if levelno < self._drop_level:
+            return False
+
+        self._remove(0)
+        return True
+
     def emit(self, record: LogRecord) -> None:
         """
-        Publish message from the LogRecord to the MQTT broker, if connected.
+        Buffer the message from the LogRecord.
         """
+        if record.levelno >= self._flush_level:
+            self._flush_pending = True
+
+        if self._len > 0:
+            last = self._index(self._len - 1)
+            if self._msgs[last] == record.msg:
+                self._counts[last] += 1
+                self._levels[last] = max(self._levels[last], record.levelno)
+                self.coalesced += 1
+                return
+
+        if self._len == len(self._msgs):
+            # Either the evicted or the new record is lost.
+            self.dropped += 1
+            self._dropped_unreported += 1
+            if not self._make_room(record.levelno):
+                return
+
+        idx = self._index(self._len)
+        self._levels[idx] = record.levelno
+        self._msgs[idx] = record.msg
+        self._counts[idx] = 1
+        self._len += 1
+
+    def _batch(self):
+        """
+        Remove up to batch size of the oldest records from the buffer.
+        :return: the records joined into single message
+        """
+        lines = []
+        if self._dropped_unreported > 0:
+            lines.append(f"({self._dropped_unreported} log records dropped)")
+            self._dropped_unreported = 0
+        for _ in range(min(self._batch_size, self._len)):
+            idx = self._head
+            count = self._counts[idx]
+            if count > 1:
+                lines.append(f"{self._msgs[idx]} (repeated {count} times)")
+            else:
+                lines.append(self._msgs[idx])
+            self._msgs[idx] = None
+            self._head = (self._head + 1) % len(self._msgs)
+            self._len -= 1
+
+        return "\n".join(lines)
+
+    def flush(self) -> None:
+        """
+        Publish single batch of the buffered records to the MQTT broker, if connected.
+        The number of the dropped records is published even if the buffer is empty.
+        If the publishing fails, the records of the batch are counted as dropped
+        (the connection loss is left to be noticed by the main loop).
+        """
+        if self._len == 0 and self._dropped_unreported == 0:
+            self._flush_pending = False
+            return
+
+        dropped_unreported = self._dropped_unreported
+        buffered = self._len
         try:
-            if self._mqtt_client.is_connected():
-                self._mqtt_client.publish(self._topic, record.msg)
-        except MQTT.MMQTTException:
-            pass
+            if not self._mqtt_client.is_connected():
+                return
+            self._mqtt_client.publish(self._topic, self._batch())
+            self.published += 1
+        except CONNECTION_ERRORS + (ValueError,):
+            # The records of the batch are lost, report them with the next one.
+            lost = buffered - self._len
+            self.dropped += lost
+            self._dropped_unreported = dropped_unreported + lost
+
+        self._flush_stamp = time.monotonic()
+        self._flush_pending = self._len > 0 and self._flush_pending
+
+    def poll(self) -> None:
+        """
+        To be called from the main loop. Publish the buffered records if the flush interval
+        has elapsed, a record of high severity was logged or the buffer holds
+        more than single batch. The number of the dropped records alone is published
+        once the flush interval elapses.
+        """
+        if self._len == 0 and self._dropped_unreported == 0:
+            return
+
+        if (
+            self._flush_pending
+            or self._len >= self._batch_size
+            or time.monotonic() - self._flush_stamp >= self._flush_interval
+        ):
+            self.flush()
 
     # To make this work also in CPython's logging.
     def handle(self, record: LogRecord) -> None:
@@ -0,0 +1,482 @@
+"""
+Radio packet decoding
+
+The decoder is meant to be created once at startup so that the per packet work
+is reduced to a single unpack of the receive buffer.
+"""
+
+import math
+import struct
+
+# Maximum payload size of RFM69 packet.
+MAX_PACKET_LEN = 60
+
+MQTT_PREFIX = b"MQTT:"
+_LEGACY_FIRST_BYTE = MQTT_PREFIX[0]
+MAX_MQTT_TOPIC_LEN = 32
+
+# Names of the sensor fields carried in the legacy packet, in the packed order.
+FIELD_NAMES = ("humidity", "temperature", "co2_ppm", "battery_level", "lux")
+LEGACY_FMT = ">ffIff"
+
+# Frame types, i.e. the first byte of the compact packets.
+# These cannot clash with the first byte of MQTT_PREFIX.
+FRAME_COMPACT = 1
+FRAME_BATCH = 2
+FRAME_BATCH_DELTA = 3
+FRAME_COMPACT_SEQ = 4
+
+# frame type, schema ID, topic ID
+COMPACT_HEADER_FMT = ">BBH"
+COMPACT_HEADER_LEN = struct.calcsize(COMPACT_HEADER_FMT)
+# frame type, schema ID, topic ID, sequence number
+COMPACT_SEQ_HEADER_FMT = ">BBHB"
+COMPACT_SEQ_HEADER_LEN = struct.calcsize(COMPACT_SEQ_HEADER_FMT)
+# frame type, schema ID, topic ID, number of records
+BATCH_HEADER_FMT = ">BBHB"
+BATCH_HEADER_LEN = struct.calcsize(BATCH_HEADER_FMT)
+# age of the record in seconds
+AGE_FMT = "H"
+# The delta encoded records carry the difference of the age (the previous record age
+# minus the current record age) and the differences of the values.
+# The differences of the float values are in hundredths.
+DELTA_AGE_FMT = "B"
+DELTA_VALUE_FMT = "h"
+DELTA_FLOAT_SCALE = 100
+# Delta value marking value that was not measured.
+DELTA_NOT_MEASURED = -32768
+
+
+class PacketDecodingError(Exception):
+    """
+    Exception raised when a packet cannot be decoded.
+    """
+
+
+class TopicNotAllowedError(PacketDecodingError):
+    """
+    Exception raised when the packet was decoded however its topic is not allowed.
+    """
+
+
+def fields_to_dict(values):
+    """
+    Convert tuple of sensor values in the legacy layout to dictionary, omitting the values
+    that were not measured (NaN for the float values, zero for CO2).
+    """
+    humidity, temperature, co2_ppm, battery_level, lux = values
+    pub_data_dict = {}
+    # NaN is the only value not equal to itself.
+    # pylint: disable=comparison-with-itself
+    if humidity == humidity:
+        pub_data_dict["humidity"] = humidity
+    if temperature == temperature:
+        pub_data_dict["temperature"] = temperature
+    if co2_ppm != 0:
+        pub_data_dict["co2_ppm"] = co2_ppm
+    if battery_level == battery_level:
+        pub_data_dict["battery_level"] = battery_level
+    if lux == lux:
+        pub_data_dict["lux"] = lux
+
+    return pub_data_dict
+
+
+def fields_mask(values):
+    """
+    Same as Schema.mask() for the sensor values in the legacy layout, unrolled.
+    """
+    humidity, temperature, co2_ppm, battery_level, lux = values
+    mask = 0
+    # pylint: disable=comparison-with-itself
+    if humidity == humidity:
+        mask = 1
+    if temperature == temperature:
+        mask |= 2
+    if co2_ppm != 0:
+        mask |= 4
+    if battery_level == battery_level:
+        mask |= 8
+    if lux == lux:
+        mask |= 16
+
+    return mask
+
+
+class Schema:  # pylint: disable=too-many-instance-attributes
+    """
+    Layout of the sensor values in the packet.
+    """
+
+    def __init__(self, schema_id, fmt, field_names):
+        """
+        :param schema_id: schema ID (0-255)
+        :param fmt: struct format of the values
+        :param field_names: names of the values, in the packed order
+        """
+        self.schema_id = schema_id
+        self.fmt = fmt
+        self.size = struct.calcsize(fmt)
+        self.field_names = field_names
+        values = struct.unpack(fmt, bytes(self.size))
+        if len(field_names) != len(values):
+            raise ValueError(f"field names do not match the format {fmt}")
+        # tuple of (name, is float) for each value
+        self.fields = tuple(
+            (name, isinstance(value, float)) for name, value in zip(field_names, values)
+        )
+        # The most common layout is converted by the unrolled function,
+        # without going through the generic method.
+        if fmt == LEGACY_FMT and tuple(field_names) == FIELD_NAMES:
+            self.to_dict = fields_to_dict
+            self.mask = fields_mask
+
+        # Formats of the records in the batch frames.
+        self.record_fmt = f">{AGE_FMT}{fmt[1:]}"
+        self.record_size = struct.calcsize(self.record_fmt)
+        self.delta_fmt = f">{DELTA_AGE_FMT}{DELTA_VALUE_FMT * len(values)}"
+        self.delta_size = struct.calcsize(self.delta_fmt)
+
+    def apply_delta(self, values, deltas):
+        """
+        Compute values of delta encoded record.
+        :param values: values of the previous record
+        :param deltas: the differences as unpacked using delta_fmt (the age delta being first)
+        :return: tuple of the values
+        """
+        return tuple(
+            _apply_delta(is_float, value, deltas[i])
+            for i, ((_, is_float), value) in enumerate(zip(self.fields, values), 1)
+        )
+
+    def to_dict(self, values):  # pylint: disable=method-hidden
+        """
+        Convert tuple of sensor values to dictionary, omitting the values that were not measured
+        (NaN for the float values, zero for the integer values such as CO2).
+        """
+        pub_data_dict = {}
+        i = 0
+        for name, is_float in self.fields:
+            value = values[i]
+            i += 1
+            # NaN is the only value not equal to itself.
+            # pylint: disable=comparison-with-itself
+            if (value == value) if is_float else value != 0:
+                pub_data_dict[name] = value
+
+        return pub_data_dict
+
+    def mask(self, values):  # pylint: disable=method-hidden
+        """
+        :return: bit mask of the measured values (bit i set if the i-th value was measured),
+        the values that were not measured being the same as in to_dict()
+        """
+        mask = 0
+        bit = 1
+        i = 0
+        for _, is_float in self.fields:
+            value = values[i]
+            i += 1
+            # pylint: disable=comparison-with-itself
+            if (value == value) if is_float else value != 0:
+                mask |= bit
+            bit <<= 1
+
+        return mask
+
+
+def _apply_delta(is_float, value, delta):
+    """
+    Apply the difference to a value. If the previous value was not measured,
+    the difference is relative to zero.
+    """
+    if is_float:
+        if delta == DELTA_NOT_MEASURED:
+            return math.nan
+        # pylint: disable=comparison-with-itself
+        if value != value:
+            value = 0.0
+        return value + delta / DELTA_FLOAT_SCALE
+
+    if delta == DELTA_NOT_MEASURED:
+        return 0
+    return value + delta
+
+
+# Schema of the values in the legacy packet (the one with MQTT_PREFIX).
+LEGACY_SCHEMA = Schema(0, LEGACY_FMT, FIELD_NAMES)
+
+# Schema ID to schema mapping for the compact packets.
+SCHEMAS = {
+    1: Schema(1, LEGACY_FMT, FIELD_NAMES),
+    2: Schema(2, ">fff", ("humidity", "temperature", "battery_level")),
+    3: Schema(3, ">If", ("co2_ppm", "battery_level")),
+}
+
+
+def is_batch(packet):
+    """
+    :return: True if the packet is a batch frame with multiple records
+    """
+    return len(packet) > 0 and packet[0] in (FRAME_BATCH, FRAME_BATCH_DELTA)
+
+
+class PacketDecoder:  # pylint: disable=too-many-instance-attributes
+    """
+    Decoder of the radio packets. The following formats are accepted:
+      - legacy: MQTT_PREFIX, NUL padded topic and the values of LEGACY_SCHEMA
+      - compact: FRAME_COMPACT, schema ID, topic ID and the values of the schema
+      - compact with sequence number: FRAME_COMPACT_SEQ, schema ID, topic ID,
+        sequence number (0-255, incremented by the sender for each packet) and the values
+      - batch: FRAME_BATCH, schema ID, topic ID, number of records
+        and the records, each consisting of age and the values of the schema
+      - delta encoded batch: FRAME_BATCH_DELTA, schema ID, topic ID, number of records,
+        the first record as in the batch frame and the rest of the records delta encoded
+
+    The struct formats are built once. The packets with single reading are decoded inline,
+    the records of the batch frames by generators. The values are unpacked from memoryview
+    of the receive buffer rather than from a copy of it. The topic strings are cached
+    per distinct topic field so that repeated packets from the same sender do not decode
+    the topic again.
+    """
+
+    def __init__(self, topic_ids=None, schemas=None, max_cached_topics=32):
+        """
+        :param topic_ids: dictionary of topic ID to MQTT topic for the compact packets
+        :param schemas: dictionary of schema ID to Schema for the compact packets
+        :param max_cached_topics: maximum number of cached legacy topics
+        """
+        self._fmt = f">{len(MQTT_PREFIX)}s{MAX_MQTT_TOPIC_LEN}s{LEGACY_SCHEMA.fmt[1:]}"
+        self._size = struct.calcsize(self._fmt)
+        if self._size > MAX_PACKET_LEN:
+            raise ValueError(
+                f"the format for structure packing is bigger than {MAX_PACKET_LEN} bytes"
+            )
+
+        self._topic_ids = topic_ids if topic_ids is not None else {}
+        self._schemas = schemas if schemas is not None else SCHEMAS
+        for schema in self._schemas.values():
+            if COMPACT_SEQ_HEADER_LEN + schema.size > MAX_PACKET_LEN:
+                raise ValueError(f"schema {schema.schema_id} does not fit the packet")
+
+        self._topic_cache = {}
+        self._max_cached_topics = max_cached_topics
+
+        # MQTT topic and sequence number (None if not present) of the last decoded packet.
+        self.last_topic = None
+        self.last_seq = None
+
+    @property
+    def size(self):
+        """
+        :return: size of the legacy packet in bytes
+        """
+        return self._size
+
+    def _topic(self, topic_field):
+        """
+        Convert the NUL padded topic field to string, using the cache.
+        """
+        mqtt_topic = self._topic_cache.get(topic_field)
+        if mqtt_topic is not None:
+            return mqtt_topic
+
+        nul_idx = topic_field.find(b"\x00")
+        try:
+            if nul_idx > 0:
+                mqtt_topic = topic_field[:nul_idx].decode("ascii")
+            else:
+                mqtt_topic = topic_field.decode("ascii")
+        except UnicodeError as unicode_exc:
+            raise PacketDecodingError(
+                f"failed to decode topic: {topic_field}"
+            ) from unicode_exc
+
+        # Bounded so that garbage packets cannot exhaust the memory.
+        if len(self._topic_cache) < self._max_cached_topics:
+            self._topic_cache[topic_field] = mqtt_topic
+
+        return mqtt_topic
+
+    def _lookup(self, schema_id, topic_id):
+        """
+        :return: tuple of Schema and MQTT topic
+        Raises PacketDecodingError if either is not known.
+        """
+        schema = self._schemas.get(schema_id)
+        if schema is None:
+            raise PacketDecodingError(f"unknown schema ID: {schema_id}")
+
+        mqtt_topic = self._topic_ids.get(topic_id)
+        if mqtt_topic is None:
+            raise PacketDecodingError(f"unknown topic ID: {topic_id}")
+
+        return schema, mqtt_topic
+
+    @staticmethod
+    def _check_length(packet, expected_len):
+        """
+        Raises PacketDecodingError if the packet length does not match.
+        """
+        if len(packet) != expected_len:
+            raise PacketDecodingError(
+                f"invalid packet length: {len(packet)} should be {expected_len}"
+            )
+
+    def _decode_compact_seq(self, packet):
+        """
+        Decode the compact packet with sequence number.
+        :return: tuple of MQTT topic, Schema, tuple of the sensor values and sequence number
+        """
+        if len(packet) < COMPACT_SEQ_HEADER_LEN:
+            raise PacketDecodingError(f"packet too short: {len(packet)}")
+
+        buf = memoryview(packet)
+        _, schema_id, topic_id, seq = struct.unpack_from(COMPACT_SEQ_HEADER_FMT, buf, 0)
+        schema, mqtt_topic = self._lookup(schema_id, topic_id)
+        self._check_length(packet, COMPACT_SEQ_HEADER_LEN + schema.size)
+
+        try:
+            values = struct.unpack_from(schema.fmt, buf, COMPACT_SEQ_HEADER_LEN)
+        except (RuntimeError, ValueError) as e:
+            raise PacketDecodingError("failed to unpack data") from e
+
+        return mqtt_topic, schema, values, seq
+
+    def _batch_header(self, packet):
+        """
+        :return: tuple of memoryview of the packet, Schema, MQTT topic and number of records
+        """
+        if len(packet) < BATCH_HEADER_LEN:
+            raise PacketDecodingError(f"packet too short: {len(packet)}")
+
+        buf = memoryview(packet)
+        _, schema_id, topic_id, count = struct.unpack_from(BATCH_HEADER_FMT, buf, 0)
+        if count == 0:
+            raise PacketDecodingError("empty batch")
+        schema, mqtt_topic = self._lookup(schema_id, topic_id)
+
+        return buf, schema, mqtt_topic, count
+
+    def _records_batch(self, packet):
+        """
+        Generator yielding the records of the batch frame.
+        """
+        buf, schema, mqtt_topic, count = self._batch_header(packet)
+        self._check_length(packet, BATCH_HEADER_LEN + count * schema.record_size)
+        self.last_topic = mqtt_topic
+
+        offset = BATCH_HEADER_LEN
+        for _ in range(count):
+            record = struct.unpack_from(schema.record_fmt, buf, offset)
+            offset += schema.record_size
+            yield mqtt_topic, schema, record[1:], record[0]
+
+    def _records_batch_delta(self, packet):
+        """
+        Generator yielding the records of the delta encoded batch frame.
+        """
+        buf, schema, mqtt_topic, count = self._batch_header(packet)
+        self._check_length(
+            packet,
+            BATCH_HEADER_LEN + schema.record_size + (count - 1) * schema.delta_size,
+        )
+        self.last_topic = mqtt_topic
+
+        record = struct.unpack_from(schema.record_fmt, buf, BATCH_HEADER_LEN)
+        age = record[0]
+        values = record[1:]
+        yield mqtt_topic, schema, values, age
+
+        offset = BATCH_HEADER_LEN + schema.record_size
+        for _ in range(count - 1):
+            deltas = struct.unpack_from(schema.delta_fmt, buf, offset)
+            offset += schema.delta_size
+            age = max(age - deltas[0], 0)
+            values = schema.apply_delta(values, deltas)
+            yield mqtt_topic, schema, values, age
+
+    def decode(self, packet):  # pylint: disable=too-many-branches
+        """
+        Decode packet carrying single reading. The legacy and compact packets
+        (the per packet hot path) are decoded inline.
+        Once the packet is decoded, its MQTT topic and sequence number are available
+        in the last_topic and last_seq attributes (these are not updated if the packet
+        cannot be decoded).
+        :param packet: bytes/bytearray/memoryview with the packet
+        :return: tuple of MQTT topic, Schema and tuple of the sensor values
+        Raises PacketDecodingError on error.
+        """
+        if not packet:
+            raise PacketDecodingError("empty packet")
+
+        frame = packet[0]
+        if frame == _LEGACY_FIRST_BYTE:
+            if len(packet) != self._size:
+                raise PacketDecodingError(
+                    f"invalid packet length: {len(packet)} should be {self._size}"
+                )
+            try:
+                data = struct.unpack_from(self._fmt, memoryview(packet), 0)
+            except (RuntimeError, ValueError) as e:
+                raise PacketDecodingError("failed to unpack data") from e
+            if data[0] != MQTT_PREFIX:
+                raise PacketDecodingError(f"not a MQTT prefix: {data[0]}")
+            mqtt_topic = self._topic_cache.get(data[1])
+            if mqtt_topic is None:
+                mqtt_topic = self._topic(data[1])
+            self.last_topic = mqtt_topic
+            self.last_seq = None
+            return mqtt_topic, LEGACY_SCHEMA, data[2:]
+
+        if frame == FRAME_COMPACT:
+            packet_len = len(packet)
+            if packet_len < COMPACT_HEADER_LEN:
+                raise PacketDecodingError(f"packet too short: {packet_len}")
+            buf = memoryview(packet)
+            _, schema_id, topic_id = struct.unpack_from(COMPACT_HEADER_FMT, buf, 0)
+            schema, mqtt_topic = self._lookup(schema_id, topic_id)
+            if packet_len != COMPACT_HEADER_LEN + schema.size:
+                raise PacketDecodingError(
+                    f"invalid packet length: {packet_len} "
+                    f"should be {COMPACT_HEADER_LEN + schema.size}"
+                )
+            try:
+                values = struct.unpack_from(schema.fmt, buf, COMPACT_HEADER_LEN)
+            except (RuntimeError, ValueError) as e:
+                raise PacketDecodingError("failed to unpack data") from e
+            self.last_topic = mqtt_topic
+            self.last_seq = None
+            return mqtt_topic, schema, values
+
+        if frame == FRAME_COMPACT_SEQ:
+            mqtt_topic, schema, values, seq = self._decode_compact_seq(packet)
+            self.last_topic = mqtt_topic
+            self.last_seq = seq
+            return mqtt_topic, schema, values
+
+        if frame in (FRAME_BATCH, FRAME_BATCH_DELTA):
+            raise PacketDecodingError("batch frame carries multiple readings")
+
+        raise PacketDecodingError(f"unknown frame type: {frame}")
+
+    def records(self, packet):
+        """
+        Decode packet of any format. The records of the batch frames are decoded
+        one at a time by generator (the packet length is checked before the first record
+        is yielded), the packets with single reading are decoded by decode().
+        :param packet: bytes/bytearray/memoryview with the packet
+        :return: iterable of tuples of MQTT topic, Schema, tuple of the sensor values
+        and age of the record in seconds (None for packets with single reading)
+        Raises PacketDecodingError on error.
+        """
+        if not is_batch(packet):
+            mqtt_topic, schema, values = self.decode(packet)
+            return ((mqtt_topic, schema, values, None),)
+
+        # The topic is set by the generators once the header is decoded.
+        self.last_topic = None
+        self.last_seq = None
+        if packet[0] == FRAME_BATCH:
+            return self._records_batch(packet)
+        return self._records_batch_delta(packet)
@@ -0,0 +1,103 @@
+"""
+Packet reception driven by the RFM69 DIO0 (PayloadReady) line
+
+In receive mode, the RFM69 raises DIO0 when there is a complete packet in the FIFO.
+The edges are counted in the background by countio so the FIFO is read only when
+a packet is there, without polling the radio over SPI.
+"""
+
+import time
+
+try:
+    # pylint: disable=import-error
+    import countio
+except ImportError:
+    countio = None
+
+
+def poll_packets(rfm69, timeout, with_header=False):
+    """
+    Generator yielding packet received within the timeout, if any, by polling the radio.
+    :param with_header: whether to keep the RadioHead header in the packets
+    """
+    packet = rfm69.receive(timeout=timeout, with_header=with_header)
+    if packet is not None:
+        yield packet
+
+
+class PacketReady:
+    """
+    Counts the rising edges on the DIO0 line and drains the FIFO when an edge is seen.
+    """
+
+    def __init__(self, pin, sleep_interval=0.001, check_interval=0.1):
+        """
+        :param pin: microcontroller pin connected to DIO0
+        :param sleep_interval: granularity of waiting for the edge, in seconds
+        :param check_interval: how often to check the radio for packet with missed edge,
+        in seconds
+        Raises RuntimeError if countio is not available.
+        """
+        if countio is None:
+            raise RuntimeError("countio is not available")
+
+        self._counter = countio.Counter(pin, edge=countio.Edge.RISE)
+        self._sleep_interval = sleep_interval
+        self._check_interval = check_interval
+        self._check_stamp = time.monotonic()
+
+        # Statistics.
+        self.edges = 0
+        self.packets = 0
+        self.missed_edges = 0
+
+    def packets_per_edge(self):
+        """
+        :return: average number of packets read per edge
+        """
+        if self.edges == 0:
+            return 0
+
+        return self.packets / self.edges
+
+    def _wait(self, timeout):
+        """
+        Wait for the edge(s).
+        :return: number of edges seen
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            count = self._counter.count
+            if count > 0:
+                self._counter.reset()
+                return count
+            if time.monotonic() >= deadline:
+                return 0
+            time.sleep(self._sleep_interval)
+
+    def __call__(self, rfm69, timeout, with_header=False):
+        """
+        Generator yielding the packets received within the timeout.
+        After the edge, the FIFO is drained so that packets received back-to-back
+        are picked up without waiting for another edge.
+        :param with_header: whether to keep the RadioHead header in the packets
+        """
+        edges = self._wait(timeout)
+        if edges == 0:
+            # Edge can be missed if it comes between reading and resetting the counter.
+            # The packet would stay in the FIFO until read so check for it once in a while.
+            now = time.monotonic()
+            if now - self._check_stamp < self._check_interval:
+                return
+            self._check_stamp = now
+            if not rfm69.payload_ready():
+                return
+            self.missed_edges += 1
+            edges = 1
+
+        self.edges += edges
+        while rfm69.payload_ready():
+            packet = rfm69.receive(timeout=0, with_header=with_header)
+            if packet is not None:
+                self.packets += 1
+                yield packet
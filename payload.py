@@ -0,0 +1,94 @@
+"""
+JSON payload of the readings
+
+The readings are kept as tuples of Schema, values and age (None if not present)
+until published so that no dictionary is built for the readings that are dropped.
+Right before publishing, the JSON is produced by filling a template with the values.
+The templates (key fragments with placeholders for the measured values and the age)
+are built once for each schema and combination of the measured values, so that
+the per reading work is computing the mask of the measured values and single
+str.format() call, with no dictionary built. The output is identical to json.dumps()
+of the dictionary (floats are formatted with repr() in both cases), which is
+used for the few readings the templates cannot express (infinite values).
+"""
+
+import json
+
+AGE_KEY = "age"
+
+# Schema to dictionary of the templates keyed by the mask of the measured values
+# with the bit following the value bits set if the age is present.
+_templates = {}
+
+
+def reading_to_dict(reading):
+    """
+    :param reading: tuple of Schema, values and age
+    :return: dictionary of the measured values, with the age item if the age is present
+    """
+    schema, values, age = reading
+    pub_data_dict = schema.to_dict(values)
+    if age is not None:
+        pub_data_dict[AGE_KEY] = age
+
+    return pub_data_dict
+
+
+def _template(schema, key):
+    """
+    Build the str.format() template with positional placeholders
+    of the measured values (and of the age, if present).
+    """
+    items = []
+    for i, (name, _) in enumerate(schema.fields):
+        if key & (1 << i):
+            items.append(f"{json.dumps(name)}: {{{i}!r}}")
+    age_idx = len(schema.fields)
+    if key & (1 << age_idx):
+        items.append(f"{json.dumps(AGE_KEY)}: {{{age_idx}}}")
+
+    return "{{" + ", ".join(items) + "}}"
+
+
+def reading_to_json(reading):
+    """
+    :param reading: tuple of Schema, values and age
+    :return: JSON string, same as json.dumps() of reading_to_dict()
+    """
+    schema, values, age = reading
+    key = schema.mask(values)
+    if age is not None:
+        key |= 1 << len(values)
+        values = values + (age,)
+
+    templates = _templates.get(schema)
+    if templates is None:
+        templates = {}
+        _templates[schema] = templates
+    template = templates.get(key)
+    if template is None:
+        template = _template(schema, key)
+        templates[key] = template
+
+    pub_data = template.format(*values)
+    # repr() of infinite float is not valid JSON, json.dumps() writes Infinity.
+    if "inf" in pub_data:
+        return json.dumps(reading_to_dict(reading))
+
+    return pub_data
+
+
+def serialize(data):
+    """
+    :param data: reading, list of readings (batch frames published as arrays)
+    or already serialized payload (bytes)
+    :return: bytes with the JSON payload
+    """
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, list):
+        return (
+            "[" + ", ".join(reading_to_json(reading) for reading in data) + "]"
+        ).encode("utf-8")
+
+    return reading_to_json(data).encode("utf-8")
@@ -0,0 +1,122 @@
+"""
+Per topic rate limiting of readings
+
+Each topic has a token bucket that is refilled at configured rate. A reading consumes
+one token; readings without available token are dropped or coalesced to the latest one,
+which is released once a token becomes available. This way, a sender stuck
+in a transmit loop cannot flood the broker and delay the readings of the other senders.
+"""
+
+import time
+
+DROP = "drop"
+COALESCE = "coalesce"
+POLICIES = (DROP, COALESCE)
+
+
+class TopicRateLimiter:  # pylint: disable=too-many-instance-attributes
+    """
+    Fixed size table of token buckets, one row per MQTT topic.
+    The topics that do not fit the table share the last row.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, rate, burst=5, rates=None, policy=DROP, max_topics=32):
+        """
+        :param rate: number of readings per minute allowed for each topic
+        :param burst: maximum number of tokens, i.e. readings that can be published at once
+        :param rates: optional dictionary of MQTT topic to rate overriding the default rate
+        :param policy: what to do with the readings over the limit, DROP or COALESCE
+        :param max_topics: size of the table
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"invalid policy: {policy}")
+
+        self._rate = rate
+        self._rates = rates if rates is not None else {}
+        self._burst = burst
+        self._policy = policy
+
+        self._slots = {}  # MQTT topic to row of the table
+        self._tokens = [0.0] * max_topics
+        self._ns_per_token = [0] * max_topics
+        self._stamps = [0] * max_topics  # monotonic_ns() of the last refill
+        # The latest reading over the limit for the coalesce policy, as (topic, reading).
+        self._pending = [None] * max_topics
+
+        # Counters of readings over the limit and of those lost
+        # (dropped or replaced by newer reading).
+        self.limited = 0
+        self.dropped = 0
+
+    def _slot(self, topic):
+        """
+        :return: table row for the topic, allocated and filled with tokens on first use
+        """
+        slot = self._slots.get(topic)
+        if slot is None:
+            slot = min(len(self._slots), len(self._tokens) - 1)
+            if len(self._slots) < len(self._tokens):
+                rate = self._rates.get(topic, self._rate)
+                self._ns_per_token[slot] = 60_000_000_000 // rate
+                self._tokens[slot] = self._burst
+                self._stamps[slot] = time.monotonic_ns()
+            self._slots[topic] = slot
+
+        return slot
+
+    def _refill(self, slot, now):
+        """
+        Add the tokens accumulated since the last refill.
+        """
+        elapsed = now - self._stamps[slot]
+        self._stamps[slot] = now
+        self._tokens[slot] = min(
+            self._burst, self._tokens[slot] + elapsed / self._ns_per_token[slot]
+        )
+
+    def allow(self, topic, reading):
+        """
+        Consume token for the reading. If there is none, the reading is either dropped
+        or kept as the pending reading of the topic, replacing the previous one.
+        :param topic: MQTT topic
+        :param reading: the reading
+        :return: True if the reading can be published now
+        """
+        slot = self._slot(topic)
+        self._refill(slot, time.monotonic_ns())
+        if self._tokens[slot] >= 1:
+            self._tokens[slot] -= 1
+            return True
+
+        self.limited += 1
+        if self._policy == DROP or self._pending[slot] is not None:
+            self.dropped += 1
+        if self._policy == COALESCE:
+            self._pending[slot] = (topic, reading)
+
+        return False
+
+    def release(self, put_func):
+        """
+        Hand over the pending readings of the topics that have token available.
+        :param put_func: function accepting MQTT topic and reading
+        :return: number of released readings
+        """
+        if self._policy != COALESCE:
+            return 0
+
+        now = time.monotonic_ns()
+        count = 0
+        for slot, pending in enumerate(self._pending):
+            if pending is None:
+                continue
+            self._refill(slot, now)
+            if self._tokens[slot] < 1:
+                continue
+            self._tokens[slot] -= 1
+            self._pending[slot] = None
+            put_func(*pending)
+            count += 1
+
+        return count
@@ -0,0 +1,228 @@
+"""
+Re-establishing of lost network/MQTT connection in the main loop
+
+Once the connection is lost, the reconnect attempts are spread by jittered exponential
+backoff and each attempt is short enough not to starve the watchdog, so that the radio
+keeps receiving (and the readings are queued or spooled) in the meantime.
+Only after given number of consecutive failed attempts the ConnectionError is raised,
+leading to hard reset.
+
+The initial connection is established the same way so that the radio is receiving
+already while the network and the MQTT session are coming up.
+"""
+
+import random
+import time
+
+import adafruit_logging as logging
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+
+# Exceptions signalling broken network or MQTT session.
+CONNECTION_ERRORS = (OSError, RuntimeError, MMQTTException)
+
+# Beginnings of the messages of the exceptions raised by publish() of minimqtt
+# for invalid message (older versions raise MMQTTException rather than ValueError).
+_MESSAGE_ERRORS = (
+    "Publish topic",
+    "Topic ",
+    "Encoded topic",
+    "Message ",
+    "Invalid message",
+)
+
+
+def is_message_error(exc):
+    """
+    :return: True if the exception raised by publish() was caused by the message itself
+    (e.g. invalid topic or too big payload) rather than by the connection,
+    i.e. publishing the same message again cannot succeed
+    """
+    if isinstance(exc, ValueError):
+        return True
+    if isinstance(exc, MMQTTException) and exc.args:
+        message = str(exc.args[0])
+        return any(message.startswith(prefix) for prefix in _MESSAGE_ERRORS)
+    return False
+
+
+class ConnectionSupervisor:  # pylint: disable=too-many-instance-attributes
+    """
+    Watches the MQTT client and reconnects it (and the network beneath) when disconnected.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        hw,
+        mqtt_client,
+        watchdog,
+        *,
+        backoff_base=1,
+        backoff_max=60,
+        max_failures=10,
+    ):
+        """
+        :param hw: Hardware object
+        :param mqtt_client: MQTT client object
+        :param watchdog: watchdog object, fed before each reconnect step
+        :param backoff_base: delay after the first failed attempt, in seconds
+        :param backoff_max: maximum delay between the attempts, in seconds
+        :param max_failures: number of consecutive failed attempts after which
+        ConnectionError is raised
+        """
+        self._hw = hw
+        self._mqtt_client = mqtt_client
+        self._watchdog = watchdog
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_failures = max_failures
+
+        self._outage_start = None  # monotonic() when the connection was lost
+        self._next_attempt = 0  # monotonic() of the next reconnect attempt
+        self._consecutive_failures = 0
+        self.connected_once = False
+
+        # Statistics.
+        self.outages = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.outage_total = 0
+        self.outage_max = 0
+
+    def metrics(self):
+        """
+        :return: dictionary with the number of outages, successful reconnects,
+        failed reconnect attempts and the total, maximum and current outage durations
+        in seconds
+        """
+        current = 0
+        if self._outage_start is not None:
+            current = time.monotonic() - self._outage_start
+
+        return {
+            "outages": self.outages,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "outage_total_s": self.outage_total,
+            "outage_max_s": self.outage_max,
+            "outage_current_s": current,
+        }
+
+    def _start_outage(self):
+        """
+        Record the start of outage, unless already in one.
+        """
+        if self._outage_start is None:
+            self._outage_start = time.monotonic()
+            self.outages += 1
+
+    def lost(self, exception):
+        """
+        Handle exception signalling broken connection: close the MQTT session
+        so that it is re-established.
+        :param exception: the exception
+        """
+        logger = logging.getLogger("")
+
+        logger.warning(f"MQTT connection lost: {exception}")
+        self._start_outage()
+        try:
+            self._mqtt_client.disconnect()
+        except CONNECTION_ERRORS:
+            pass
+
+    def _backoff(self):
+        """
+        :return: delay before the next attempt, in seconds
+        """
+        delay = min(
+            self._backoff_max,
+            self._backoff_base * 2 ** (self._consecutive_failures - 1),
+        )
+        # Equal jitter so that multiple gateways do not reconnect in lockstep.
+        return delay / 2 + random.random() * delay / 2
+
+    def _attempt(self):
+        """
+        Single step of (re-)establishing the connection: connect the network if it is down,
+        otherwise the MQTT session. The steps are done in separate calls so that
+        the radio is serviced in between.
+        Raises ConnectionError after too many consecutive failures.
+        :return: True if the MQTT session was established
+        """
+        logger = logging.getLogger("")
+
+        try:
+            self._watchdog.feed()
+            if not self._hw.network_connected():
+                logger.info("Connecting to the network")
+                self._hw.connect_network()
+                return False
+            logger.info("Connecting to the MQTT broker")
+            self._hw.connect_mqtt(self._mqtt_client)
+        except CONNECTION_ERRORS as e:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self._max_failures:
+                raise ConnectionError(
+                    f"giving up after {self._consecutive_failures} reconnect attempts"
+                ) from e
+            delay = self._backoff()
+            logger.warning(f"reconnect failed: {e}, next attempt in {delay:.1f} s")
+            self._next_attempt = time.monotonic() + delay
+            return False
+
+        self._consecutive_failures = 0
+        self._end_outage()
+        return True
+
+    def _end_outage(self):
+        """
+        Record the duration of the outage, if in one.
+        """
+        logger = logging.getLogger("")
+
+        if self._outage_start is None:
+            return
+        duration = time.monotonic() - self._outage_start
+        self._outage_start = None
+        self.outage_total += duration
+        self.outage_max = max(duration, self.outage_max)
+        logger.info(f"connection re-established after {duration:.1f} s")
+
+    def is_connected(self):
+        """
+        :return: True if the MQTT client is connected
+        """
+        return self._mqtt_client.is_connected()
+
+    def poll(self):
+        """
+        Check the connection, attempt to reconnect if disconnected and the backoff elapsed.
+        :return: True if connected
+        """
+        if self._mqtt_client.is_connected():
+            return True
+
+        # Connecting for the first time is not an outage.
+        if self.connected_once:
+            self._start_outage()
+        if time.monotonic() >= self._next_attempt and self._attempt():
+            if self.connected_once:
+                self.reconnects += 1
+            self.connected_once = True
+
+        return self._mqtt_client.is_connected()
+
+    def loop(self, timeout):
+        """
+        Run the MQTT client loop if connected, handle the loss of the connection.
+        :param timeout: timeout of the MQTT client loop, in seconds
+        """
+        if not self.poll():
+            return
+
+        try:
+            self._mqtt_client.loop(timeout)
+        except CONNECTION_ERRORS as e:
+            self.lost(e)
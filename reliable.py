@@ -0,0 +1,130 @@
+"""
+Reliable datagram mode
+
+Each RFM69 packet starts with the RadioHead header (destination node, source node,
+identifier, flags). In this mode the packets addressed to other nodes are rejected
+before decoding and the packets addressed to the gateway are acknowledged once accepted,
+so that the senders using adafruit_rfm69 send_with_ack() retransmit only the packets
+that were not received.
+"""
+
+import time
+
+from packetready import poll_packets
+
+BROADCAST_ADDRESS = 0xFF
+FLAGS_ACK = 0x80
+FLAGS_RETRY = 0x40
+HEADER_LEN = 4
+ACK_PAYLOAD = b"!"
+
+
+class ReliableReceiver:  # pylint: disable=too-many-instance-attributes
+    """
+    Wraps function receiving packets, filters them by the destination address
+    and sends acknowledgements.
+
+    The receiver is called the same way as the wrapped function, i.e. with the RFM69 object
+    and timeout, and yields the packets without the header. Once a packet is accepted,
+    ack() should be called before the next packet is requested.
+    """
+
+    def __init__(self, node, receive_packets=poll_packets, ack_delay=None):
+        """
+        :param node: address of the gateway (0-254)
+        :param receive_packets: function accepting RFM69 object, timeout
+        and the with_header keyword argument, returning iterable of packets
+        :param ack_delay: optional delay before sending the ACK in seconds
+        (to give the sender time to switch to receive mode)
+        """
+        if not 0 <= node < BROADCAST_ADDRESS:
+            raise ValueError(f"invalid node address: {node}")
+
+        self._node = node
+        self._receive_packets = receive_packets
+        self._ack_delay = ack_delay
+        # identifier of the last accepted packet from each source node,
+        # None for the nodes no packet was accepted from yet
+        self._seen_ids = [None] * 256
+        # header of the last yielded packet that needs ACK, as (source, identifier, flags)
+        self._pending = None
+        self._received_ns = 0
+
+        # Statistics.
+        self.foreign = 0
+        self.retries = 0
+        self.acks = 0
+        self.ack_latency_ns_max = 0
+        self.ack_latency_ns_total = 0
+
+    def ack_latency_avg_ms(self):
+        """
+        :return: average time from the reception of a packet to sending its ACK in milliseconds
+        """
+        if self.acks == 0:
+            return 0
+
+        return self.ack_latency_ns_total / self.acks / 1_000_000
+
+    def _send_ack(self, rfm69, source, identifier, flags):
+        """
+        Send ACK packet for given header.
+        """
+        if self._ack_delay is not None:
+            time.sleep(self._ack_delay)
+        rfm69.send(
+            ACK_PAYLOAD,
+            keep_listening=True,
+            destination=source,
+            node=self._node,
+            identifier=identifier,
+            flags=flags | FLAGS_ACK,
+        )
+
+    def ack(self, rfm69):
+        """
+        Acknowledge the last packet, if it was addressed to the gateway.
+        :param rfm69: RFM69 object
+        """
+        if self._pending is None:
+            return
+
+        source, identifier, flags = self._pending
+        self._pending = None
+        self._seen_ids[source] = identifier
+        self._send_ack(rfm69, source, identifier, flags)
+        latency_ns = time.monotonic_ns() - self._received_ns
+        self.acks += 1
+        self.ack_latency_ns_total += latency_ns
+        self.ack_latency_ns_max = max(latency_ns, self.ack_latency_ns_max)
+
+    def __call__(self, rfm69, timeout):
+        """
+        Generator yielding the payloads of the packets for the gateway received within
+        the timeout.
+        """
+        for packet in self._receive_packets(rfm69, timeout, with_header=True):
+            self._pending = None
+            if len(packet) <= HEADER_LEN:
+                continue
+            destination, source, identifier, flags = packet[:HEADER_LEN]
+            if flags & FLAGS_ACK:
+                continue
+            if destination == BROADCAST_ADDRESS:
+                # Broadcasts are not acknowledged.
+                yield packet[HEADER_LEN:]
+                continue
+            if destination != self._node:
+                self.foreign += 1
+                continue
+
+            self._received_ns = time.monotonic_ns()
+            if flags & FLAGS_RETRY and self._seen_ids[source] == identifier:
+                # The packet was received however the ACK was lost. Acknowledge it again
+                # without processing it for the second time.
+                self.retries += 1
+                self._send_ack(rfm69, source, identifier, flags)
+                continue
+
+            self._pending = (source, identifier, flags)
+            yield packet[HEADER_LEN:]
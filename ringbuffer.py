@@ -0,0 +1,164 @@
+"""
+Bounded queue of decoded readings between the radio receive and MQTT publish stages
+"""
+
+import time
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class ReadingQueue:  # pylint: disable=too-many-instance-attributes
+    """
+    Fixed capacity ring buffer of (MQTT topic, data) readings.
+    The storage is preallocated so that no memory is allocated when adding readings.
+
+    When the queue is full, the overflow policy determines what happens with new reading:
+      - drop_oldest: the oldest reading is dropped
+      - drop_newest: the new reading is dropped
+      - coalesce: queued reading for the same topic is replaced with the new one,
+        if there is none, the oldest reading is dropped
+    """
+
+    def __init__(self, capacity, policy=DROP_OLDEST):
+        if capacity < 1:
+            raise ValueError(f"invalid capacity: {capacity}")
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"invalid overflow policy: {policy}")
+
+        self._topics = [None] * capacity
+        self._data = [None] * capacity
+        self._stamps = [0] * capacity  # monotonic_ns() of enqueueing
+        self._capacity = capacity
+        self._policy = policy
+        self._head = 0
+        self._count = 0
+
+        # Counters of readings.
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.published = 0
+
+        # Time from enqueueing to publishing.
+        self.latency_ns_total = 0
+        self.latency_ns_max = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """
+        :return: maximum number of readings in the queue
+        """
+        return self._capacity
+
+    def _pop_oldest(self):
+        """
+        Remove the oldest reading, releasing the references.
+        """
+        self._topics[self._head] = None
+        self._data[self._head] = None
+        self._head = (self._head + 1) % self._capacity
+        self._count -= 1
+
+    def _coalesce(self, topic, data):
+        """
+        Replace the newest queued reading for the topic.
+        :return: True if replaced, False if there is no reading for the topic
+        """
+        for i in range(self._count - 1, -1, -1):
+            idx = (self._head + i) % self._capacity
+            if self._topics[idx] == topic:
+                self._data[idx] = data
+                return True
+
+        return False
+
+    def put(self, topic, data):
+        """
+        Add reading to the queue, applying the overflow policy if the queue is full.
+        :return: True if the reading was queued without dropping anything, False otherwise
+        """
+        self.enqueued += 1
+        if self._count == self._capacity:
+            if self._policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self._policy == COALESCE and self._coalesce(topic, data):
+                self.coalesced += 1
+                return False
+            self._pop_oldest()
+            self.dropped += 1
+            ret = False
+        else:
+            ret = True
+
+        idx = (self._head + self._count) % self._capacity
+        self._topics[idx] = topic
+        self._data[idx] = data
+        self._stamps[idx] = time.monotonic_ns()
+        self._count += 1
+
+        return ret
+
+    def accepts(self):
+        """
+        :return: False if the reading passed to put() would be dropped
+        (the queue is full and the overflow policy is drop_newest), True otherwise
+        """
+        return self._count < self._capacity or self._policy != DROP_NEWEST
+
+    def latency_avg_ms(self):
+        """
+        :return: average time from enqueueing to publishing in milliseconds
+        """
+        if self.published == 0:
+            return 0
+
+        return self.latency_ns_total / self.published / 1_000_000
+
+    def peek(self):
+        """
+        :return: the oldest reading as tuple of topic and data, or None if the queue is empty
+        """
+        if self._count == 0:
+            return None
+
+        return self._topics[self._head], self._data[self._head]
+
+    def pop(self):
+        """
+        Remove the oldest reading.
+        """
+        if self._count > 0:
+            self._pop_oldest()
+
+    def drain(self, publish_func, budget_ms, limit=None):
+        """
+        Publish the queued readings, oldest first, until the queue is empty,
+        the time budget is exhausted or the limit is reached. A reading is removed
+        from the queue only after publish_func returned, so it is kept if publish_func
+        raises an exception.
+        :param publish_func: function accepting topic and data
+        :param budget_ms: time budget in milliseconds
+        :param limit: optional maximum number of readings to publish
+        :return: number of published readings
+        """
+        deadline = time.monotonic_ns() + budget_ms * 1_000_000
+        count = 0
+        now = time.monotonic_ns()
+        while self._count > 0 and now < deadline and (limit is None or count < limit):
+            publish_func(self._topics[self._head], self._data[self._head])
+            now = time.monotonic_ns()
+            latency = now - self._stamps[self._head]
+            self.latency_ns_total += latency
+            self.latency_ns_max = max(latency, self.latency_ns_max)
+            self._pop_oldest()
+            self.published += 1
+            count += 1
+
+        return count
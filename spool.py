@@ -0,0 +1,597 @@
+"""
+Store-and-forward spool of readings on the flash
+
+The readings that cannot be published are appended to a circular file of fixed size
+so that they survive the resets. Once the MQTT broker is reachable again,
+the spool is replayed in rate-limited batches.
+"""
+
+import struct
+import time
+
+import adafruit_logging as logging
+
+from packet import LEGACY_SCHEMA, SCHEMAS
+from payload import serialize
+from reconnect import CONNECTION_ERRORS, is_message_error
+
+try:
+    # pylint: disable=import-error
+    import storage
+except ImportError:
+    # CPython (simulation), the file system is writable as it is.
+    storage = None
+
+# The version 2 files hold binary records that may span multiple slots.
+MAGIC = b"R2M2"
+# magic, sequence number of the last replayed record
+META_FMT = ">4sI"
+# sequence number (0 for empty slot), record type, topic length, data length
+# The lengths are set only in the first slot of the record.
+SLOT_HEADER_FMT = ">IBBH"
+SLOT_HEADER_LEN = struct.calcsize(SLOT_HEADER_FMT)
+SLOT_SIZE = 128
+SLOT_DATA_SIZE = SLOT_SIZE - SLOT_HEADER_LEN
+
+# Record types.
+RECORD_CONT = 0  # continuation of the record from the previous slot
+RECORD_PAYLOAD = 1  # serialized payload (e.g. the aggregates)
+RECORD_READING = 2  # single reading
+RECORD_READINGS = 3  # list of readings (batch frame published as array)
+
+# schema ID, whether the age is present, age
+READING_HEADER_FMT = ">BBH"
+READING_HEADER_LEN = struct.calcsize(READING_HEADER_FMT)
+# schema ID, number of readings, each followed by age and the values
+READINGS_HEADER_FMT = ">BB"
+READINGS_HEADER_LEN = struct.calcsize(READINGS_HEADER_FMT)
+
+
+def values_format(schema):
+    """
+    :return: struct format of the schema values in the spool. The floats are stored
+    as doubles and the integers as long long so that the values computed from the deltas
+    are stored exactly.
+    """
+    return ">" + "".join("d" if is_float else "q" for _, is_float in schema.fields)
+
+
+def remount(readonly):
+    """
+    Remount the root file system, if running on CircuitPython.
+    :param readonly: whether the file system should be read-only for CircuitPython
+    """
+    if storage is not None:
+        storage.remount("/", readonly)
+
+
+class Spool:  # pylint: disable=too-many-instance-attributes
+    """
+    Circular file of fixed size slots. The first slot holds the meta data,
+    the other slots hold the records (MQTT topic and the reading), each record
+    taking one or more consecutive slots. The readings are stored in binary form
+    (schema ID, age and the values), only the readings of unknown schema
+    and the payloads queued already serialized (e.g. the aggregates) are stored as JSON.
+    The slots are written in round-robin fashion and the file never changes its size,
+    which spreads the writes across the flash.
+
+    The file system is remounted for writing only for the duration of the writes,
+    same as in safemode.py. To spare the flash, the meta data (the last replayed record)
+    is not written after each replayed batch but only together with the records
+    or once the spool is empty, so the records replayed just before reset may be
+    replayed again after it.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, path, slots=256, replay_batch=10, replay_interval=1, schemas=None
+    ):
+        """
+        :param path: path of the spool file
+        :param slots: number of slots for the records
+        :param replay_batch: maximum number of records replayed at once
+        :param replay_interval: minimum interval between the replays in seconds
+        :param schemas: dictionary of schema ID to Schema of the readings stored
+        in binary form, by default the legacy and the compact schemas
+        """
+        self._path = path
+        self._slots = slots
+        self._replay_batch = replay_batch
+        self._replay_interval = replay_interval
+        self._replay_stamp = None
+        self._file_size = (slots + 1) * SLOT_SIZE
+        self._buf = bytearray(SLOT_SIZE)
+        # monotonic time of spooling for each slot
+        self._stamps = [0.0] * slots
+        # whether the slot holds the first part of a record
+        self._heads = bytearray(slots)
+        # whether the file has the right magic, otherwise it is created again
+        self._valid = False
+
+        if schemas is None:
+            schemas = dict(SCHEMAS)
+            schemas[LEGACY_SCHEMA.schema_id] = LEGACY_SCHEMA
+        # schema ID to tuple of Schema and the struct formats of the values
+        # without and with the age
+        self._formats = {}
+        for schema_id, schema in schemas.items():
+            fmt = values_format(schema)
+            self._formats[schema_id] = (schema, fmt, f">H{fmt[1:]}")
+
+        self._acked_seq = 0
+        self._tail_seq = 1  # oldest slot not replayed yet
+        self._next_seq = 1
+
+        # Metrics.
+        self.spooled = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.skipped = 0
+        self._replay_ns = 0
+
+        self._load()
+
+    def __len__(self):
+        """
+        :return: number of slots in use
+        """
+        return self._next_seq - self._tail_seq
+
+    def _load(self):
+        """
+        Read the spool file, if it exists, to find the records not replayed yet.
+        """
+        logger = logging.getLogger("")
+
+        try:
+            with open(self._path, "rb") as file_obj:
+                if file_obj.readinto(self._buf) != SLOT_SIZE:
+                    logger.warning(f"ignoring truncated spool file {self._path}")
+                    return
+                magic, acked_seq = struct.unpack_from(META_FMT, self._buf, 0)
+                if magic != MAGIC:
+                    logger.warning(f"ignoring invalid spool file {self._path}")
+                    return
+
+                min_seq = None
+                max_seq = acked_seq
+                for slot in range(self._slots):
+                    if file_obj.readinto(self._buf) != SLOT_SIZE:
+                        break
+                    seq, record_type, _, _ = struct.unpack_from(
+                        SLOT_HEADER_FMT, self._buf, 0
+                    )
+                    if seq > acked_seq:
+                        self._heads[slot] = 0 if record_type == RECORD_CONT else 1
+                        max_seq = max(seq, max_seq)
+                        if min_seq is None or seq < min_seq:
+                            min_seq = seq
+        except OSError:
+            # The file does not exist yet.
+            return
+
+        self._valid = True
+        self._acked_seq = acked_seq
+        self._next_seq = max_seq + 1
+        self._tail_seq = min_seq if min_seq is not None else self._next_seq
+        self._skip_orphans()
+        now = time.monotonic()
+        for i in range(self._slots):
+            self._stamps[i] = now
+        if len(self) > 0:
+            logger.info(f"{len(self)} slots in use in the spool {self._path}")
+
+    def _skip_orphans(self):
+        """
+        Skip the continuation slots at the tail, left over from record
+        whose first slot was overwritten.
+        """
+        while len(self) > 0 and not self._heads[self._tail_seq % self._slots]:
+            self._tail_seq += 1
+
+    def _open_for_write(self):
+        """
+        Open the spool file for writing, create it with the full size if it does not exist
+        (or it is not valid). Assumes the file system is remounted for writing.
+        """
+        try:
+            file_obj = open(self._path, "r+b")  # pylint: disable=consider-using-with
+            file_obj.seek(0, 2)
+            if self._valid and file_obj.tell() == self._file_size:
+                return file_obj
+            file_obj.close()
+        except OSError:
+            pass
+
+        with open(self._path, "wb") as file_obj:
+            struct.pack_into(META_FMT, self._buf, 0, MAGIC, self._acked_seq)
+            file_obj.write(self._buf)
+            self._buf[:] = bytes(SLOT_SIZE)
+            for _ in range(self._slots):
+                file_obj.write(self._buf)
+        self._valid = True
+
+        return open(self._path, "r+b")  # pylint: disable=consider-using-with
+
+    def _write_meta(self, file_obj):
+        """
+        Write the sequence number of the last replayed record, if it changed.
+        """
+        if self._acked_seq == self._tail_seq - 1:
+            return
+
+        self._acked_seq = self._tail_seq - 1
+        struct.pack_into(META_FMT, self._buf, 0, MAGIC, self._acked_seq)
+        file_obj.seek(0)
+        file_obj.write(memoryview(self._buf)[: struct.calcsize(META_FMT)])
+
+    def _encode(self, reading):
+        """
+        :param reading: reading, list of readings or already serialized payload (bytes)
+        :return: tuple of the record type and the record data
+        Raises ValueError if the reading cannot be serialized.
+        """
+        if isinstance(reading, bytes):
+            return RECORD_PAYLOAD, reading
+
+        if isinstance(reading, list):
+            schema = reading[0][0]
+            formats = self._formats.get(schema.schema_id)
+            if (
+                formats is not None
+                and formats[0] is schema
+                and all(r[0] is schema and r[2] is not None for r in reading)
+            ):
+                data = bytearray(
+                    struct.pack(READINGS_HEADER_FMT, schema.schema_id, len(reading))
+                )
+                for _, values, age in reading:
+                    data += struct.pack(formats[2], age, *values)
+                return RECORD_READINGS, data
+        else:
+            schema, values, age = reading
+            formats = self._formats.get(schema.schema_id)
+            if formats is not None and formats[0] is schema:
+                return RECORD_READING, struct.pack(
+                    READING_HEADER_FMT,
+                    schema.schema_id,
+                    age is not None,
+                    age if age is not None else 0,
+                ) + struct.pack(formats[1], *values)
+
+        # Not known schema, not worth the binary form.
+        return RECORD_PAYLOAD, serialize(reading)
+
+    def _decode(self, record_type, data):
+        """
+        :param record_type: record type
+        :param data: memoryview of the record data
+        :return: reading, list of readings or serialized payload (bytes)
+        Raises ValueError if the record is not valid.
+        """
+        if record_type == RECORD_PAYLOAD:
+            return bytes(data)
+
+        if record_type == RECORD_READING:
+            if len(data) < READING_HEADER_LEN:
+                raise ValueError("truncated reading")
+            schema_id, has_age, age = struct.unpack_from(READING_HEADER_FMT, data, 0)
+            schema, fmt, _ = self._schema_formats(schema_id)
+            if len(data) != READING_HEADER_LEN + struct.calcsize(fmt):
+                raise ValueError("invalid reading length")
+            values = struct.unpack_from(fmt, data, READING_HEADER_LEN)
+            return schema, values, age if has_age else None
+
+        if record_type == RECORD_READINGS:
+            if len(data) < READINGS_HEADER_LEN:
+                raise ValueError("truncated readings")
+            schema_id, count = struct.unpack_from(READINGS_HEADER_FMT, data, 0)
+            schema, _, record_fmt = self._schema_formats(schema_id)
+            record_size = struct.calcsize(record_fmt)
+            if len(data) != READINGS_HEADER_LEN + count * record_size:
+                raise ValueError("invalid readings length")
+            reading_list = []
+            for i in range(count):
+                record = struct.unpack_from(
+                    record_fmt, data, READINGS_HEADER_LEN + i * record_size
+                )
+                reading_list.append((schema, record[1:], record[0]))
+            return reading_list
+
+        raise ValueError(f"unknown record type {record_type}")
+
+    def _schema_formats(self, schema_id):
+        """
+        :return: tuple of Schema and the struct formats of its values
+        Raises ValueError if the schema is not known.
+        """
+        formats = self._formats.get(schema_id)
+        if formats is None:
+            raise ValueError(f"unknown schema ID {schema_id}")
+
+        return formats
+
+    def _make_room(self, count):
+        """
+        Advance the tail so that there are count free slots,
+        dropping the oldest records if the spool is full.
+        """
+        logger = logging.getLogger("")
+
+        while len(self) + count > self._slots:
+            if self._heads[self._tail_seq % self._slots]:
+                self.dropped += 1
+                logger.warning(
+                    f"spool full, dropped the oldest record {self._tail_seq}"
+                )
+            self._tail_seq += 1
+        self._skip_orphans()
+
+    def _append(self, file_obj, topic, record_type, data):
+        """
+        Write the record to the next slots, overwriting the oldest records
+        if the spool is full.
+        :return: True if stored, False if the record does not fit the spool
+        """
+        logger = logging.getLogger("")
+
+        topic_bytes = topic.encode("utf-8")
+        length = len(topic_bytes) + len(data)
+        count = max((length + SLOT_DATA_SIZE - 1) // SLOT_DATA_SIZE, 1)
+        if len(topic_bytes) > 255 or len(data) > 65535 or count > self._slots:
+            self.dropped += 1
+            logger.warning(
+                f"dropped reading for {topic}, {length} bytes do not fit the spool"
+            )
+            return False
+
+        self._make_room(count)
+        record = topic_bytes + data
+        now = time.monotonic()
+        for i in range(count):
+            seq = self._next_seq + i
+            if i == 0:
+                struct.pack_into(
+                    SLOT_HEADER_FMT,
+                    self._buf,
+                    0,
+                    seq,
+                    record_type,
+                    len(topic_bytes),
+                    len(data),
+                )
+            else:
+                struct.pack_into(SLOT_HEADER_FMT, self._buf, 0, seq, RECORD_CONT, 0, 0)
+            chunk = record[i * SLOT_DATA_SIZE : (i + 1) * SLOT_DATA_SIZE]
+            self._buf[SLOT_HEADER_LEN : SLOT_HEADER_LEN + len(chunk)] = chunk
+
+            slot = seq % self._slots
+            file_obj.seek((slot + 1) * SLOT_SIZE)
+            file_obj.write(self._buf)
+            self._heads[slot] = 1 if i == 0 else 0
+            self._stamps[slot] = now
+        self._next_seq += count
+        self.spooled += 1
+
+        return True
+
+    def save_queue(self, queue):
+        """
+        Move all readings from the ReadingQueue to the spool, write the meta data as well.
+        The reading is removed from the queue only once it is written, so the reading
+        that failed to be written stays in the queue.
+        :param queue: ReadingQueue object
+        :return: number of spooled readings
+        """
+        logger = logging.getLogger("")
+
+        if len(queue) == 0:
+            self.flush()
+            return 0
+
+        count = 0
+        try:
+            remount(False)  # writeable by CircuitPython
+            try:
+                with self._open_for_write() as file_obj:
+                    while len(queue) > 0:
+                        topic, reading = queue.peek()
+                        try:
+                            record_type, data = self._encode(reading)
+                        except ValueError as e:
+                            queue.pop()
+                            self.dropped += 1
+                            logger.warning(f"dropped reading for {topic}: {e}")
+                            continue
+                        if self._append(file_obj, topic, record_type, data):
+                            count += 1
+                        queue.pop()
+                    self._write_meta(file_obj)
+            finally:
+                remount(True)  # writeable by USB host
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"failed to write to the spool {self._path}: {e}")
+
+        logger.info(f"spooled {count} readings, {len(self)} slots in use")
+        return count
+
+    def flush(self):
+        """
+        Write the meta data, if there were records replayed since it was written.
+        """
+        logger = logging.getLogger("")
+
+        if self._acked_seq == self._tail_seq - 1:
+            return
+
+        try:
+            remount(False)  # writeable by CircuitPython
+            try:
+                with self._open_for_write() as file_obj:
+                    self._write_meta(file_obj)
+            finally:
+                remount(True)  # writeable by USB host
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"failed to write to the spool {self._path}: {e}")
+
+    def replay(self, publish_func):
+        """
+        Publish batch of the oldest records and mark them as replayed.
+        Does nothing if the replay interval has not elapsed since the previous batch.
+        The record that cannot be published for other reason than the connection
+        (e.g. it is refused by the MQTT client) is skipped.
+        :param publish_func: function accepting MQTT topic and the reading (tuple of Schema,
+        values and age), list of readings or serialized payload (bytes), as they were queued
+        :return: number of replayed records
+        Raises the connection errors of publish_func, the record stays in the spool then.
+        """
+        logger = logging.getLogger("")
+
+        if len(self) == 0:
+            return 0
+
+        now = time.monotonic()
+        if (
+            self._replay_stamp is not None
+            and now - self._replay_stamp < self._replay_interval
+        ):
+            return 0
+        self._replay_stamp = now
+
+        start_ns = time.monotonic_ns()
+        count = 0
+        try:
+            records, end_seq = self._read_batch()
+            for seq, next_seq, topic, reading in records:
+                if self._replay_record(publish_func, seq, topic, reading):
+                    count += 1
+                self._tail_seq = next_seq
+            self._tail_seq = end_seq
+        finally:
+            self._replay_ns += time.monotonic_ns() - start_ns
+            self.replayed += count
+
+        if len(self) == 0:
+            logger.info(f"spool replayed: {self.metrics()}")
+            # Once per emptying the spool rather than after each batch.
+            self.flush()
+
+        return count
+
+    def _read_slot(self, file_obj, seq):
+        """
+        Read the slot of the sequence number to the buffer.
+        :return: tuple of record type, topic length and data length,
+        None if the slot does not hold the sequence number
+        """
+        file_obj.seek((seq % self._slots + 1) * SLOT_SIZE)
+        if file_obj.readinto(self._buf) != SLOT_SIZE:
+            return None
+        slot_seq, record_type, topic_len, data_len = struct.unpack_from(
+            SLOT_HEADER_FMT, self._buf, 0
+        )
+        if slot_seq != seq:
+            return None
+
+        return record_type, topic_len, data_len
+
+    def _read_record(self, file_obj, seq):
+        """
+        Read the record starting in the slot of the sequence number.
+        :return: tuple of record type, MQTT topic, record data and the sequence number
+        following the record, record type is None if the slot does not start a record
+        Raises ValueError if the record is corrupted.
+        """
+        header = self._read_slot(file_obj, seq)
+        if header is None or header[0] == RECORD_CONT:
+            return None, None, None, seq + 1
+        record_type, topic_len, data_len = header
+
+        length = topic_len + data_len
+        record = bytearray(self._buf[SLOT_HEADER_LEN : SLOT_HEADER_LEN + length])
+        seq += 1
+        while len(record) < length:
+            header = self._read_slot(file_obj, seq)
+            seq += 1
+            if header is None or header[0] != RECORD_CONT:
+                raise ValueError("missing continuation")
+            missing = length - len(record)
+            record += self._buf[
+                SLOT_HEADER_LEN : SLOT_HEADER_LEN + min(missing, SLOT_DATA_SIZE)
+            ]
+
+        topic = str(record[:topic_len], "utf-8")
+        return record_type, topic, memoryview(record)[topic_len:], seq
+
+    def _read_batch(self):
+        """
+        Read batch of the oldest records, skipping the empty and corrupted slots.
+        :return: tuple of list of (sequence number, sequence number following the record,
+        MQTT topic, reading) tuples and the sequence number following the last read slot
+        """
+        logger = logging.getLogger("")
+
+        records = []
+        seq = self._tail_seq
+        try:
+            with open(self._path, "rb") as file_obj:
+                while len(records) < self._replay_batch and seq < self._next_seq:
+                    try:
+                        record_type, topic, data, next_seq = self._read_record(
+                            file_obj, seq
+                        )
+                        if record_type is not None:
+                            reading = self._decode(record_type, data)
+                            records.append((seq, next_seq, topic, reading))
+                    except (UnicodeError, ValueError) as e:
+                        logger.warning(f"skipping corrupted spooled record {seq}: {e}")
+                        self.skipped += 1
+                        next_seq = seq + 1
+                    seq = next_seq
+        except OSError as e:
+            logger.warning(f"failed to read the spool {self._path}: {e}")
+
+        return records, min(seq, self._next_seq)
+
+    def _replay_record(self, publish_func, seq, topic, reading):
+        """
+        Publish the record.
+        :return: True if published, False if skipped
+        """
+        logger = logging.getLogger("")
+
+        try:
+            publish_func(topic, reading)
+        except Exception as e:  # pylint: disable=broad-except
+            if isinstance(e, CONNECTION_ERRORS) and not is_message_error(e):
+                raise
+            logger.warning(f"skipping spooled record {seq} for {topic}: {e}")
+            self.skipped += 1
+            return False
+
+        return True
+
+    def metrics(self):
+        """
+        :return: dictionary with the number of slots in use, number of spooled, dropped,
+        replayed and skipped records, replay throughput (records per second) and the age
+        of the oldest record in seconds (measured since it was spooled or since boot
+        for the records spooled before reset)
+        """
+        oldest_age = 0
+        if len(self) > 0:
+            oldest_age = time.monotonic() - self._stamps[self._tail_seq % self._slots]
+
+        throughput = 0
+        if self._replay_ns > 0:
+            throughput = self.replayed * 1_000_000_000 / self._replay_ns
+
+        return {
+            "size": len(self),
+            "spooled": self.spooled,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "skipped": self.skipped,
+            "replay_throughput": throughput,
+            "oldest_age": oldest_age,
+        }
@@ -0,0 +1,197 @@
+"""
+Lightweight instrumentation of the main loop
+
+The durations of the stages are recorded to histograms with fixed buckets of integer counts
+so that recording a sample does not allocate memory (apart from the time stamps themselves).
+"""
+
+import time
+
+import adafruit_logging as logging
+
+STAGE_LOOP = "loop"
+STAGE_MQTT_LOOP = "mqtt_loop"
+STAGE_RECEIVE = "receive"
+STAGE_DECODE = "decode"
+STAGE_JSON = "json"
+STAGE_PUBLISH = "publish"
+STAGES = (
+    STAGE_LOOP,
+    STAGE_MQTT_LOOP,
+    STAGE_RECEIVE,
+    STAGE_DECODE,
+    STAGE_JSON,
+    STAGE_PUBLISH,
+)
+
+COUNTER_LOOPS = "loops"
+COUNTER_PACKETS = "packets"
+COUNTER_DECODE_FAILURES = "decode_failures"
+COUNTER_TOPIC_REJECTIONS = "topic_rejections"
+COUNTER_PUBLISH_DROPS = "publish_drops"
+COUNTERS = (
+    COUNTER_LOOPS,
+    COUNTER_PACKETS,
+    COUNTER_DECODE_FAILURES,
+    COUNTER_TOPIC_REJECTIONS,
+    COUNTER_PUBLISH_DROPS,
+)
+
+BOOT_RADIO = "radio"
+BOOT_FIRST_RECEIVE = "first_receive"
+BOOT_CONNECTED = "connected"
+BOOT_FIRST_PUBLISH = "first_publish"
+
+# Upper bounds of the histogram buckets in microseconds. The last bucket is unbounded.
+BUCKET_BOUNDS_US = (
+    100,
+    250,
+    500,
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    500_000,
+    1_000_000,
+)
+
+
+class Histogram:
+    """
+    Histogram of durations with fixed buckets.
+    """
+
+    def __init__(self):
+        self._buckets = [0] * (len(BUCKET_BOUNDS_US) + 1)
+        self.count = 0
+        self.max_us = 0
+
+    def record(self, duration_us):
+        """
+        Add sample to the histogram.
+        """
+        idx = 0
+        for bound in BUCKET_BOUNDS_US:
+            if duration_us <= bound:
+                break
+            idx += 1
+        self._buckets[idx] += 1
+        self.count += 1
+        self.max_us = max(duration_us, self.max_us)
+
+    def percentile(self, fraction):
+        """
+        :param fraction: between 0 and 1
+        :return: upper bound of the bucket containing the percentile, in microseconds
+        (for the last bucket, the maximum value is returned)
+        """
+        if self.count == 0:
+            return 0
+
+        rank = fraction * self.count
+        total = 0
+        for idx, bucket in enumerate(self._buckets):
+            total += bucket
+            if total >= rank:
+                if idx < len(BUCKET_BOUNDS_US):
+                    return min(BUCKET_BOUNDS_US[idx], self.max_us)
+                break
+
+        return self.max_us
+
+    def reset(self):
+        """
+        Clear the histogram.
+        """
+        for idx, _ in enumerate(self._buckets):
+            self._buckets[idx] = 0
+        self.count = 0
+        self.max_us = 0
+
+
+class Stats:
+    """
+    Per stage duration histograms and counters.
+    """
+
+    def __init__(self):
+        self._histograms = {stage: Histogram() for stage in STAGES}
+        self._counters = {counter: 0 for counter in COUNTERS}
+        self._start = time.monotonic()
+
+    def record(self, stage, start_ns):
+        """
+        Record duration of the stage.
+        :param stage: name of the stage
+        :param start_ns: time.monotonic_ns() when the stage started
+        :return: current time.monotonic_ns() so that it can be used as start of the next stage
+        """
+        now = time.monotonic_ns()
+        self._histograms[stage].record((now - start_ns) // 1000)
+        return now
+
+    def increment(self, counter, value=1):
+        """
+        Increment the counter.
+        """
+        self._counters[counter] += value
+
+    def summary(self, extra=None):
+        """
+        Compute compact summary and reset the histograms.
+        :param extra: optional dictionary to include in the summary
+        :return: dictionary with the uptime, counters and for each stage number of samples,
+        50th and 99th percentile and maximum in milliseconds
+        """
+        latency = {}
+        for stage, histogram in self._histograms.items():
+            if histogram.count == 0:
+                continue
+            latency[stage] = [
+                histogram.count,
+                histogram.percentile(0.5) / 1000,
+                histogram.percentile(0.99) / 1000,
+                histogram.max_us / 1000,
+            ]
+            histogram.reset()
+
+        summary = {
+            "uptime": int(time.monotonic() - self._start),
+            "counters": dict(self._counters),
+            "latency_ms": latency,
+        }
+        if extra:
+            summary.update(extra)
+
+        return summary
+
+
+class BootTimes:  # pylint: disable=too-few-public-methods
+    """
+    Time from the boot to the milestones of the start up.
+    """
+
+    def __init__(self, boot_ns):
+        """
+        :param boot_ns: time.monotonic_ns() of the boot
+        """
+        self._boot_ns = boot_ns
+        self.milestones = {}
+
+    def mark(self, milestone):
+        """
+        Record the milestone, unless already recorded.
+        :param milestone: name of the milestone
+        """
+        if milestone in self.milestones:
+            return
+
+        logger = logging.getLogger("")
+
+        elapsed_ms = (time.monotonic_ns() - self._boot_ns) // 1_000_000
+        self.milestones[milestone] = elapsed_ms
+        logger.info(f"boot: {milestone} after {elapsed_ms} ms")
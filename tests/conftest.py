@@ -0,0 +1,11 @@
+"""
+Make the modules in the top level directory importable by the tests.
+
+The directory is appended rather than prepended to the path
+so that code.py does not shadow the standard library module of the same name.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,102 @@
+"""
+Tests of the windowed aggregation
+"""
+
+import math
+
+import pytest
+
+from aggregate import WindowAggregator
+from packet import SCHEMAS
+
+TOPIC = "devices/garden"
+
+
+def collect(aggregator):
+    """
+    Close the elapsed windows.
+    :return: list of (topic, aggregates) tuples
+    """
+    published = []
+    aggregator.poll(lambda topic, data: published.append((topic, data)))
+    return published
+
+
+def collect_one(aggregator):
+    """
+    Close the elapsed windows, expecting single one.
+    :return: tuple of topic and the aggregates
+    """
+    published = collect(aggregator)
+    assert len(published) == 1
+    return published[0]
+
+
+def test_aggregates():
+    """
+    Minimum, maximum, mean and count are computed for the measured values
+    """
+    aggregator = WindowAggregator([TOPIC], window=0)
+    assert aggregator.add(TOPIC, SCHEMAS[2], (50.0, 20.0, 3.5))
+    assert aggregator.add(TOPIC, SCHEMAS[2], (60.0, math.nan, 3.5))
+    assert aggregator.add(TOPIC, SCHEMAS[3], (800, 3.0))
+    assert not aggregator.add("devices/other", SCHEMAS[3], (800, 3.0))
+
+    topic, data = collect_one(aggregator)
+    assert topic == TOPIC + "/aggregate"
+    assert data["window"] == 0
+    assert data["humidity"] == {"min": 50.0, "max": 60.0, "mean": 55.0, "count": 2}
+    assert data["temperature"] == {"min": 20.0, "max": 20.0, "mean": 20.0, "count": 1}
+    assert data["co2_ppm"] == {"min": 800, "max": 800, "mean": 800, "count": 1}
+    assert data["battery_level"]["count"] == 3
+    assert "lux" not in data
+    assert aggregator.published == 1
+
+
+def test_window_reset():
+    """
+    New window starts once the aggregates are handed over
+    """
+    aggregator = WindowAggregator([TOPIC], window=0)
+    aggregator.add(TOPIC, SCHEMAS[3], (800, 3.0))
+    collect(aggregator)
+    assert not collect(aggregator)
+
+    aggregator.add(TOPIC, SCHEMAS[3], (400, 3.0))
+    _, data = collect_one(aggregator)
+    assert data["co2_ppm"]["count"] == 1
+
+
+def test_window_kept_on_failure():
+    """
+    The aggregates are not lost if they could not be handed over
+    """
+    aggregator = WindowAggregator([TOPIC], window=0)
+    aggregator.add(TOPIC, SCHEMAS[3], (800, 3.0))
+
+    def fail(topic, data):
+        raise OSError(f"cannot publish {topic}: {data}")
+
+    with pytest.raises(OSError):
+        aggregator.poll(fail)
+    _, data = collect_one(aggregator)
+    assert data["co2_ppm"]["count"] == 1
+
+
+def test_window_not_elapsed():
+    """
+    The aggregates are published only once the window elapses
+    """
+    aggregator = WindowAggregator([TOPIC], window=3600)
+    aggregator.add(TOPIC, SCHEMAS[3], (800, 3.0))
+    assert not collect(aggregator)
+
+
+def test_table_full():
+    """
+    The topics that do not fit the table are not aggregated
+    """
+    aggregator = WindowAggregator(["a", "b"], max_topics=1)
+    assert aggregator.add("a", SCHEMAS[3], (800, 3.0))
+    assert not aggregator.add("b", SCHEMAS[3], (800, 3.0))
+    assert "b" not in aggregator
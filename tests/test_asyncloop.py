@@ -0,0 +1,74 @@
+"""
+Tests of the asyncio based main loop
+"""
+
+import asyncio
+import time
+
+from asyncloop import AsyncLoop
+
+
+class Client:
+    """
+    MQTT client that gets connected by the second loop() call,
+    as ConnectionSupervisor connecting the network first and then the MQTT session.
+    """
+
+    def __init__(self):
+        self.loops = 0
+
+    def loop(self, timeout):  # pylint: disable=unused-argument
+        """
+        Count the calls.
+        """
+        self.loops += 1
+
+    def is_connected(self):
+        """
+        :return: True once loop() was called twice
+        """
+        return self.loops >= 2
+
+
+def run_mqtt_task(client, publish_stage, duration):
+    """
+    Run the MQTT task for the duration in seconds.
+    """
+
+    async def run():
+        try:
+            await asyncio.wait_for(
+                AsyncLoop(mqtt_loop_interval=1).mqtt_task(client, publish_stage),
+                duration,
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run())
+
+
+def test_connect_without_waiting():
+    """
+    The connection is established and the readings queued meanwhile are published
+    without waiting for the MQTT loop interval
+    """
+    client = Client()
+    start = time.monotonic()
+    published = []
+
+    def publish_stage():
+        if client.is_connected() and not published:
+            published.append(time.monotonic() - start)
+
+    run_mqtt_task(client, publish_stage, 0.3)
+    assert published and published[0] < 0.2
+
+
+def test_loop_interval_once_connected():
+    """
+    Once connected, the MQTT client loop runs once per interval
+    """
+    client = Client()
+    client.loops = 2
+    run_mqtt_task(client, lambda: None, 0.3)
+    assert client.loops == 3
@@ -0,0 +1,93 @@
+"""
+Tests of the raw packet capture
+"""
+
+import pytest
+
+import capture
+from capture import CaptureFile, PacketCapture, iter_records
+
+
+class Writer:  # pylint: disable=too-few-public-methods
+    """
+    Write function of PacketCapture recording the written records.
+    """
+
+    def __init__(self, result=True):
+        self.written = b""
+        self.result = result
+
+    def __call__(self, data):
+        if self.result:
+            self.written += bytes(data)
+        return self.result
+
+
+def test_round_trip():
+    """
+    The captured packets are read back with their RSSI
+    """
+    writer = Writer()
+    packet_capture = PacketCapture(writer, interval=0)
+    packet_capture.add(b"\x01\x02", -70.5)
+    packet_capture.add(b"MQTT:", -40)
+    packet_capture.poll()
+    records = [
+        (rssi, bytes(packet)) for _, rssi, packet in iter_records(writer.written)
+    ]
+    assert records == [(-70.5, b"\x01\x02"), (-40, b"MQTT:")]
+    assert packet_capture.written == len(writer.written)
+
+
+def test_truncated():
+    """
+    Truncated capture is reported
+    """
+    writer = Writer()
+    packet_capture = PacketCapture(writer)
+    packet_capture.add(b"\x01\x02", -70)
+    packet_capture.flush()
+    with pytest.raises(ValueError):
+        list(iter_records(writer.written[:-1]))
+
+
+def test_full_buffer_kept_on_failure():
+    """
+    The records that failed to be written are kept, the new ones dropped
+    """
+    writer = Writer(result=False)
+    packet_capture = PacketCapture(writer, size=20)
+    packet_capture.add(b"x" * 10, -70)
+    packet_capture.add(b"y" * 10, -70)
+    assert packet_capture.dropped == 1
+
+    writer.result = True
+    packet_capture.flush()
+    assert [bytes(packet) for _, _, packet in iter_records(writer.written)] == [
+        b"x" * 10
+    ]
+
+
+def test_file(tmp_path):
+    """
+    The file starts with the magic, the capture stops at the maximum size
+    """
+    path = str(tmp_path / "capture.bin")
+    capture_file = CaptureFile(path, max_size=30)
+    assert capture_file(b"\x02\x00\x00\x00\x01\x00\x00ab")
+    assert not capture_file(b"x" * 30)
+    with open(path, "rb") as file_obj:
+        data = file_obj.read()
+    assert data.startswith(capture.MAGIC)
+    assert [bytes(packet) for _, _, packet in iter_records(data)] == [b"ab"]
+
+
+def test_file_remounted_read_only_on_failure(tmp_path, monkeypatch):
+    """
+    The file system is remounted read-only even if the write fails
+    """
+    remounts = []
+    monkeypatch.setattr(capture, "remount", remounts.append)
+    capture_file = CaptureFile(str(tmp_path / "missing" / "capture.bin"))
+    assert not capture_file(b"data")
+    assert remounts == [False, True]
@@ -0,0 +1,75 @@
+"""
+Tests of the multi-gateway coordination
+"""
+
+import json
+import struct
+import time
+
+from coordination import BestRssiSelector, parse_reception, reception_payload
+from packet import COMPACT_HEADER_FMT, FRAME_COMPACT, SCHEMAS
+from tools.coordinator import Coordinator
+
+PACKET = struct.pack(COMPACT_HEADER_FMT, FRAME_COMPACT, 3, 1) + struct.pack(
+    SCHEMAS[3].fmt, 1500, 3.25
+)
+
+
+class Client:  # pylint: disable=too-few-public-methods
+    """
+    Records the published messages.
+    """
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload):
+        """
+        Record the message.
+        """
+        self.published.append((topic, payload))
+
+
+def test_reception_round_trip():
+    """
+    Reception is parsed back, including gateway identifier that needs escaping
+    """
+    gateway = 'gw "1"\\'
+    payload = reception_payload(gateway, -70, PACKET)
+    assert json.loads(payload)["gateway"] == gateway
+    assert parse_reception(payload) == (gateway, -70, PACKET)
+
+
+def test_best_rssi_selected():
+    """
+    The copy with the best RSSI is selected once the window elapses,
+    the late copies are dropped
+    """
+    selector = BestRssiSelector(window_ms=0)
+    assert selector.offer("gw1", -80, PACKET) is None
+    assert selector.offer("gw2", -60, PACKET) is None
+    assert selector.offer("gw3", -90, PACKET) is None
+    time.sleep(0.001)
+    assert selector.poll() == [("gw2", -60, PACKET)]
+    assert selector.offer("gw4", -50, PACKET) is None
+    assert not selector.poll()
+    assert selector.dropped == 3
+
+
+def test_coordinator_publishes():
+    """
+    The selected reception is decoded and published as the gateway would
+    """
+    client = Client()
+    coordinator = Coordinator(
+        client,
+        {"allowed_topics": ["devices/#"], "topic_ids": {1: "devices/garden"}},
+        BestRssiSelector(window_ms=0),
+    )
+    coordinator.on_reception(reception_payload("gw1", -70, PACKET))
+    coordinator.on_reception(b"not JSON")
+    time.sleep(0.001)
+    coordinator.poll()
+    assert client.published == [
+        ("devices/garden", b'{"co2_ppm": 1500, "battery_level": 3.25}')
+    ]
@@ -0,0 +1,83 @@
+"""
+Tests of the report-by-exception filtering
+"""
+
+import math
+
+import pytest
+
+from deadband import DeadbandFilter
+from packet import SCHEMAS
+
+TOPIC = "devices/kitchen"
+SCHEMA = SCHEMAS[2]
+
+
+def passes(deadband, values, topic=TOPIC):
+    """
+    Check the reading and commit it if it passed, as the gateway does once it is queued.
+    :return: whether the reading passed
+    """
+    if not deadband.check(topic, SCHEMA, values):
+        return False
+    deadband.commit(topic, SCHEMA, values)
+    return True
+
+
+@pytest.fixture(name="deadband")
+def fixture_deadband():
+    """
+    Filter with deadband for the temperature of the test topic
+    """
+    return DeadbandFilter({TOPIC: {"temperature": 0.5}}, heartbeat=3600)
+
+
+def test_change_beyond_deadband(deadband):
+    """
+    The reading is published only once the value moves beyond the deadband
+    since the last published reading
+    """
+    assert passes(deadband, (50.0, 20.0, 3.5))
+    assert not passes(deadband, (60.0, 20.25, 3.5))
+    assert not passes(deadband, (60.0, 20.5, 3.5))
+    assert passes(deadband, (60.0, 20.75, 3.5))
+    assert not passes(deadband, (60.0, 20.5, 3.5))
+    assert (deadband.passed, deadband.suppressed) == (2, 3)
+
+
+def test_measured_state_change(deadband):
+    """
+    Value that stops or starts being measured is a change
+    """
+    assert passes(deadband, (50.0, 20.0, 3.5))
+    assert passes(deadband, (50.0, math.nan, 3.5))
+    assert not passes(deadband, (50.0, math.nan, 3.5))
+    assert passes(deadband, (50.0, 20.0, 3.5))
+
+
+def test_topic_without_deadband(deadband):
+    """
+    The topics without deadbands are always published
+    """
+    assert passes(deadband, (50.0, 20.0, 3.5), topic="devices/other")
+    assert passes(deadband, (50.0, 20.0, 3.5), topic="devices/other")
+
+
+def test_heartbeat():
+    """
+    The reading is published once the heartbeat interval expires
+    """
+    deadband = DeadbandFilter({TOPIC: {"temperature": 0.5}}, heartbeat=0)
+    assert passes(deadband, (50.0, 20.0, 3.5))
+    assert passes(deadband, (50.0, 20.0, 3.5))
+
+
+def test_not_committed_does_not_suppress(deadband):
+    """
+    Reading that passed but was not queued (not committed) does not become
+    the reference for the following readings
+    """
+    assert passes(deadband, (50.0, 20.0, 3.5))
+    assert deadband.check(TOPIC, SCHEMA, (50.0, 21.0, 3.5))
+    assert not passes(deadband, (50.0, 20.25, 3.5))
+    assert passes(deadband, (50.0, 21.0, 3.5))
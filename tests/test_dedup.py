@@ -0,0 +1,70 @@
+"""
+Tests of the duplicate packet suppression
+"""
+
+import struct
+
+import pytest
+
+from dedup import DedupCache, packet_key
+from packet import COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ
+
+
+def seq_packet(seq, value):
+    """
+    :return: compact packet with sequence number
+    """
+    return struct.pack(COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ, 3, 1, seq) + (
+        struct.pack(">If", value, 3.5)
+    )
+
+
+def test_duplicate_within_ttl():
+    """
+    Identical packet is a duplicate only within the TTL
+    """
+    cache = DedupCache(ttl_ms=1000)
+    key = packet_key(bytearray(b"MQTT:packet"))
+    assert not cache.is_duplicate(key)
+    assert cache.is_duplicate(packet_key(b"MQTT:packet"))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    expired = DedupCache(ttl_ms=0)
+    assert not expired.is_duplicate(key)
+    assert not expired.is_duplicate(key)
+
+
+def test_contents_compared():
+    """
+    Packets differing in contents are not duplicates
+    """
+    cache = DedupCache()
+    assert not cache.is_duplicate(packet_key(b"\x01\x02\x03"))
+    assert not cache.is_duplicate(packet_key(b"\x01\x02\x04"))
+
+
+def test_sequence_number_key():
+    """
+    Packets with sequence number are keyed by the header, other packets by the contents
+    """
+    assert packet_key(seq_packet(7, 400)) == packet_key(seq_packet(7, 500))
+    assert packet_key(seq_packet(7, 400)) != packet_key(seq_packet(8, 400))
+
+
+def test_oldest_replaced():
+    """
+    When the table is full, the oldest key is forgotten
+    """
+    cache = DedupCache(size=2)
+    for key in (b"a", b"b", b"c"):
+        assert not cache.is_duplicate(key)
+    assert cache.is_duplicate(b"c")
+    assert not cache.is_duplicate(b"a")
+
+
+def test_invalid_size():
+    """
+    The table has to have at least one entry
+    """
+    with pytest.raises(ValueError):
+        DedupCache(size=0)
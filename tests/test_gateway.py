@@ -0,0 +1,177 @@
+"""
+Tests of the gateway flow from the received packet through the queue to publishing
+"""
+
+import math
+import struct
+
+import pytest
+
+from deadband import DeadbandFilter
+from gateway import enqueue_packet, publish
+from packet import (
+    BATCH_HEADER_FMT,
+    FRAME_BATCH,
+    MQTT_PREFIX,
+    SCHEMAS,
+    PacketDecoder,
+    TopicNotAllowedError,
+)
+from ringbuffer import DROP_NEWEST, ReadingQueue
+from stats import COUNTER_PUBLISH_DROPS, Stats
+from topicacl import TopicACL
+
+TOPIC = "devices/kitchen"
+BATCH_TOPIC = "devices/garden"
+
+
+class Client:  # pylint: disable=too-few-public-methods
+    """
+    MQTT client recording the published messages, optionally failing to publish.
+    """
+
+    def __init__(self, exc=None):
+        self.published = []
+        self.exc = exc
+
+    def publish(self, topic, msg):
+        """
+        Record the message or raise the exception.
+        """
+        if self.exc is not None:
+            raise self.exc
+        self.published.append((topic, msg))
+
+
+def legacy_packet(topic=TOPIC, values=(45.5, 21.5, 812, 3.75, math.nan)):
+    """
+    :return: packet in the legacy format
+    """
+    return struct.pack(">5s32sffIff", MQTT_PREFIX, topic.encode("ascii"), *values)
+
+
+def batch_packet():
+    """
+    :return: batch frame with two records
+    """
+    schema = SCHEMAS[2]
+    return (
+        struct.pack(BATCH_HEADER_FMT, FRAME_BATCH, 2, 1, 2)
+        + struct.pack(schema.record_fmt, 10, 50.0, 20.0, 3.5)
+        + struct.pack(schema.record_fmt, 0, 51.0, 20.5, 3.5)
+    )
+
+
+def enqueue(queue, packet, batch_array=False, **kwargs):
+    """
+    Decode the packet and queue its readings the way the gateway does.
+    """
+    enqueue_packet(
+        queue,
+        PacketDecoder(topic_ids={1: BATCH_TOPIC}),
+        TopicACL(["devices/#"]),
+        packet,
+        batch_array,
+        **kwargs,
+    )
+
+
+def publish_all(queue, client, stats=None):
+    """
+    Publish the queued readings.
+    """
+    stats = stats if stats is not None else Stats()
+    queue.drain(lambda topic, reading: publish(client, topic, reading, stats), 1000)
+
+
+def test_packet_to_publish():
+    """
+    Reading of received packet is published as JSON
+    """
+    queue = ReadingQueue(4)
+    enqueue(queue, legacy_packet())
+    client = Client()
+    publish_all(queue, client)
+    assert client.published == [
+        (
+            TOPIC,
+            b'{"humidity": 45.5, "temperature": 21.5, "co2_ppm": 812, '
+            b'"battery_level": 3.75}',
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "batch_array, expected",
+    [
+        (
+            False,
+            [
+                b'{"humidity": 50.0, "temperature": 20.0, "battery_level": 3.5, '
+                b'"age": 10}',
+                b'{"humidity": 51.0, "temperature": 20.5, "battery_level": 3.5, '
+                b'"age": 0}',
+            ],
+        ),
+        (
+            True,
+            [
+                b'[{"humidity": 50.0, "temperature": 20.0, "battery_level": 3.5, '
+                b'"age": 10}, {"humidity": 51.0, "temperature": 20.5, '
+                b'"battery_level": 3.5, "age": 0}]'
+            ],
+        ),
+    ],
+)
+def test_batch(batch_array, expected):
+    """
+    Records of batch frame are published one by one or as single array
+    """
+    queue = ReadingQueue(4)
+    enqueue(queue, batch_packet(), batch_array)
+    client = Client()
+    publish_all(queue, client)
+    assert client.published == [(BATCH_TOPIC, msg) for msg in expected]
+
+
+def test_not_allowed_topic():
+    """
+    Packet with topic that is not allowed is not queued
+    """
+    queue = ReadingQueue(4)
+    with pytest.raises(TopicNotAllowedError):
+        enqueue(queue, legacy_packet(topic="other/kitchen"))
+    assert len(queue) == 0
+
+
+def test_dropped_reading_not_committed():
+    """
+    Reading dropped because the queue is full does not suppress the next one
+    by the deadband
+    """
+    deadband = DeadbandFilter({TOPIC: {"temperature": 0.5}}, heartbeat=3600)
+    queue = ReadingQueue(1, DROP_NEWEST)
+    enqueue(queue, legacy_packet(topic="devices/other"))
+    enqueue(queue, legacy_packet(), deadband=deadband)
+    assert queue.dropped == 1
+
+    publish_all(queue, Client())
+    enqueue(queue, legacy_packet(), deadband=deadband)
+    assert len(queue) == 1
+
+
+def test_refused_reading_dropped():
+    """
+    Reading refused by the MQTT client is dropped and counted,
+    the connection errors keep it in the queue
+    """
+    queue = ReadingQueue(4)
+    enqueue(queue, legacy_packet())
+    with pytest.raises(OSError):
+        publish_all(queue, Client(OSError("connection reset")))
+    assert len(queue) == 1
+
+    stats = Stats()
+    publish_all(queue, Client(ValueError("invalid topic")), stats)
+    assert len(queue) == 0
+    assert stats.summary()["counters"][COUNTER_PUBLISH_DROPS] == 1
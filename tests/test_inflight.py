@@ -0,0 +1,118 @@
+"""
+Tests of the QoS 1 in-flight window
+"""
+
+import pytest
+
+from inflight import InFlightWindow
+
+
+class Client:
+    """
+    MQTT client recording the sent messages.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.on_puback = None
+
+    def publish_nowait(self, topic, payload, pid, dup=False):
+        """
+        Record the message.
+        """
+        self.sent.append((topic, payload, pid, dup))
+
+    @staticmethod
+    def is_connected():
+        """
+        always connected
+        """
+        return True
+
+
+@pytest.fixture(name="client")
+def fixture_client():
+    """
+    MQTT client
+    """
+    return Client()
+
+
+def test_window_full(client):
+    """
+    No more messages than the window size wait for PUBACK
+    """
+    window = InFlightWindow(client, size=2)
+    assert window.publish("a", b"1")
+    assert window.publish("b", b"2")
+    assert window.free() == 0
+    assert not window.publish("c", b"3")
+    assert [pid for _, _, pid, _ in client.sent] == [1, 2]
+
+    client.on_puback(1)
+    assert window.free() == 1
+    assert window.publish("c", b"3")
+    assert window.acked == 1
+    assert window.occupancy_max == 2
+
+
+def test_unknown_ack(client):
+    """
+    Acknowledgement of message not in the window is counted
+    """
+    window = InFlightWindow(client)
+    window.publish("a", b"1")
+    client.on_puback(1)
+    client.on_puback(1)
+    assert window.unknown_acks == 1
+    assert len(window) == 0
+
+
+def test_retransmit(client):
+    """
+    Message not acknowledged within the timeout is sent again with the DUP flag
+    """
+    window = InFlightWindow(client, retransmit_timeout=0)
+    window.publish("a", b"1")
+    assert window.poll() == 1
+    assert client.sent[-1] == ("a", b"1", 1, True)
+    assert window.retransmits == 1
+
+    patient = InFlightWindow(Client(), retransmit_timeout=3600)
+    patient.publish("a", b"1")
+    assert patient.poll() == 0
+
+
+def test_requeue_oldest_first(client):
+    """
+    The unacknowledged messages are handed over oldest first and the window emptied
+    """
+    window = InFlightWindow(client, size=3)
+    for topic in ("a", "b", "c"):
+        window.publish(topic, topic.encode())
+    client.on_puback(1)
+    window.publish("d", b"d")
+    requeued = []
+    assert window.requeue(lambda topic, payload: requeued.append(topic)) == 3
+    assert requeued == ["b", "c", "d"]
+    assert window.free() == 3
+
+
+def test_pid_skips_zero(client):
+    """
+    Packet ID wraps around without using 0
+    """
+    window = InFlightWindow(client, size=1)
+    window._next_pid = 65535  # pylint: disable=protected-access
+    window.publish("a", b"1")
+    client.on_puback(65535)
+    window.publish("b", b"2")
+    assert [pid for _, _, pid, _ in client.sent] == [65535, 1]
+
+
+def test_invalid_size(client):
+    """
+    The window has to hold at least one message
+    """
+    with pytest.raises(ValueError):
+        InFlightWindow(client, size=0)
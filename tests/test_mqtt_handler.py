@@ -0,0 +1,147 @@
+"""
+Tests of the buffered MQTT log handler
+"""
+
+import pytest
+
+# adafruit_logging defines log levels dynamically.
+# pylint: disable=no-name-in-module
+from adafruit_logging import ERROR, INFO, WARNING, LogRecord
+
+from mqtt_handler import MQTTHandler
+
+TOPIC = "log/gateway"
+
+
+class Client:
+    """
+    MQTT client recording the published messages, optionally failing to publish.
+    """
+
+    def __init__(self):
+        self.published = []
+        self.connected = True
+        self.exc = None
+
+    def is_connected(self):
+        """
+        :return: the connection state
+        """
+        return self.connected
+
+    def publish(self, topic, msg):
+        """
+        Record the message or raise the exception.
+        """
+        if self.exc is not None:
+            raise self.exc
+        self.published.append((topic, msg))
+
+
+def record(msg, levelno=INFO):
+    """
+    :return: log record with the message
+    """
+    return LogRecord("", levelno, "", msg, 0, ())
+
+
+@pytest.fixture(name="client")
+def fixture_client():
+    """
+    Connected MQTT client
+    """
+    return Client()
+
+
+def test_batch_on_interval(client):
+    """
+    The records are published in single message once the flush interval elapses
+    """
+    handler = MQTTHandler(client, TOPIC, flush_interval=3600)
+    handler.emit(record("one"))
+    handler.emit(record("two"))
+    handler.emit(record("two"))
+    handler.poll()
+    assert not client.published
+
+    handler = MQTTHandler(client, TOPIC, flush_interval=0)
+    handler.emit(record("one"))
+    handler.emit(record("two"))
+    handler.emit(record("two"))
+    handler.poll()
+    assert client.published == [(TOPIC, "one\ntwo (repeated 2 times)")]
+    assert handler.coalesced == 1
+
+
+def test_error_flushed_right_away(client):
+    """
+    Record of high severity is published without waiting for the interval
+    """
+    handler = MQTTHandler(client, TOPIC, flush_interval=3600)
+    handler.emit(record("broken", ERROR))
+    handler.poll()
+    assert client.published == [(TOPIC, "broken")]
+
+
+def test_drop_below_drop_level(client):
+    """
+    When full, the records below the drop level are dropped first
+    """
+    handler = MQTTHandler(client, TOPIC, capacity=2, flush_interval=3600)
+    handler.emit(record("warning", WARNING))
+    handler.emit(record("info"))
+    handler.emit(record("another warning", WARNING))
+    handler.emit(record("another info"))
+    assert handler.dropped == 2
+    handler.flush()
+    assert client.published == [
+        (TOPIC, "(2 log records dropped)\nwarning\nanother warning")
+    ]
+
+
+def test_dropped_reported_on_interval(client):
+    """
+    The number of dropped records is published once the interval elapses,
+    not right away
+    """
+    for flush_interval in (3600, 0):
+        handler = MQTTHandler(client, TOPIC, capacity=1, flush_interval=flush_interval)
+        handler.emit(record("one"))
+        handler.emit(record("two"))
+        handler.poll()
+    assert client.published == [(TOPIC, "(1 log records dropped)\ntwo")]
+
+
+@pytest.mark.parametrize(
+    "exc", [OSError("connection reset"), RuntimeError("socket error")]
+)
+def test_connection_error_counted(client, exc):
+    """
+    Batch that failed to be published is counted as dropped and reported later
+    """
+    handler = MQTTHandler(client, TOPIC, flush_interval=3600)
+    handler.emit(record("one"))
+    handler.emit(record("two"))
+    client.exc = exc
+    handler.flush()
+    assert handler.dropped == 2
+    assert len(handler) == 0
+
+    client.exc = None
+    handler.emit(record("three"))
+    handler.flush()
+    assert client.published == [(TOPIC, "(2 log records dropped)\nthree")]
+
+
+def test_not_connected(client):
+    """
+    The records stay buffered while not connected
+    """
+    handler = MQTTHandler(client, TOPIC, flush_interval=0)
+    handler.emit(record("one"))
+    client.connected = False
+    handler.poll()
+    assert len(handler) == 1
+    client.connected = True
+    handler.poll()
+    assert client.published == [(TOPIC, "one")]
@@ -0,0 +1,253 @@
+"""
+Tests of the radio packet decoding
+"""
+
+import math
+import struct
+
+import pytest
+
+from packet import (
+    BATCH_HEADER_FMT,
+    COMPACT_HEADER_FMT,
+    COMPACT_SEQ_HEADER_FMT,
+    DELTA_NOT_MEASURED,
+    FRAME_BATCH,
+    FRAME_BATCH_DELTA,
+    FRAME_COMPACT,
+    FRAME_COMPACT_SEQ,
+    LEGACY_SCHEMA,
+    MQTT_PREFIX,
+    SCHEMAS,
+    PacketDecoder,
+    PacketDecodingError,
+    is_batch,
+)
+
+TOPIC = "devices/kitchen/shield"
+TOPIC_ID = 5
+VALUES = (45.5, 21.5, 812, 3.75, math.nan)
+
+
+def legacy_packet(topic=TOPIC, values=VALUES):
+    """
+    :return: packet in the legacy format
+    """
+    return bytearray(
+        struct.pack(">5s32sffIff", MQTT_PREFIX, topic.encode("ascii"), *values)
+    )
+
+
+def compact_packet(schema_id=1, topic_id=TOPIC_ID, values=VALUES):
+    """
+    :return: compact packet
+    """
+    return bytearray(
+        struct.pack(COMPACT_HEADER_FMT, FRAME_COMPACT, schema_id, topic_id)
+        + struct.pack(SCHEMAS[schema_id].fmt, *values)
+    )
+
+
+def batch_packet(records, schema_id=2):
+    """
+    :param records: list of (age, values) tuples
+    :return: batch packet
+    """
+    schema = SCHEMAS[schema_id]
+    packet = bytearray(
+        struct.pack(BATCH_HEADER_FMT, FRAME_BATCH, schema_id, TOPIC_ID, len(records))
+    )
+    for age, values in records:
+        packet += struct.pack(schema.record_fmt, age, *values)
+    return packet
+
+
+def same_values(values, expected):
+    """
+    :return: True if the values are equal, NaN being equal to NaN
+    """
+    return len(values) == len(expected) and all(
+        a == b or (isinstance(b, float) and math.isnan(a) and math.isnan(b))
+        for a, b in zip(values, expected)
+    )
+
+
+@pytest.fixture(name="decoder")
+def fixture_decoder():
+    """
+    Decoder knowing the topic ID used by the tests
+    """
+    return PacketDecoder(topic_ids={TOPIC_ID: TOPIC})
+
+
+def test_legacy(decoder):
+    """
+    Legacy packet is decoded with the NUL padding of the topic stripped
+    """
+    topic, schema, values = decoder.decode(legacy_packet())
+    assert topic == TOPIC
+    assert schema is LEGACY_SCHEMA
+    assert same_values(values, VALUES)
+    assert decoder.last_topic == TOPIC
+    assert decoder.last_seq is None
+    assert schema.to_dict(values) == {
+        "humidity": 45.5,
+        "temperature": 21.5,
+        "co2_ppm": 812,
+        "battery_level": 3.75,
+    }
+
+
+def test_legacy_bad_prefix(decoder):
+    """
+    Legacy packet has to start with the whole MQTT prefix
+    """
+    packet = legacy_packet()
+    packet[1:5] = b"QTT?"
+    with pytest.raises(PacketDecodingError):
+        decoder.decode(packet)
+
+
+def test_legacy_topic_cache(decoder):
+    """
+    Repeated legacy packets yield the same topic string
+    """
+    first, _, _ = decoder.decode(legacy_packet())
+    second, _, _ = decoder.decode(legacy_packet())
+    assert first is second
+
+
+def test_legacy_topic_leading_nul(decoder):
+    """
+    Topic field starting with NUL is not stripped to empty topic
+    """
+    topic, _, _ = decoder.decode(legacy_packet(topic="\x00garbage"))
+    assert topic == "\x00garbage".ljust(32, "\x00")
+
+
+def test_compact(decoder):
+    """
+    Compact packet is decoded using the schema and topic ID
+    """
+    topic, schema, values = decoder.decode(compact_packet(2, values=(60.0, 19.0, 3.5)))
+    assert topic == TOPIC
+    assert schema is SCHEMAS[2]
+    assert values == (60.0, 19.0, 3.5)
+    assert schema.to_dict(values) == {
+        "humidity": 60.0,
+        "temperature": 19.0,
+        "battery_level": 3.5,
+    }
+
+
+def test_compact_seq(decoder):
+    """
+    Sequence number of the compact packet is available in last_seq
+    """
+    packet = struct.pack(
+        COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ, 3, TOPIC_ID, 200
+    ) + struct.pack(SCHEMAS[3].fmt, 1500, 3.25)
+    assert decoder.decode(packet) == (TOPIC, SCHEMAS[3], (1500, 3.25))
+    assert decoder.last_seq == 200
+    assert list(decoder.records(packet)) == [(TOPIC, SCHEMAS[3], (1500, 3.25), None)]
+
+
+def test_batch(decoder):
+    """
+    Records of batch frame are yielded with their age
+    """
+    packet = batch_packet([(10, (50.0, 20.0, 3.5)), (5, (51.0, 20.5, 3.5))])
+    assert is_batch(packet)
+    assert list(decoder.records(packet)) == [
+        (TOPIC, SCHEMAS[2], (50.0, 20.0, 3.5), 10),
+        (TOPIC, SCHEMAS[2], (51.0, 20.5, 3.5), 5),
+    ]
+    assert decoder.last_topic == TOPIC
+    with pytest.raises(PacketDecodingError):
+        decoder.decode(packet)
+
+
+def test_batch_delta(decoder):
+    """
+    Delta encoded records are relative to the previous record
+    """
+    schema = SCHEMAS[2]
+    packet = bytearray(
+        struct.pack(BATCH_HEADER_FMT, FRAME_BATCH_DELTA, 2, TOPIC_ID, 3)
+        + struct.pack(schema.record_fmt, 30, 50.0, 20.0, 3.5)
+        + struct.pack(schema.delta_fmt, 10, 150, -25, 0)
+        + struct.pack(schema.delta_fmt, 50, 0, 0, DELTA_NOT_MEASURED)
+    )
+    records = list(decoder.records(packet))
+    assert [record[3] for record in records] == [30, 20, 0]
+    assert records[0][2] == (50.0, 20.0, 3.5)
+    assert same_values(records[1][2], (51.5, 19.75, 3.5))
+    assert same_values(records[2][2], (51.5, 19.75, math.nan))
+
+
+def test_records_single(decoder):
+    """
+    Packet with single reading yields single record without age
+    """
+    ((topic, schema, values, age),) = decoder.records(compact_packet())
+    assert (topic, schema, age) == (TOPIC, SCHEMAS[1], None)
+    assert same_values(values, VALUES)
+
+
+@pytest.mark.parametrize(
+    "packet",
+    [
+        b"",
+        b"\x01\x01",
+        bytes(legacy_packet())[:-1],
+        bytes(legacy_packet()) + b"\x00",
+        bytes(compact_packet())[:-1],
+        bytes(compact_packet()) + b"\x00",
+        struct.pack(COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ, 1, TOPIC_ID, 0),
+        bytes(batch_packet([(1, (1.0, 2.0, 3.0))]))[:-1],
+        struct.pack(BATCH_HEADER_FMT, FRAME_BATCH, 2, TOPIC_ID, 0),
+        struct.pack(BATCH_HEADER_FMT, FRAME_BATCH_DELTA, 2, TOPIC_ID, 0),
+        b"\x02\x02",
+        b"\x7fgarbage",
+    ],
+)
+def test_malformed(decoder, packet):
+    """
+    Short, long, empty and unknown packets are rejected
+    """
+    with pytest.raises(PacketDecodingError):
+        list(decoder.records(packet))
+
+
+@pytest.mark.parametrize(
+    "packet",
+    [
+        compact_packet(schema_id=1, topic_id=TOPIC_ID + 1),
+        struct.pack(COMPACT_HEADER_FMT, FRAME_COMPACT, 99, TOPIC_ID) + bytes(20),
+    ],
+)
+def test_unknown_ids(decoder, packet):
+    """
+    Unknown topic and schema IDs are rejected
+    """
+    with pytest.raises(PacketDecodingError):
+        decoder.decode(packet)
+
+
+def test_failure_keeps_last(decoder):
+    """
+    The last topic and sequence number are not updated by packet that cannot be decoded
+    """
+    decoder.decode(legacy_packet())
+    with pytest.raises(PacketDecodingError):
+        decoder.decode(b"\x01")
+    assert decoder.last_topic == TOPIC
+
+
+def test_generic_to_dict():
+    """
+    Generic conversion omits NaN floats and zero integers
+    """
+    schema = SCHEMAS[3]
+    assert not schema.to_dict((0, math.nan))
+    assert schema.to_dict((400, 3.0)) == {"co2_ppm": 400, "battery_level": 3.0}
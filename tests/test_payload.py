@@ -0,0 +1,54 @@
+"""
+Tests of the JSON payload serialization
+"""
+
+import json
+import math
+
+import pytest
+
+from packet import LEGACY_SCHEMA, SCHEMAS, Schema
+from payload import reading_to_dict, serialize
+
+
+@pytest.mark.parametrize(
+    "reading",
+    [
+        (LEGACY_SCHEMA, (45.5, 21.5, 812, 3.700000047683716, 1234.5), None),
+        (SCHEMAS[1], (45.5, 21.5, 0, 3.75, math.nan), None),
+        (SCHEMAS[1], (math.nan, math.nan, 0, math.nan, math.nan), None),
+        (SCHEMAS[2], (60.125, -19.0, 3.3), 42),
+        (SCHEMAS[3], (1500, math.inf), 0),
+        (SCHEMAS[3], (1500, -math.inf), None),
+        (Schema(9, ">fI", ('"quoted"', "info")), (1.5, 2), 7),
+    ],
+)
+def test_same_as_json_dumps(reading):
+    """
+    The payload is identical to json.dumps() of the dictionary
+    """
+    assert serialize(reading) == json.dumps(reading_to_dict(reading)).encode("utf-8")
+
+
+def test_list():
+    """
+    List of readings is serialized as JSON array
+    """
+    readings = [
+        (SCHEMAS[2], (50.0, 20.0, 3.5), 30),
+        (SCHEMAS[2], (51.5, 19.75, math.nan), 0),
+    ]
+    assert json.loads(serialize(readings)) == [
+        {"humidity": 50.0, "temperature": 20.0, "battery_level": 3.5, "age": 30},
+        {"humidity": 51.5, "temperature": 19.75, "age": 0},
+    ]
+    assert serialize(readings) == json.dumps(
+        [reading_to_dict(reading) for reading in readings]
+    ).encode("utf-8")
+
+
+def test_bytes():
+    """
+    Already serialized payload is passed as it is
+    """
+    assert serialize(b'{"window": 60}') == b'{"window": 60}'
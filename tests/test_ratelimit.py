@@ -0,0 +1,111 @@
+"""
+Tests of the per topic rate limiting
+"""
+
+import pytest
+
+import ratelimit
+from ratelimit import COALESCE, DROP, TopicRateLimiter
+
+
+class Clock:  # pylint: disable=too-few-public-methods
+    """
+    Replacement of the time module with manually advanced monotonic_ns().
+    """
+
+    def __init__(self):
+        self.now = 0
+
+    def monotonic_ns(self):
+        """
+        :return: the current time
+        """
+        return self.now
+
+    def advance(self, seconds):
+        """
+        Move the time forward.
+        """
+        self.now += int(seconds * 1_000_000_000)
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    """
+    Manually advanced clock used by the rate limiter
+    """
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    """
+    The burst is allowed at once, then one reading per token refill interval
+    """
+    limiter = TopicRateLimiter(60, burst=2)
+    assert [limiter.allow("t", i) for i in range(3)] == [True, True, False]
+    clock.advance(0.5)
+    assert not limiter.allow("t", 3)
+    clock.advance(0.5)
+    assert limiter.allow("t", 4)
+    assert (limiter.limited, limiter.dropped) == (2, 2)
+
+
+def test_topics_independent(clock):  # pylint: disable=unused-argument
+    """
+    Each topic has its own bucket, with optional rate override
+    """
+    limiter = TopicRateLimiter(60, burst=1, rates={"slow": 1})
+    assert limiter.allow("a", 0)
+    assert limiter.allow("b", 0)
+    assert limiter.allow("slow", 0)
+    assert not limiter.allow("a", 1)
+
+
+def test_coalesce(clock):
+    """
+    The latest reading over the limit is released once a token is available
+    """
+    limiter = TopicRateLimiter(60, burst=1, policy=COALESCE)
+    assert limiter.allow("t", 0)
+    assert not limiter.allow("t", 1)
+    assert not limiter.allow("t", 2)
+    released = []
+    assert (
+        limiter.release(lambda topic, reading: released.append((topic, reading))) == 0
+    )
+
+    clock.advance(1)
+    limiter.release(lambda topic, reading: released.append((topic, reading)))
+    assert released == [("t", 2)]
+    assert limiter.dropped == 1
+    assert limiter.release(lambda topic, reading: None) == 0
+
+
+def test_table_full(clock):  # pylint: disable=unused-argument
+    """
+    The topics that do not fit the table share the last row
+    """
+    limiter = TopicRateLimiter(60, burst=1, max_topics=2)
+    assert limiter.allow("a", 0)
+    assert limiter.allow("b", 0)
+    assert not limiter.allow("c", 0)
+
+
+def test_invalid_policy():
+    """
+    Unknown policy is rejected
+    """
+    with pytest.raises(ValueError):
+        TopicRateLimiter(60, policy="bogus")
+
+
+def test_drop_policy_releases_nothing(clock):  # pylint: disable=unused-argument
+    """
+    With the drop policy, nothing is kept for later
+    """
+    limiter = TopicRateLimiter(60, burst=1, policy=DROP)
+    limiter.allow("t", 0)
+    limiter.allow("t", 1)
+    assert limiter.release(lambda topic, reading: None) == 0
@@ -0,0 +1,174 @@
+"""
+Tests of re-establishing the connection in the main loop
+"""
+
+import pytest
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+
+from reconnect import ConnectionSupervisor, is_message_error
+
+
+class Client:
+    """
+    MQTT client whose connection state is set by the tests.
+    """
+
+    def __init__(self):
+        self.connected = False
+        self.loops = 0
+
+    def is_connected(self):
+        """
+        :return: the connection state
+        """
+        return self.connected
+
+    def loop(self, timeout):  # pylint: disable=unused-argument
+        """
+        Count the calls.
+        """
+        self.loops += 1
+
+    def disconnect(self):
+        """
+        Drop the connection.
+        """
+        self.connected = False
+
+
+class Hardware:
+    """
+    Network connection that fails given number of times.
+    """
+
+    def __init__(self, failures=0):
+        self.network = False
+        self.failures = failures
+        self.steps = []
+
+    def network_connected(self):
+        """
+        :return: the network state
+        """
+        return self.network
+
+    def connect_network(self):
+        """
+        Connect the network, unless set to fail.
+        """
+        self.steps.append("network")
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("no AP")
+        self.network = True
+
+    def connect_mqtt(self, mqtt_client):
+        """
+        Connect the MQTT client.
+        """
+        self.steps.append("mqtt")
+        mqtt_client.connected = True
+
+
+class Watchdog:  # pylint: disable=too-few-public-methods
+    """
+    Counts the feeds.
+    """
+
+    feeds = 0
+
+    def feed(self):
+        """
+        Count the feed.
+        """
+        self.feeds += 1
+
+
+def supervisor_for(hw, client, **kwargs):
+    """
+    :return: ConnectionSupervisor without the backoff delays
+    """
+    return ConnectionSupervisor(
+        hw, client, Watchdog(), backoff_base=0, backoff_max=0, **kwargs
+    )
+
+
+def test_initial_connect_in_steps():
+    """
+    The network and the MQTT session are connected in separate steps,
+    the first connection is not an outage
+    """
+    hw = Hardware()
+    client = Client()
+    supervisor = supervisor_for(hw, client)
+    supervisor.loop(0)
+    assert hw.steps == ["network"]
+    assert not supervisor.is_connected()
+    assert client.loops == 0
+    supervisor.loop(0)
+    assert hw.steps == ["network", "mqtt"]
+    assert supervisor.is_connected()
+    assert supervisor.connected_once
+    assert supervisor.metrics()["outages"] == 0
+    assert client.loops == 1
+
+
+def test_reconnect_after_loss():
+    """
+    Lost connection is re-established and counted as outage
+    """
+    hw = Hardware()
+    client = Client()
+    supervisor = supervisor_for(hw, client)
+    while not supervisor.poll():
+        pass
+
+    supervisor.lost(OSError("connection reset"))
+    assert not client.connected
+    assert supervisor.poll()
+    metrics = supervisor.metrics()
+    assert (metrics["outages"], metrics["reconnects"]) == (1, 1)
+    assert metrics["outage_current_s"] == 0
+
+
+def test_give_up():
+    """
+    ConnectionError is raised after too many consecutive failures
+    """
+    hw = Hardware(failures=3)
+    supervisor = supervisor_for(hw, Client(), max_failures=3)
+    supervisor.poll()
+    supervisor.poll()
+    assert supervisor.failures == 2
+    with pytest.raises(ConnectionError):
+        supervisor.poll()
+
+
+def test_failures_reset_by_success():
+    """
+    Only consecutive failures count towards giving up
+    """
+    hw = Hardware(failures=2)
+    supervisor = supervisor_for(hw, Client(), max_failures=3)
+    for _ in range(4):
+        supervisor.poll()
+    assert supervisor.is_connected()
+    assert supervisor.failures == 2
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (ValueError("Invalid topic"), True),
+        (MMQTTException("Message size larger than"), True),
+        (MMQTTException("Publish topic can not contain wildcards."), True),
+        (MMQTTException("Unable to connect"), False),
+        (OSError(104), False),
+        (RuntimeError("socket"), False),
+    ],
+)
+def test_is_message_error(exc, expected):
+    """
+    Errors of the message are told apart from the connection errors
+    """
+    assert is_message_error(exc) is expected
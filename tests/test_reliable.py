@@ -0,0 +1,153 @@
+"""
+Tests of the reliable datagram mode
+"""
+
+import pytest
+
+from reliable import (
+    ACK_PAYLOAD,
+    BROADCAST_ADDRESS,
+    FLAGS_ACK,
+    FLAGS_RETRY,
+    ReliableReceiver,
+)
+
+NODE = 1
+SENDER = 7
+
+
+class Radio:  # pylint: disable=too-few-public-methods
+    """
+    Records the sent packets.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, **kwargs):
+        """
+        Record the packet with its header fields.
+        """
+        self.sent.append((data, kwargs))
+
+
+def receive_from(*packets):
+    """
+    :return: receive function yielding the packets (with header)
+    """
+
+    def receive_packets(rfm69, timeout, with_header=False):
+        assert with_header
+        del rfm69, timeout
+        yield from packets
+
+    return receive_packets
+
+
+def header(destination=NODE, identifier=0, flags=0):
+    """
+    :return: RadioHead header of packet from the sender
+    """
+    return bytes((destination, SENDER, identifier, flags))
+
+
+def accept_all(receiver, radio):
+    """
+    Receive the packets, acknowledging each accepted one.
+    :return: list of the accepted payloads
+    """
+    accepted = []
+    for payload in receiver(radio, 0):
+        accepted.append(bytes(payload))
+        receiver.ack(radio)
+    return accepted
+
+
+def test_ack():
+    """
+    Packet for the gateway is acknowledged with its identifier
+    """
+    radio = Radio()
+    receiver = ReliableReceiver(NODE, receive_from(header(identifier=5) + b"data"))
+    assert accept_all(receiver, radio) == [b"data"]
+    assert len(radio.sent) == 1
+    data, fields = radio.sent[0]
+    assert data == ACK_PAYLOAD
+    assert fields["destination"] == SENDER
+    assert fields["node"] == NODE
+    assert fields["identifier"] == 5
+    assert fields["flags"] & FLAGS_ACK
+    assert receiver.acks == 1
+
+
+def test_foreign_and_broadcast():
+    """
+    Packets for other nodes are rejected, broadcasts accepted without ACK,
+    ACKs of other nodes ignored
+    """
+    radio = Radio()
+    receiver = ReliableReceiver(
+        NODE,
+        receive_from(
+            header(destination=2) + b"foreign",
+            header(destination=BROADCAST_ADDRESS) + b"broadcast",
+            header(flags=FLAGS_ACK) + b"!",
+            header(),
+        ),
+    )
+    assert accept_all(receiver, radio) == [b"broadcast"]
+    assert not radio.sent
+    assert receiver.foreign == 1
+
+
+def test_retry_acknowledged_again():
+    """
+    Retransmission of accepted packet is acknowledged but not processed again
+    """
+    radio = Radio()
+    receiver = ReliableReceiver(
+        NODE,
+        receive_from(
+            header(identifier=0) + b"first",
+            header(identifier=0, flags=FLAGS_RETRY) + b"first",
+            header(identifier=1, flags=FLAGS_RETRY) + b"second",
+        ),
+    )
+    assert accept_all(receiver, radio) == [b"first", b"second"]
+    assert len(radio.sent) == 3
+    assert receiver.retries == 1
+
+
+def test_first_retry_with_identifier_zero():
+    """
+    The first packet of a node is processed even if it is a retry with identifier 0
+    """
+    radio = Radio()
+    receiver = ReliableReceiver(
+        NODE, receive_from(header(identifier=0, flags=FLAGS_RETRY) + b"data")
+    )
+    assert accept_all(receiver, radio) == [b"data"]
+    assert receiver.retries == 0
+
+
+def test_not_acknowledged_until_accepted():
+    """
+    Packet that was not accepted (ack() not called) is not acknowledged,
+    so its retransmission is processed
+    """
+    radio = Radio()
+    packet = header(identifier=3) + b"data"
+    receiver = ReliableReceiver(
+        NODE, receive_from(packet, header(identifier=3, flags=FLAGS_RETRY) + b"data")
+    )
+    assert [bytes(payload) for payload in receiver(radio, 0)] == [b"data", b"data"]
+    assert not radio.sent
+
+
+@pytest.mark.parametrize("node", [-1, BROADCAST_ADDRESS])
+def test_invalid_node(node):
+    """
+    The gateway address has to be unicast address
+    """
+    with pytest.raises(ValueError):
+        ReliableReceiver(node)
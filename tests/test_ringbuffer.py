@@ -0,0 +1,113 @@
+"""
+Tests of the bounded reading queue
+"""
+
+import pytest
+
+from ringbuffer import COALESCE, DROP_NEWEST, DROP_OLDEST, ReadingQueue
+
+
+def fill(queue, count, topic="t"):
+    """
+    Put readings 0 .. count - 1 to the queue.
+    """
+    for i in range(count):
+        queue.put(f"{topic}{i}", i)
+
+
+def drain_all(queue):
+    """
+    :return: list of (topic, data) of all queued readings, oldest first
+    """
+    published = []
+    queue.drain(lambda topic, data: published.append((topic, data)), 1000)
+    return published
+
+
+def test_fifo_wrap_around():
+    """
+    Readings come out in order also once the ring buffer wraps around
+    """
+    queue = ReadingQueue(3)
+    fill(queue, 2)
+    assert drain_all(queue) == [("t0", 0), ("t1", 1)]
+    fill(queue, 3, topic="u")
+    assert len(queue) == 3
+    assert drain_all(queue) == [("u0", 0), ("u1", 1), ("u2", 2)]
+    assert queue.published == 5
+
+
+def test_drop_oldest():
+    """
+    The oldest reading makes room for the new one
+    """
+    queue = ReadingQueue(2, DROP_OLDEST)
+    fill(queue, 2)
+    assert queue.accepts()
+    assert not queue.put("new", 9)
+    assert queue.dropped == 1
+    assert drain_all(queue) == [("t1", 1), ("new", 9)]
+
+
+def test_drop_newest():
+    """
+    The new reading is dropped when the queue is full
+    """
+    queue = ReadingQueue(2, DROP_NEWEST)
+    fill(queue, 2)
+    assert not queue.accepts()
+    assert not queue.put("new", 9)
+    assert queue.dropped == 1
+    assert drain_all(queue) == [("t0", 0), ("t1", 1)]
+
+
+def test_coalesce():
+    """
+    The queued reading of the same topic is replaced, otherwise the oldest is dropped
+    """
+    queue = ReadingQueue(2, COALESCE)
+    fill(queue, 2)
+    assert not queue.put("t0", 10)
+    assert queue.coalesced == 1
+    assert not queue.put("other", 11)
+    assert queue.dropped == 1
+    assert drain_all(queue) == [("t1", 1), ("other", 11)]
+
+
+def test_drain_keeps_head_on_exception():
+    """
+    Reading whose publishing failed stays at the head of the queue
+    """
+    queue = ReadingQueue(4)
+    fill(queue, 3)
+    published = []
+
+    def publish(topic, data):
+        if data == 1:
+            raise OSError("connection lost")
+        published.append(topic)
+
+    with pytest.raises(OSError):
+        queue.drain(publish, 1000)
+    assert published == ["t0"]
+    assert queue.peek() == ("t1", 1)
+    assert len(queue) == 2
+
+
+def test_drain_limit():
+    """
+    At most the limit of readings is published
+    """
+    queue = ReadingQueue(4)
+    fill(queue, 4)
+    assert queue.drain(lambda topic, data: None, 1000, limit=3) == 3
+    assert len(queue) == 1
+
+
+@pytest.mark.parametrize("capacity, policy", [(0, DROP_OLDEST), (1, "bogus")])
+def test_invalid(capacity, policy):
+    """
+    Invalid capacity and overflow policy are rejected
+    """
+    with pytest.raises(ValueError):
+        ReadingQueue(capacity, policy)
@@ -0,0 +1,276 @@
+"""
+Tests of the store-and-forward spool
+"""
+
+import json
+import math
+
+import pytest
+
+from packet import LEGACY_SCHEMA, SCHEMAS
+from payload import serialize
+from ringbuffer import ReadingQueue
+from spool import SLOT_SIZE, Spool
+
+# Reading with all the fields of the legacy packet, one of them not measured.
+READING = (LEGACY_SCHEMA, (45.5, 21.25, 812, 3.75, math.nan), None)
+
+
+def queue_of(count, start=0):
+    """
+    :return: ReadingQueue with count readings, already serialized as JSON
+    """
+    queue = ReadingQueue(count)
+    for i in range(start, start + count):
+        queue.put(f"devices/{i}", f'{{"value": {i}}}'.encode("utf-8"))
+    return queue
+
+
+class Publisher:  # pylint: disable=too-few-public-methods
+    """
+    Records the published readings, raises given exception for given topic.
+    """
+
+    def __init__(self, fail_topic=None, exc=None):
+        self.published = []
+        self._fail_topic = fail_topic
+        self._exc = exc
+
+    def __call__(self, topic, data):
+        if topic == self._fail_topic:
+            raise self._exc
+        self.published.append((topic, data))
+
+
+def replay_all(spool, publisher):
+    """
+    Replay the spool until it is empty.
+    """
+    while len(spool) > 0:
+        spool.replay(publisher)
+
+
+@pytest.fixture(name="path")
+def fixture_path(tmp_path):
+    """
+    Path of the spool file
+    """
+    return str(tmp_path / "spool.bin")
+
+
+def test_replay(path):
+    """
+    The spooled readings are replayed in batches, oldest first
+    """
+    spool = Spool(path, slots=8, replay_batch=2, replay_interval=0)
+    assert spool.save_queue(queue_of(3)) == 3
+    publisher = Publisher()
+    assert spool.replay(publisher) == 2
+    replay_all(spool, publisher)
+    assert publisher.published == [
+        ("devices/0", b'{"value": 0}'),
+        ("devices/1", b'{"value": 1}'),
+        ("devices/2", b'{"value": 2}'),
+    ]
+    assert spool.metrics()["replayed"] == 3
+
+
+def test_wrap_around(path):
+    """
+    When the spool is full, the oldest records are overwritten
+    """
+    spool = Spool(path, slots=4, replay_batch=10, replay_interval=0)
+    spool.save_queue(queue_of(3))
+    spool.save_queue(queue_of(3, start=3))
+    assert len(spool) == 4
+    assert spool.dropped == 2
+    publisher = Publisher()
+    replay_all(spool, publisher)
+    assert [topic for topic, _ in publisher.published] == [
+        f"devices/{i}" for i in range(2, 6)
+    ]
+
+
+def test_survives_restart(path):
+    """
+    The records not replayed yet are found again after restart
+    """
+    spool = Spool(path, slots=4, replay_batch=2, replay_interval=0)
+    spool.save_queue(queue_of(3))
+    spool.replay(Publisher())
+    # Replay position is written with the next spooled readings.
+    spool.save_queue(queue_of(1, start=3))
+
+    restarted = Spool(path, slots=4, replay_batch=10, replay_interval=0)
+    publisher = Publisher()
+    replay_all(restarted, publisher)
+    assert [topic for topic, _ in publisher.published] == ["devices/2", "devices/3"]
+
+
+def test_replay_position_written_once_empty(path):
+    """
+    Once the spool is replayed, nothing is replayed again after restart
+    """
+    spool = Spool(path, slots=4, replay_batch=2, replay_interval=0)
+    spool.save_queue(queue_of(3))
+    replay_all(spool, Publisher())
+    assert len(Spool(path, slots=4)) == 0
+
+
+def test_connection_failure_keeps_record(path):
+    """
+    Record that failed to publish due to the connection stays in the spool
+    """
+    spool = Spool(path, slots=8, replay_batch=10, replay_interval=0)
+    spool.save_queue(queue_of(3))
+    with pytest.raises(OSError):
+        spool.replay(Publisher("devices/1", OSError("connection lost")))
+    assert len(spool) == 2
+
+    publisher = Publisher()
+    replay_all(spool, publisher)
+    assert [topic for topic, _ in publisher.published] == ["devices/1", "devices/2"]
+
+
+def test_refused_record_skipped(path):
+    """
+    Record refused by the MQTT client is skipped rather than retried forever
+    """
+    spool = Spool(path, slots=8, replay_batch=10, replay_interval=0)
+    spool.save_queue(queue_of(3))
+    publisher = Publisher("devices/1", ValueError("invalid topic"))
+    replay_all(spool, publisher)
+    assert [topic for topic, _ in publisher.published] == ["devices/0", "devices/2"]
+    assert spool.metrics()["skipped"] == 1
+
+
+def test_reading(path):
+    """
+    Reading is stored in single slot and replayed as it was queued
+    """
+    queue = ReadingQueue(2)
+    queue.put("devices/kitchen/shield/with/long/topic", READING)
+    queue.put("devices/garden", (SCHEMAS[3], (1500, 3.25), 120))
+    spool = Spool(path, slots=4)
+    assert spool.save_queue(queue) == 2
+    assert len(spool) == 2
+
+    publisher = Publisher()
+    replay_all(Spool(path, slots=4, replay_interval=0), publisher)
+    assert len(publisher.published) == 2
+    topic, reading = publisher.published[0]
+    assert topic == "devices/kitchen/shield/with/long/topic"
+    assert serialize(reading) == serialize(READING)
+    assert publisher.published[1] == (
+        "devices/garden",
+        (SCHEMAS[3], (1500, 3.25), 120),
+    )
+
+
+def test_batch_readings(path):
+    """
+    List of readings with values computed from the deltas is stored exactly
+    """
+    schema = SCHEMAS[2]
+    readings = [(schema, (50.0, 20.0, 3.5), 30), (schema, (51.01, 19.99, 3.51), 0)]
+    queue = ReadingQueue(1)
+    queue.put("devices/batch", readings)
+    spool = Spool(path, slots=4, replay_interval=0)
+    spool.save_queue(queue)
+
+    publisher = Publisher()
+    replay_all(spool, publisher)
+    assert publisher.published == [("devices/batch", readings)]
+
+
+def test_aggregate(path):
+    """
+    Aggregate that does not fit single slot spans multiple slots
+    """
+    aggregate = {"window": 60}
+    for name in LEGACY_SCHEMA.field_names:
+        aggregate[name] = {"min": 1.5, "max": 21.75, "mean": 11.333333333333334}
+        aggregate[name]["count"] = 12
+    pub_data = json.dumps(aggregate).encode("utf-8")
+    assert len(pub_data) > 3 * SLOT_SIZE
+
+    queue = ReadingQueue(3)
+    queue.put("devices/0", READING)
+    queue.put("devices/0/aggregate", pub_data)
+    queue.put("devices/1", READING)
+    spool = Spool(path, slots=8, replay_batch=2, replay_interval=0)
+    assert spool.save_queue(queue) == 3
+    # The aggregate takes 4 slots.
+    assert len(spool) == 6
+
+    publisher = Publisher()
+    replay_all(Spool(path, slots=8, replay_interval=0), publisher)
+    assert [topic for topic, _ in publisher.published] == [
+        "devices/0",
+        "devices/0/aggregate",
+        "devices/1",
+    ]
+    assert publisher.published[1][1] == pub_data
+
+
+def test_wrap_around_multiple_slots(path):
+    """
+    Record overwritten in part is dropped as whole
+    """
+    queue = ReadingQueue(3)
+    queue.put("devices/0", b"x" * 300)
+    queue.put("devices/1", READING)
+    queue.put("devices/2", b"y" * 200)
+    spool = Spool(path, slots=4, replay_interval=0)
+    spool.save_queue(queue)
+    assert spool.dropped == 1
+    assert len(spool) == 3
+
+    publisher = Publisher()
+    replay_all(Spool(path, slots=4, replay_interval=0), publisher)
+    assert [topic for topic, _ in publisher.published] == ["devices/1", "devices/2"]
+
+
+def test_too_big_reading_dropped(path):
+    """
+    Reading that does not fit the whole spool is dropped
+    """
+    queue = ReadingQueue(1)
+    queue.put("devices/big", b"x" * 1000)
+    spool = Spool(path, slots=4)
+    assert spool.save_queue(queue) == 0
+    assert spool.dropped == 1
+    assert len(spool) == 0
+    assert len(queue) == 0
+
+
+def test_write_failure_keeps_reading(path, monkeypatch):
+    """
+    Reading that failed to be written stays in the queue
+    """
+    spool = Spool(path, slots=8)
+    append = spool._append  # pylint: disable=protected-access
+
+    def failing_append(file_obj, topic, record_type, data):
+        if topic == "devices/1":
+            raise OSError("write failed")
+        return append(file_obj, topic, record_type, data)
+
+    monkeypatch.setattr(spool, "_append", failing_append)
+    queue = queue_of(3)
+    assert spool.save_queue(queue) == 1
+    assert queue.peek()[0] == "devices/1"
+    assert len(queue) == 2
+
+
+def test_invalid_file_ignored(path):
+    """
+    File without the magic is not used, it is created again once written
+    """
+    with open(path, "wb") as file_obj:
+        file_obj.write(bytes(5 * SLOT_SIZE))
+    spool = Spool(path, slots=4)
+    assert len(spool) == 0
+
+    spool.save_queue(queue_of(1))
+    assert len(Spool(path, slots=4)) == 1
@@ -0,0 +1,92 @@
+"""
+Tests of the MQTT topic access control list
+"""
+
+import struct
+
+import pytest
+
+from gateway import decode_packet
+from packet import MQTT_PREFIX, PacketDecoder, TopicNotAllowedError
+from topicacl import TopicACL
+
+
+def test_exact():
+    """
+    Exact topic matches only itself
+    """
+    acl = TopicACL(["devices/kitchen/temp"])
+    assert acl.is_allowed("devices/kitchen/temp")
+    assert not acl.is_allowed("devices/kitchen")
+    assert not acl.is_allowed("devices/kitchen/temp/x")
+
+
+@pytest.mark.parametrize(
+    "topic_filter, topic, allowed",
+    [
+        ("devices/+/temp", "devices/kitchen/temp", True),
+        ("devices/+/temp", "devices/kitchen/humidity", False),
+        ("devices/+/temp", "devices/temp", False),
+        ("devices/#", "devices", True),
+        ("devices/#", "devices/a/b/c", True),
+        ("devices/#", "other/a", False),
+        ("#", "devices/a", True),
+        ("#", "$SYS/a", False),
+        ("+/a", "$SYS/a", False),
+    ],
+)
+def test_wildcards(topic_filter, topic, allowed):
+    """
+    Single and multi level wildcards, '$' topics
+    """
+    assert TopicACL([topic_filter]).is_allowed(topic) is allowed
+
+
+@pytest.mark.parametrize("topic", ["", "devices/+", "devices/#", "devices/a\0b"])
+@pytest.mark.parametrize("topic_filter", ["#", "devices/#", "devices/+"])
+def test_invalid_topics_rejected(topic_filter, topic):
+    """
+    Topics that cannot be published to are not allowed by wildcard filters
+    """
+    acl = TopicACL([topic_filter])
+    assert not acl.is_allowed(topic)
+    # The decision is memoized, check it again.
+    assert not acl.is_allowed(topic)
+
+
+def test_invalid_topic_rejected_even_if_listed():
+    """
+    Topic with NUL is not allowed even as exact filter
+    """
+    acl = TopicACL(["devices/a\0b"])
+    assert not acl.is_allowed("devices/a\0b")
+
+
+@pytest.mark.parametrize("topic_filter", ["", "a/#/b", "a/b#", "a/+b"])
+def test_invalid_filters(topic_filter):
+    """
+    Misplaced wildcards and empty filter are rejected
+    """
+    with pytest.raises(ValueError):
+        TopicACL([topic_filter])
+
+
+def test_cache_eviction():
+    """
+    Decisions stay correct when the memoized decisions are evicted
+    """
+    acl = TopicACL(["devices/+"], max_cached=2)
+    for i in range(10):
+        assert acl.is_allowed(f"devices/{i}")
+    assert not acl.is_allowed("other/1")
+
+
+@pytest.mark.parametrize("topic", [b"devices/+", b"devices/#", b""])
+def test_wildcard_topic_packet_rejected(topic):
+    """
+    Legacy packet with topic that cannot be published to is rejected as not allowed topic
+    (and counted as such by the gateway) instead of reaching the MQTT client.
+    """
+    packet = struct.pack(">5s32sffIff", MQTT_PREFIX, topic, 50.0, 21.5, 400, 3.3, 100.0)
+    with pytest.raises(TopicNotAllowedError):
+        list(decode_packet(PacketDecoder(), TopicACL(["devices/#", "#"]), packet))
@@ -0,0 +1,117 @@
+"""
+Tests of the warm-restart record in the non-volatile memory
+"""
+
+from warmstart import (
+    FLAG_BROKER,
+    FLAG_NETWORK,
+    RESET_WATCHDOG,
+    WarmStart,
+    config_key,
+)
+
+KEY = config_key("ssid", "broker.example", 1883)
+BSSID = b"\x01\x02\x03\x04\x05\x06"
+
+
+def saved_nvm(offset=0):
+    """
+    :return: non-volatile memory with record of cached network and broker
+    """
+    nvm = bytearray(256)
+    warm_start = WarmStart(nvm, KEY, offset=offset)
+    warm_start.set_network(6, BSSID)
+    warm_start.set_broker_address("192.168.1.10")
+    warm_start.count_boot()
+    warm_start.count_reset(RESET_WATCHDOG)
+    warm_start.connected(1500, False)
+    return nvm
+
+
+def test_empty_memory():
+    """
+    Erased memory yields no cached data
+    """
+    warm_start = WarmStart(bytearray(256), KEY)
+    assert warm_start.network() is None
+    assert warm_start.broker_address() is None
+    assert warm_start.boots == 0
+
+
+def test_round_trip():
+    """
+    Saved record is parsed back
+    """
+    warm_start = WarmStart(saved_nvm(offset=16), KEY, offset=16)
+    assert warm_start.network() == (6, BSSID)
+    assert warm_start.broker_address() == "192.168.1.10"
+    assert warm_start.boots == 1
+    assert warm_start.full_connect_ms == 1500
+    assert warm_start.resets[RESET_WATCHDOG] == 1
+
+
+def test_corrupted_record():
+    """
+    Record with CRC mismatch is ignored
+    """
+    nvm = saved_nvm()
+    nvm[10] ^= 0xFF
+    warm_start = WarmStart(nvm, KEY)
+    assert warm_start.network() is None
+    assert warm_start.boots == 0
+
+
+def test_different_configuration():
+    """
+    Cached data of different configuration is stale, the counters are kept
+    """
+    warm_start = WarmStart(saved_nvm(), config_key("other", "broker.example", 1883))
+    assert warm_start.network() is None
+    assert warm_start.broker_address() is None
+    assert warm_start.full_connect_ms == 0
+    assert warm_start.boots == 1
+
+
+def test_invalidate():
+    """
+    Invalidated part of the cache is not used after restart
+    """
+    nvm = saved_nvm()
+    WarmStart(nvm, KEY).invalidate(FLAG_NETWORK)
+    warm_start = WarmStart(nvm, KEY)
+    assert warm_start.network() is None
+    assert warm_start.broker_address() == "192.168.1.10"
+    assert warm_start.fast_misses == 1
+    warm_start.invalidate(FLAG_BROKER)
+    assert WarmStart(nvm, KEY).broker_address() is None
+
+
+def test_unchanged_record_not_written():
+    """
+    Saving unchanged record does not write the memory
+    """
+
+    class Memory(bytearray):
+        """
+        Counts the writes.
+        """
+
+        writes = 0
+
+        def __setitem__(self, key, value):
+            self.writes += 1
+            super().__setitem__(key, value)
+
+    nvm = Memory(saved_nvm())
+    WarmStart(nvm, KEY).save()
+    assert nvm.writes == 0
+
+
+def test_non_ipv4_broker_address():
+    """
+    Only IPv4 addresses are cached
+    """
+    warm_start = WarmStart(bytearray(256), KEY)
+    warm_start.set_broker_address("broker.example")
+    warm_start.set_broker_address("1.2.3")
+    assert warm_start.broker_address() is None
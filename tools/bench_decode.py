@@ -0,0 +1,156 @@
+"""
+CPython micro benchmark of the packet decoding.
+
+Compares the original per packet decoding (format string built and topic decoded
+for each packet) with the precompiled PacketDecoder.
+
+Run from the top level directory of the repository:
+
+  python -m tools.bench_decode
+"""
+
+import argparse
+import math
+import struct
+import time
+
+from packet import COMPACT_HEADER_FMT, FRAME_COMPACT, PacketDecoder
+
+
+def legacy_decode(packet):
+    """
+    The decoding as it used to be done in decode_packet() in code.py.
+    """
+    mqtt_prefix = "MQTT:"
+    max_mqtt_topic_len = 32
+    fmt = f">{len(mqtt_prefix)}s{max_mqtt_topic_len}sffIff"
+    if struct.calcsize(fmt) > 60:
+        raise ValueError("the format for structure packing is bigger than 60 bytes")
+    data = struct.unpack(fmt, packet)
+    prefix = data[0].decode("ascii")
+    if prefix != mqtt_prefix:
+        raise ValueError(f"not a MQTT prefix: {prefix}")
+
+    mqtt_topic = data[1].decode("ascii")
+    nul_idx = mqtt_topic.find("\x00")
+    if nul_idx > 0:
+        mqtt_topic = mqtt_topic[:nul_idx]
+
+    data = data[2:]
+
+    pub_data_dict = {}
+    if not math.isnan(data[0]):
+        pub_data_dict["humidity"] = data[0]
+    if not math.isnan(data[1]):
+        pub_data_dict["temperature"] = data[1]
+    if data[2] != 0:
+        pub_data_dict["co2_ppm"] = data[2]
+    if not math.isnan(data[3]):
+        pub_data_dict["battery_level"] = data[3]
+    if not math.isnan(data[4]):
+        pub_data_dict["lux"] = data[4]
+
+    return mqtt_topic, pub_data_dict
+
+
+def make_packet(topic, values):
+    """
+    Create packet in the format produced by the senders.
+    :param topic: MQTT topic
+    :param values: tuple of humidity, temperature, co2_ppm, battery_level, lux
+    """
+    return bytearray(
+        struct.pack(">5s32sffIff", b"MQTT:", topic.encode("ascii"), *values)
+    )
+
+
+def make_compact_packet(topic_id, values):
+    """
+    Create compact packet with schema 1 (the same values as the legacy packet).
+    """
+    return bytearray(
+        struct.pack(COMPACT_HEADER_FMT, FRAME_COMPACT, 1, topic_id)
+        + struct.pack(">ffIff", *values)
+    )
+
+
+def run(func, packets, count):
+    """
+    Decode the packets count times in a round-robin fashion.
+    :return: duration in seconds
+    """
+    num_packets = len(packets)
+    start = time.perf_counter()
+    for i in range(count):
+        func(packets[i % num_packets])
+    return time.perf_counter() - start
+
+
+def run_all(variants, count, repeat):
+    """
+    Run the variants interleaved so that they are equally affected by the noise
+    of the machine, print the best rate of each.
+    :param variants: list of tuples of name, function and packets
+    :return: dictionary of name to the best rate in packets per second
+    """
+    best = {}
+    for _ in range(repeat):
+        for name, func, packets in variants:
+            duration = run(func, packets, count)
+            best[name] = min(duration, best.get(name, duration))
+
+    rates = {}
+    for name, _, _ in variants:
+        rates[name] = count / best[name]
+        print(f"{name:>10}: {rates[name]:12.0f} packets/s")
+    return rates
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="packet decoding benchmark")
+    parser.add_argument("-n", "--count", type=int, default=50_000)
+    parser.add_argument("-t", "--topics", type=int, default=8)
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="best of")
+    args = parser.parse_args()
+
+    packets = [
+        make_packet(f"devices/sensor{i}/shield", (45.5, 21.5, 0, 3.7, math.nan))
+        for i in range(args.topics)
+    ]
+
+    values = (45.5, 21.5, 0, 3.7, math.nan)
+    compact_packets = [make_compact_packet(i, values) for i in range(args.topics)]
+    decoder = PacketDecoder(
+        topic_ids={i: f"devices/sensor{i}/shield" for i in range(args.topics)}
+    )
+
+    def decode(packet):
+        # The way the gateway decodes the packets with single reading.
+        topic, schema, values = decoder.decode(packet)
+        return topic, schema.to_dict(values)
+
+    for packet, compact_packet in zip(packets, compact_packets):
+        assert legacy_decode(packet) == decode(packet) == decode(compact_packet)
+
+    rates = run_all(
+        [
+            ("legacy", legacy_decode, packets),
+            ("decoder", decode, packets),
+            ("raw", decoder.decode, packets),
+            ("compact", decode, compact_packets),
+        ],
+        args.count,
+        args.repeat,
+    )
+    before = rates["legacy"]
+    print(
+        f"speedup: {rates['decoder'] / before:.2f}x "
+        f"(without dict: {rates['raw'] / before:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
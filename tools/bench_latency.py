@@ -0,0 +1,204 @@
+"""
+CPython benchmark of the receive-to-publish latency of the polling main loop
+and the asyncio based main loop.
+
+The radio and the MQTT client are simulated: the packets arrive at random times
+and the MQTT client loop blocks for the whole timeout, same as when there is no
+incoming traffic.
+
+Run from the top level directory of the repository:
+
+  python -m tools.bench_latency
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+
+from asyncloop import AsyncLoop
+from packet import COMPACT_HEADER_FMT, FRAME_COMPACT, PacketDecoder
+from payload import serialize
+from ringbuffer import ReadingQueue
+
+TOPIC = "devices/bench/shield"
+
+
+class FakeRadio:  # pylint: disable=too-few-public-methods
+    """
+    Simulated RFM69 delivering packets at pseudo random times.
+    The value of temperature in each packet is the index of the packet.
+    """
+
+    def __init__(self, rate, duration):
+        self.arrivals = []
+        stamp = time.monotonic()
+        end = stamp + duration
+        while True:
+            stamp += random.expovariate(rate)
+            if stamp >= end:
+                break
+            self.arrivals.append(stamp)
+        self._next = 0
+
+    # pylint: disable=unused-argument
+    def receive(self, timeout=None, with_header=False):
+        """
+        Return the next packet if it has arrived, wait up to timeout for it otherwise.
+        """
+        if self._next >= len(self.arrivals):
+            time.sleep(timeout)
+            return None
+
+        arrival = self.arrivals[self._next]
+        now = time.monotonic()
+        if arrival > now:
+            if not timeout or arrival > now + timeout:
+                time.sleep(timeout or 0)
+                return None
+            time.sleep(arrival - now)
+
+        packet = struct.pack(COMPACT_HEADER_FMT, FRAME_COMPACT, 1, 1) + struct.pack(
+            ">ffIff", 50.0, float(self._next), 0, 3.7, 100.0
+        )
+        self._next += 1
+        return packet
+
+
+class FakeMQTTClient:
+    """
+    Simulated MQTT client recording the latency of each publish.
+    """
+
+    def __init__(self, radio):
+        self._radio = radio
+        self.latencies = []
+
+    def loop(self, timeout):
+        """
+        Block for the whole timeout.
+        """
+        time.sleep(timeout)
+
+    @staticmethod
+    def is_connected():
+        """
+        always connected
+        """
+        return True
+
+    def publish(self, topic, msg):
+        """
+        Record the time since the arrival of the packet.
+        """
+        assert topic == TOPIC
+        index = int(json.loads(msg)["temperature"])
+        self.latencies.append(time.monotonic() - self._radio.arrivals[index])
+
+
+class FakeWatchdog:  # pylint: disable=too-few-public-methods
+    """
+    watchdog that does nothing
+    """
+
+    def feed(self):
+        """
+        nothing to do
+        """
+
+
+def make_stages(mqtt_client):
+    """
+    :return: tuple of functions handling received packet and publishing readings
+    """
+    decoder = PacketDecoder(topic_ids={1: TOPIC})
+    queue = ReadingQueue(32)
+
+    def handle_packet(packet):
+        mqtt_topic, schema, values = decoder.decode(packet)
+        queue.put(mqtt_topic, (schema, values, None))
+
+    def publish_stage():
+        queue.drain(
+            lambda topic, reading: mqtt_client.publish(topic, serialize(reading)),
+            500,
+        )
+
+    return handle_packet, publish_stage
+
+
+def run_polling(rate, duration):
+    """
+    Run the polling loop the same way as in code.py.
+    """
+    radio = FakeRadio(rate, duration)
+    mqtt_client = FakeMQTTClient(radio)
+    handle_packet, publish_stage = make_stages(mqtt_client)
+
+    end = time.monotonic() + duration + 0.5
+    while time.monotonic() < end:
+        mqtt_client.loop(0.1)
+        publish_stage()
+        packet = radio.receive(timeout=0.1)
+        if packet is not None:
+            handle_packet(packet)
+
+    return mqtt_client.latencies
+
+
+def run_async(rate, duration):
+    """
+    Run the asyncio based loop.
+    """
+    radio = FakeRadio(rate, duration)
+    mqtt_client = FakeMQTTClient(radio)
+
+    async def run():
+        try:
+            await asyncio.wait_for(
+                AsyncLoop().run(
+                    FakeWatchdog(), radio, mqtt_client, make_stages(mqtt_client)
+                ),
+                duration + 0.5,
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run())
+    return mqtt_client.latencies
+
+
+def report(name, latencies):
+    """
+    Print latency statistics in milliseconds.
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        print(f"{name:>8}: no packets")
+        return
+    avg = sum(latencies) / len(latencies) * 1000
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(
+        f"{name:>8}: {len(latencies)} packets, avg {avg:.1f} ms, "
+        f"p50 {p50:.1f} ms, p99 {p99:.1f} ms"
+    )
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="receive-to-publish latency benchmark")
+    parser.add_argument("-r", "--rate", type=float, default=5, help="packets/s")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds")
+    args = parser.parse_args()
+
+    report("polling", run_polling(args.rate, args.duration))
+    report("asyncio", run_async(args.rate, args.duration))
+
+
+if __name__ == "__main__":
+    main()
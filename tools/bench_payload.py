@@ -0,0 +1,79 @@
+"""
+CPython micro benchmark of the JSON payload serialization.
+
+Compares json.dumps() of the dictionary of the values (the way the payloads used to be
+produced) with payload.serialize() and checks that the output is identical.
+
+Run from the top level directory of the repository:
+
+  python -m tools.bench_payload
+"""
+
+import argparse
+import json
+import math
+import time
+
+from packet import LEGACY_SCHEMA, SCHEMAS
+from payload import reading_to_dict, serialize
+
+READINGS = [
+    (LEGACY_SCHEMA, (45.5, 21.5, 812, 3.700000047683716, 1234.5), None),
+    (SCHEMAS[1], (45.5, 21.5, 0, 3.700000047683716, math.nan), None),
+    (SCHEMAS[1], (math.nan, -3.25, 812, 4.1, 1234.5), None),
+    (SCHEMAS[2], (60.125, 19.0, 3.3), 42),
+    (SCHEMAS[3], (0, math.nan), None),
+]
+
+
+def to_json(reading):
+    """
+    Serialize the reading the way it used to be done: dictionary and json.dumps().
+    """
+    return json.dumps(reading_to_dict(reading)).encode("utf-8")
+
+
+def run(func, count, repeat):
+    """
+    Serialize the readings count times in a round-robin fashion.
+    :return: the best rate of the repetitions in payloads per second
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(count):
+            func(READINGS[i % len(READINGS)])
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+
+    return count / best
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="payload serialization benchmark")
+    parser.add_argument("-n", "--count", type=int, default=200_000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for reading in READINGS + [(SCHEMAS[3], (1500, math.inf), 0)]:
+        assert serialize(reading) == to_json(reading), reading
+    assert serialize(READINGS) == json.dumps(
+        [reading_to_dict(reading) for reading in READINGS]
+    ).encode("utf-8")
+
+    # Interleaved so that both are measured in similar conditions.
+    before = after = 0
+    for _ in range(2):
+        before = max(before, run(to_json, args.count, args.repeat))
+        after = max(after, run(serialize, args.count, args.repeat))
+    print(f"  json.dumps: {before:12.0f} payloads/s")
+    print(f"   templates: {after:12.0f} payloads/s")
+    print(f"speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
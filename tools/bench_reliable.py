@@ -0,0 +1,183 @@
+"""
+CPython simulation of the reliable datagram mode over lossy radio channel
+
+The senders either transmit each reading blindly several times (no ACKs) or use
+acknowledged transmission with retries like adafruit_rfm69 send_with_ack(),
+with the gateway side handled by ReliableReceiver. Each transmission (packet or ACK)
+is lost with given probability. The simulation counts the delivered readings,
+the transmissions and the duplicates processed by the gateway.
+
+Run from the top level directory of the repository:
+
+  python -m tools.bench_reliable
+"""
+
+import argparse
+import random
+
+from reliable import BROADCAST_ADDRESS, FLAGS_ACK, FLAGS_RETRY, ReliableReceiver
+
+GATEWAY_NODE = 1
+
+
+class LossyRadio:
+    """
+    Simulated RFM69 of the gateway. The packets sent by the senders get to its FIFO
+    unless lost, the ACKs it sends get to the sender unless lost.
+    """
+
+    def __init__(self, loss, rng):
+        """
+        :param loss: probability of losing a transmission
+        :param rng: random.Random object
+        """
+        self._loss = loss
+        self._rng = rng
+        self._fifo = []
+        self.last_rssi = -70
+        self.acks = []  # ACK headers delivered to the senders
+        self.transmissions = 0
+
+    def __len__(self):
+        return len(self._fifo)
+
+    def transmit(self, packet):
+        """
+        Sender side transmission of a packet with the header.
+        """
+        self.transmissions += 1
+        if self._rng.random() >= self._loss:
+            self._fifo.append(bytes(packet))
+
+    # pylint: disable=unused-argument
+    def receive(self, timeout=None, with_header=False):
+        """
+        :return: the next packet in the FIFO, None if empty
+        """
+        if not self._fifo:
+            return None
+        packet = self._fifo.pop(0)
+        return packet if with_header else packet[4:]
+
+    # pylint: disable=too-many-arguments
+    def send(
+        self,
+        data,
+        *,
+        keep_listening=False,
+        destination=None,
+        node=None,
+        identifier=None,
+        flags=None,
+    ):
+        """
+        Gateway side transmission, i.e. of ACK.
+        """
+        self.transmissions += 1
+        if self._rng.random() >= self._loss:
+            self.acks.append((destination, node, identifier, flags))
+        return True
+
+
+def run_blind(radio, senders, readings, copies):
+    """
+    Each reading is broadcast given number of times, the gateway processes all copies.
+    :return: tuple of the number of delivered readings and processed duplicates
+    """
+    seen = set()
+    duplicates = 0
+    for reading in range(readings):
+        for sender in range(senders):
+            for _ in range(copies):
+                radio.transmit(
+                    bytes((BROADCAST_ADDRESS, sender + 2, reading % 256, 0, 1))
+                )
+            while (packet := radio.receive(with_header=True)) is not None:
+                key = (packet[1], reading)
+                if key in seen:
+                    duplicates += 1
+                seen.add(key)
+
+    return len(seen), duplicates
+
+
+def send_with_ack(radio, receiver, node, identifier, retries):
+    """
+    Transmit the packet until acknowledged or the retries are exhausted,
+    let the gateway process what it receives.
+    :return: number of times the gateway processed the packet
+    """
+    processed = 0
+    for attempt in range(retries):
+        flags = FLAGS_RETRY if attempt > 0 else 0
+        radio.acks.clear()
+        radio.transmit(bytes((GATEWAY_NODE, node, identifier, flags, 1)))
+        while len(radio) > 0:
+            for _ in receiver(radio, 0):
+                processed += 1
+                receiver.ack(radio)
+        if any(
+            ack[0] == node and ack[2] == identifier and ack[3] & FLAGS_ACK
+            for ack in radio.acks
+        ):
+            break
+
+    return processed
+
+
+def run_reliable(radio, senders, readings, retries):
+    """
+    Each reading is sent with ACK request and retransmitted until acknowledged
+    or the retries are exhausted.
+    :return: tuple of the number of delivered readings and processed duplicates
+    """
+    receiver = ReliableReceiver(GATEWAY_NODE)
+
+    seen = set()
+    duplicates = 0
+    for reading in range(readings):
+        for sender in range(senders):
+            node = sender + 2
+            processed = send_with_ack(radio, receiver, node, reading % 256, retries)
+            if processed > 0:
+                seen.add((node, reading))
+                duplicates += processed - 1
+
+    return len(seen), duplicates
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="reliable datagram mode simulation")
+    parser.add_argument("-n", "--readings", type=int, default=1000)
+    parser.add_argument("-s", "--senders", type=int, default=5)
+    parser.add_argument(
+        "-l", "--loss", type=float, default=0.2, help="loss probability"
+    )
+    parser.add_argument(
+        "-c", "--copies", type=int, default=3, help="blind transmissions"
+    )
+    parser.add_argument(
+        "-r", "--retries", type=int, default=5, help="ACK mode attempts"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    total = args.readings * args.senders
+    for name, func, param in (
+        ("blind", run_blind, args.copies),
+        ("ack", run_reliable, args.retries),
+    ):
+        radio = LossyRadio(args.loss, random.Random(args.seed))
+        delivered, duplicates = func(radio, args.senders, args.readings, param)
+        print(
+            f"{name:>6}: delivered {delivered / total:6.1%}, "
+            f"{radio.transmissions / total:.2f} transmissions per reading, "
+            f"{duplicates} duplicates processed"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Host side selection stage of the multi-gateway deployment
+
+Subscribes to the coordination topic the gateways publish the raw receptions to,
+keeps the copy with the best RSSI of each packet and publishes its readings the same way
+a single gateway would. The configuration (broker, allowed topics, topic IDs,
+coordination topic, batch publishing) is read from the secrets.py file of the gateways.
+
+Requires the paho-mqtt package. Run from the top level directory of the repository:
+
+  python -m tools.coordinator --secrets secrets.py
+"""
+
+import argparse
+import runpy
+import sys
+
+from coordination import BestRssiSelector, parse_reception
+from gateway import decode_packet, join_records, publish
+from packet import PacketDecoder, PacketDecodingError, is_batch
+from stats import Stats
+from topicacl import TopicACL
+
+try:
+    # pylint: disable=import-error
+    import paho.mqtt.client as paho
+except ImportError:
+    paho = None
+
+
+class Coordinator:
+    """
+    Decodes and publishes the selected receptions.
+    """
+
+    def __init__(self, client, secrets, selector):
+        """
+        :param client: connected MQTT client with publish(topic, payload) method
+        :param secrets: the secrets dictionary
+        :param selector: BestRssiSelector object
+        """
+        self._client = client
+        self._selector = selector
+        self._decoder = PacketDecoder(topic_ids=secrets.get("topic_ids"))
+        self._topic_acl = TopicACL(secrets["allowed_topics"])
+        self._batch_array = secrets.get("batch_publish") == "array"
+        self._stats = Stats()
+
+    def on_reception(self, payload):
+        """
+        Handle message from the coordination topic.
+        """
+        try:
+            gateway, rssi, packet = parse_reception(payload)
+        except ValueError as e:
+            print(f"ignoring invalid reception: {e}", file=sys.stderr)
+            return
+
+        early = self._selector.offer(gateway, rssi, packet)
+        if early is not None:
+            self.publish(*early)
+
+    def poll(self):
+        """
+        Publish the receptions whose selection window elapsed.
+        """
+        for reception in self._selector.poll():
+            self.publish(*reception)
+
+    def publish(self, gateway, rssi, packet):
+        """
+        Decode the packet and publish its readings, the same way the gateway does.
+        """
+        try:
+            readings = decode_packet(self._decoder, self._topic_acl, packet)
+            if self._batch_array and is_batch(packet):
+                readings = join_records(readings)
+            readings = list(readings)
+        except PacketDecodingError as e:
+            print(f"{gateway}: {e}", file=sys.stderr)
+            return
+
+        for mqtt_topic, reading in readings:
+            print(f"{gateway} ({rssi}): publishing to {mqtt_topic}")
+            publish(self._client, mqtt_topic, reading, self._stats)
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="multi-gateway selection stage")
+    parser.add_argument("--secrets", default="secrets.py", help="path to secrets.py")
+    parser.add_argument("--window-ms", type=int, default=200)
+    args = parser.parse_args()
+
+    if paho is None:
+        sys.exit("the paho-mqtt package is needed")
+
+    secrets = runpy.run_path(args.secrets)["secrets"]
+    coordination_topic = secrets.get("coordination_topic")
+    if not coordination_topic:
+        sys.exit("coordination_topic is not set")
+
+    client = paho.Client(paho.CallbackAPIVersion.VERSION2)
+    coordinator = Coordinator(
+        client, secrets, BestRssiSelector(window_ms=args.window_ms)
+    )
+    client.on_message = lambda client, userdata, message: coordinator.on_reception(
+        message.payload
+    )
+    client.connect(secrets["broker"], secrets.get("broker_port", 1883))
+    client.subscribe(coordination_topic)
+
+    while True:
+        client.loop(timeout=0.05)
+        coordinator.poll()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Load generator driving the gateway loop (gateway.py) with simulated hardware
+
+The simulated senders transmit packets at given rate, with loss and bursts,
+the loop runs unmodified (polling or asyncio based) and publishes to in-process broker.
+At the end, the sustained throughput, the drop rate (with the breakdown where
+the packets were lost) and the receive-to-publish latency percentiles are reported.
+
+Run from the top level directory of the repository:
+
+  python -m tools.loadgen -r 20 -d 10 --burst 3
+
+With --node, the packets are addressed to the gateway, which acknowledges them.
+"""
+
+import argparse
+import json
+import random
+
+import gateway
+from reliable import BROADCAST_ADDRESS
+from tools.simulator import (
+    SIM_TOPIC_PREFIX,
+    SimBroker,
+    SimHardware,
+    SimRadio,
+    SimulationDone,
+)
+from topicacl import TopicACL
+from tunables import (
+    ALLOWED_TOPICS,
+    BROKER,
+    BROKER_PORT,
+    LOG_LEVEL,
+    MQTT_QOS,
+    NODE_ADDRESS,
+    QUEUE_SIZE,
+    STATS_INTERVAL,
+    STATS_TOPIC,
+    TOPIC_IDS,
+    USE_ASYNCIO,
+)
+
+STATS_SIM_TOPIC = "sim/stats"
+
+
+def percentile(values, fraction):
+    """
+    :param values: sorted list
+    :param fraction: 0 to 1
+    :return: the value at the fraction of the list
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report_stats(broker):
+    """
+    Print the last statistics published by the gateway.
+    """
+    stats = [
+        payload for topic, payload, _ in broker.messages if topic == STATS_SIM_TOPIC
+    ]
+    if not stats:
+        return
+    last = json.loads(stats[-1])
+    print(f"connection: {last['connection']}")
+    print(f"boot (ms): {last['boot']}")
+    if "reliable" in last:
+        print(f"reliable: {last['reliable']}")
+
+
+def report(radio, broker, hw):
+    """
+    Print the results of the simulation.
+    """
+    publish_stamps = {}
+    for topic, payload, stamp in broker.messages:
+        if not topic.startswith(SIM_TOPIC_PREFIX):
+            continue
+        index = int(json.loads(payload)["temperature"])
+        publish_stamps.setdefault(index, stamp)
+
+    generated = len(radio.arrivals)
+    published = len(publish_stamps)
+    if generated == 0:
+        print("no packets generated")
+        return
+
+    gateway_drops = radio.received - published
+    print(
+        f"generated {generated} packets in "
+        f"{radio.arrivals[-1] - radio.arrivals[0]:.1f} s, published {published}"
+    )
+    print(
+        f"drop rate {(generated - published) / generated:.1%} "
+        f"(air {radio.lost}, FIFO overrun {radio.overrun}, gateway {gateway_drops})"
+    )
+    if published == 0:
+        return
+
+    stamps = sorted(publish_stamps.values())
+    span = stamps[-1] - radio.arrivals[min(publish_stamps)]
+    latencies = sorted(
+        (stamp - radio.arrivals[index]) * 1000
+        for index, stamp in publish_stamps.items()
+    )
+    print(f"sustained {published / span if span > 0 else 0:.1f} packets/s")
+    print(
+        f"receive-to-publish latency p50 {percentile(latencies, 0.5):.1f} ms, "
+        f"p99 {percentile(latencies, 0.99):.1f} ms, max {latencies[-1]:.1f} ms"
+    )
+    print(f"longest watchdog feed interval {hw.watchdog_obj.max_interval:.2f} s")
+
+    report_stats(broker)
+    if radio.acks:
+        print(f"ACKs transmitted {radio.acks}")
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="gateway load generator")
+    parser.add_argument("-r", "--rate", type=float, default=5, help="bursts/s")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds")
+    parser.add_argument("-s", "--senders", type=int, default=5)
+    parser.add_argument(
+        "-l", "--loss", type=float, default=0.0, help="loss probability"
+    )
+    parser.add_argument("-b", "--burst", type=int, default=1, help="packets per burst")
+    parser.add_argument(
+        "--airtime", type=float, default=0.005, help="packet spacing in burst"
+    )
+    parser.add_argument("--asyncio", action="store_true", help="asyncio based loop")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument(
+        "--outage",
+        action="append",
+        default=[],
+        metavar="START:DURATION",
+        help="broker outage, in seconds since the start (can be repeated)",
+    )
+    parser.add_argument(
+        "--connect-delay",
+        type=float,
+        default=0,
+        help="time to connect to the network, in seconds",
+    )
+    parser.add_argument(
+        "--node",
+        type=int,
+        help="gateway node address, the packets are sent to it and acknowledged",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    topic_ids = {i: f"{SIM_TOPIC_PREFIX}{i}" for i in range(1, args.senders + 1)}
+    secrets = {
+        BROKER: "localhost",
+        BROKER_PORT: 1883,
+        LOG_LEVEL: args.log_level,
+        ALLOWED_TOPICS: [f"{SIM_TOPIC_PREFIX}#"],
+        TOPIC_IDS: topic_ids,
+        USE_ASYNCIO: args.asyncio,
+        MQTT_QOS: args.qos,
+        QUEUE_SIZE: args.queue_size,
+        STATS_TOPIC: STATS_SIM_TOPIC,
+        STATS_INTERVAL: 1,
+    }
+    if args.node is not None:
+        secrets[NODE_ADDRESS] = args.node
+
+    radio = SimRadio(
+        args.rate,
+        args.duration,
+        senders=args.senders,
+        loss=args.loss,
+        burst=args.burst,
+        airtime=args.airtime,
+        destination=args.node if args.node is not None else BROADCAST_ADDRESS,
+        rng=random.Random(args.seed),
+    )
+    broker = SimBroker(
+        [tuple(float(v) for v in outage.split(":")) for outage in args.outage]
+    )
+    hw = SimHardware(radio, broker, connect_delay=args.connect_delay)
+    try:
+        gateway.run(hw, secrets, TopicACL(secrets[ALLOWED_TOPICS]))
+    except SimulationDone:
+        pass
+    except ConnectionError as e:
+        print(f"the gateway gave up: {e}")
+
+    report(radio, broker, hw)
+
+
+if __name__ == "__main__":
+    main()
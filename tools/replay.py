@@ -0,0 +1,176 @@
+"""
+Replay of packet captures through the decoding and publishing path of the gateway
+
+The packets of a capture (see capture.py) are fed through decode_packet() and publish()
+of gateway.py, at the recorded pace or as fast as possible. The published messages
+can be printed (to compare the output between versions, i.e. as regression test)
+and the throughput and per stage durations are reported (to use the capture as benchmark).
+The configuration (allowed topics, topic IDs) is read from the secrets.py file of the gateway.
+
+Run from the top level directory of the repository:
+
+  python -m tools.replay --secrets secrets.py --max-speed capture.bin
+"""
+
+import argparse
+import runpy
+import sys
+import time
+
+from capture import iter_records
+from gateway import decode_packet, publish
+from packet import PacketDecoder, PacketDecodingError, TopicNotAllowedError
+from stats import (
+    COUNTER_DECODE_FAILURES,
+    COUNTER_PACKETS,
+    COUNTER_TOPIC_REJECTIONS,
+    STAGE_DECODE,
+    Stats,
+)
+from topicacl import TopicACL
+
+
+class Publisher:  # pylint: disable=too-few-public-methods
+    """
+    Stand-in for the MQTT client, counts and optionally prints the messages.
+    """
+
+    def __init__(self, output=None):
+        """
+        :param output: file object to print the messages to, None to only count them
+        """
+        self._output = output
+        self.messages = 0
+        self.bytes = 0
+
+    def publish(self, topic, msg):
+        """
+        Count the message and print it.
+        """
+        self.messages += 1
+        self.bytes += len(msg)
+        if self._output is not None:
+            print(f"{topic} {str(msg, 'utf-8')}", file=self._output)
+
+
+def wait_for(stamp_ms, first_stamp_ms, start):
+    """
+    Sleep until the recorded time of the packet, relative to the start of the replay.
+    """
+    offset = ((stamp_ms - first_stamp_ms) & 0xFFFFFFFF) / 1000
+    delay = start + offset - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def load_captures(paths):
+    """
+    :param paths: paths of the capture files
+    :return: list of (timestamp in milliseconds, RSSI, packet) tuples
+    The records are read up to the first truncated one.
+    """
+    records = []
+    for path in paths:
+        with open(path, "rb") as file_obj:
+            data = file_obj.read()
+        try:
+            for stamp_ms, rssi, packet in iter_records(data):
+                records.append((stamp_ms, rssi, bytes(packet)))
+        except ValueError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+
+    return records
+
+
+# pylint: disable=too-many-arguments
+def replay(records, decoder, topic_acl, publisher, stats, *, max_speed=False):
+    """
+    Decode and publish the packets.
+    :param records: list of (timestamp in milliseconds, RSSI, packet) tuples
+    :return: number of packets replayed
+    """
+    start = time.monotonic()
+    for stamp_ms, _, packet in records:
+        if not max_speed:
+            wait_for(stamp_ms, records[0][0], start)
+
+        stats.increment(COUNTER_PACKETS)
+        start_ns = time.monotonic_ns()
+        try:
+            readings = list(decode_packet(decoder, topic_acl, packet))
+        except TopicNotAllowedError as e:
+            stats.increment(COUNTER_TOPIC_REJECTIONS)
+            print(e, file=sys.stderr)
+            continue
+        except PacketDecodingError as e:
+            stats.increment(COUNTER_DECODE_FAILURES)
+            print(e, file=sys.stderr)
+            continue
+        stats.record(STAGE_DECODE, start_ns)
+
+        for mqtt_topic, reading in readings:
+            publish(publisher, mqtt_topic, reading, stats)
+
+    return len(records)
+
+
+def report(count, elapsed, publisher, stats):
+    """
+    Print the throughput and the per stage durations.
+    """
+    summary = stats.summary()
+    print(
+        f"replayed {count} packets in {elapsed:.3f} s ({count / elapsed:.0f} packets/s), "
+        f"published {publisher.messages} messages ({publisher.bytes} bytes), "
+        f"counters {summary['counters']}",
+        file=sys.stderr,
+    )
+    for stage, (samples, p50, p99, max_ms) in summary["latency_ms"].items():
+        print(
+            f"{stage:>7}: {samples} samples, p50 {p50:.3f} ms, p99 {p99:.3f} ms, "
+            f"max {max_ms:.3f} ms",
+            file=sys.stderr,
+        )
+
+
+def main():
+    """
+    command line entry point
+    """
+    parser = argparse.ArgumentParser(description="packet capture replay")
+    parser.add_argument("capture", nargs="+", help="capture file(s)")
+    parser.add_argument("--secrets", default="secrets.py", help="path to secrets.py")
+    parser.add_argument(
+        "--max-speed", action="store_true", help="do not keep the recorded pace"
+    )
+    parser.add_argument(
+        "--print", action="store_true", help="print the published messages"
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=1, help="replay the capture n times"
+    )
+    args = parser.parse_args()
+
+    secrets = runpy.run_path(args.secrets)["secrets"]
+    decoder = PacketDecoder(topic_ids=secrets.get("topic_ids"))
+    topic_acl = TopicACL(secrets["allowed_topics"])
+
+    records = load_captures(args.capture)
+    if not records:
+        sys.exit("no packets in the capture")
+
+    publisher = Publisher(sys.stdout if args.print else None)
+    stats = Stats()
+    start = time.monotonic()
+    count = 0
+    for _ in range(args.repeat):
+        count += replay(
+            records, decoder, topic_acl, publisher, stats, max_speed=args.max_speed
+        )
+    elapsed = time.monotonic() - start
+
+    report(count, elapsed, publisher, stats)
+
+
+if __name__ == "__main__":
+    main()
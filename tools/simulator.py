@@ -0,0 +1,366 @@
+"""
+CPython simulation of the gateway hardware
+
+SimRadio delivers generated packets at scheduled times with loss and bursts,
+modelling the single packet FIFO of the RFM69: a packet that is not read before
+the next one arrives is overwritten. SimBroker is in-process stand-in for the MQTT broker
+that records the published messages. SimHardware plugs these to the gateway loop
+in gateway.py via the hardware abstraction layer.
+"""
+
+import random
+import struct
+import time
+
+from hal import Hardware
+from packet import COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ
+from reliable import BROADCAST_ADDRESS
+
+SIM_TOPIC_PREFIX = "devices/sim/"
+
+
+class SimulationDone(Exception):
+    """
+    Raised by SimRadio once all the packets were delivered and the drain time elapsed,
+    to end the gateway loop.
+    """
+
+
+def sim_packet(sender, index):
+    """
+    :param sender: topic ID of the sender
+    :param index: index of the packet, used as the temperature value
+    :return: packet in the compact frame with sequence number
+    """
+    return struct.pack(
+        COMPACT_SEQ_HEADER_FMT, FRAME_COMPACT_SEQ, 1, sender, index % 256
+    ) + struct.pack(">ffIff", 50.0, float(index), 400, 3.7, 100.0)
+
+
+class SimRadio:  # pylint: disable=too-many-instance-attributes
+    """
+    Simulated RFM69 receiving packets of multiple senders.
+    The arrival time of each packet (by its index) is kept in the arrivals list.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        rate,
+        duration,
+        *,
+        senders=1,
+        loss=0.0,
+        burst=1,
+        airtime=0.005,
+        drain=2.0,
+        destination=BROADCAST_ADDRESS,
+        rng=None,
+    ):
+        """
+        :param rate: average number of bursts per second (all senders together)
+        :param duration: how long to generate the packets, in seconds
+        :param senders: number of senders (topic IDs 1 to senders)
+        :param loss: probability of losing a packet on the air
+        :param burst: number of packets in a burst, sent back-to-back
+        :param airtime: interval between the packets of a burst, in seconds
+        :param drain: time after the last packet to let the gateway publish, in seconds
+        :param destination: node address the packets are sent to,
+        BROADCAST_ADDRESS for broadcasts that are not acknowledged
+        :param rng: random.Random object
+        """
+        rng = rng if rng is not None else random.Random()
+        self.arrivals = []
+        self._senders = []
+        self._lost = []
+        stamp = time.monotonic()
+        end = stamp + duration
+        while True:
+            stamp += rng.expovariate(rate)
+            if stamp >= end:
+                break
+            sender = rng.randrange(senders) + 1
+            for i in range(burst):
+                self.arrivals.append(stamp + i * airtime)
+                self._senders.append(sender)
+                self._lost.append(rng.random() < loss)
+        self._end = (self.arrivals[-1] if self.arrivals else end) + drain
+        self._next = 0
+        self._destination = destination
+
+        self.lost = 0
+        self.overrun = 0
+        self.received = 0
+        self.acks = 0
+
+        self.last_rssi = -70.0
+        self.encryption_key = None
+        self.temperature = 20
+        self.frequency_mhz = 433.0
+        self.bitrate = 250000
+        self.frequency_deviation = 250000
+
+    def listen(self):
+        """
+        Enter the receive mode. The simulated radio is always receiving.
+        """
+
+    def payload_ready(self):
+        """
+        :return: True if a packet has arrived since the last receive
+        """
+        return (
+            self._next < len(self.arrivals)
+            and self.arrivals[self._next] <= time.monotonic()
+        )
+
+    def _arrived(self, now):
+        """
+        :return: index of the packet in the FIFO, i.e. the latest one arrived by now,
+        None if there is no such packet
+        """
+        index = None
+        while self._next < len(self.arrivals) and self.arrivals[self._next] <= now:
+            if self._lost[self._next]:
+                self.lost += 1
+            else:
+                if index is not None:
+                    self.overrun += 1
+                index = self._next
+            self._next += 1
+
+        return index
+
+    def receive(self, timeout=None, with_header=False):
+        """
+        Return the packet in the FIFO, wait up to timeout for one otherwise.
+        Raises SimulationDone when the simulation is over.
+        """
+        now = time.monotonic()
+        if now >= self._end:
+            raise SimulationDone()
+
+        index = self._arrived(now)
+        if index is None:
+            wait = timeout or 0
+            if self._next < len(self.arrivals):
+                wait = min(wait, max(0, self.arrivals[self._next] - now))
+            time.sleep(wait)
+            index = self._arrived(time.monotonic())
+            if index is None:
+                return None
+
+        self.received += 1
+        packet = sim_packet(self._senders[index], index)
+        if with_header:
+            packet = (
+                bytes((self._destination, self._senders[index], index % 256, 0))
+                + packet
+            )
+        return packet
+
+    # pylint: disable=unused-argument
+    def send(self, data, **kwargs):
+        """
+        Count the transmissions (ACKs).
+        """
+        self.acks += 1
+        return True
+
+
+class SimBroker:
+    """
+    Records the messages published by the clients, as (topic, payload, monotonic time).
+    The broker is unreachable during the outages.
+    """
+
+    def __init__(self, outages=()):
+        """
+        :param outages: list of (start, duration) tuples in seconds since now
+        """
+        now = time.monotonic()
+        self._outages = [
+            (now + start, now + start + duration) for start, duration in outages
+        ]
+        self.messages = []
+
+    def is_up(self):
+        """
+        :return: False during outage
+        """
+        now = time.monotonic()
+        return not any(start <= now < end for start, end in self._outages)
+
+    def deliver(self, topic, payload):
+        """
+        Store message published by client.
+        Raises OSError during outage.
+        """
+        if not self.is_up():
+            raise OSError("broker unreachable")
+        self.messages.append((topic, bytes(payload), time.monotonic()))
+
+
+class SimMQTTClient:  # pylint: disable=too-many-instance-attributes
+    """
+    Simulated MQTT client connected to SimBroker. The PUBACKs of QoS 1 messages
+    are received in the next loop() call. Retransmitted messages are delivered again,
+    as by real broker.
+    """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._connected = False
+        self._pending_acks = []
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_publish = None
+        self.on_puback = None
+
+    def connect(self):
+        """
+        Connect to the broker.
+        Raises OSError during outage.
+        """
+        if not self._broker.is_up():
+            raise OSError("broker unreachable")
+        self._connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, 0, 0)
+
+    def disconnect(self):
+        """
+        Disconnect from the broker.
+        """
+        self._connected = False
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 0)
+
+    def is_connected(self):
+        """
+        :return: True if connected
+        """
+        return self._connected
+
+    def loop(self, timeout=0):
+        """
+        Receive the PUBACKs, block for the timeout if there are none,
+        like the MiniMQTT loop() without incoming traffic.
+        Raises OSError during outage.
+        """
+        if not self._connected:
+            raise RuntimeError("not connected")
+        if not self._broker.is_up():
+            raise OSError("connection reset")
+        if not self._pending_acks:
+            time.sleep(timeout)
+            return None
+
+        pids, self._pending_acks = self._pending_acks, []
+        if self.on_puback is not None:
+            for pid in pids:
+                self.on_puback(pid)
+        return [0x40] * len(pids)
+
+    def publish(self, topic, msg):
+        """
+        Publish message with QoS 0.
+        """
+        if not self._connected:
+            raise RuntimeError("not connected")
+        if isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        self._broker.deliver(topic, msg)
+
+    # pylint: disable=unused-argument
+    def publish_nowait(self, topic, msg, pid, dup=False):
+        """
+        Publish message with QoS 1, the PUBACK will be received in loop().
+        """
+        if not self._connected:
+            raise RuntimeError("not connected")
+        self._broker.deliver(topic, msg)
+        self._pending_acks.append(pid)
+
+
+class SimWatchdog:  # pylint: disable=too-few-public-methods
+    """
+    Records the longest interval between feeds instead of resetting.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.max_interval = 0
+        self._stamp = time.monotonic()
+
+    def feed(self):
+        """
+        Feed the watchdog.
+        """
+        now = time.monotonic()
+        self.max_interval = max(now - self._stamp, self.max_interval)
+        self._stamp = now
+
+
+class SimPixel:  # pylint: disable=too-few-public-methods
+    """
+    Neopixel that does nothing.
+    """
+
+    def __init__(self):
+        self.brightness = 0
+
+    def fill(self, color):
+        """
+        Set the color.
+        """
+
+
+class SimHardware(Hardware):
+    """
+    Simulated hardware of the gateway.
+    """
+
+    def __init__(self, radio, broker, connect_delay=0):
+        """
+        :param radio: SimRadio object
+        :param broker: SimBroker object
+        :param connect_delay: how long it takes to connect to the network, in seconds
+        """
+        self._radio = radio
+        self._broker = broker
+        self._connect_delay = connect_delay
+        self._network_connected = False
+        self.watchdog_obj = None
+
+    def watchdog(self, timeout):
+        self.watchdog_obj = SimWatchdog(timeout)
+        return self.watchdog_obj
+
+    def radio(self):
+        return self._radio
+
+    def network_connected(self):
+        return self._network_connected
+
+    def connect_network(self, timeout=3):
+        time.sleep(min(self._connect_delay, timeout))
+        self._network_connected = True
+
+    def packet_ready(self, pin_name):
+        raise RuntimeError("DIO0 is not simulated")
+
+    def connect_mqtt(self, mqtt_client):
+        mqtt_client.connect()
+
+    def warm_start_metrics(self):
+        return None
+
+    def mqtt_client(self, broker, port, log_level):
+        return SimMQTTClient(self._broker)
+
+    def pixel(self):
+        return SimPixel()
+
+    def uid(self):
+        return b"\x00\x00\x00\x00\x00\x01"
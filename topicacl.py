@@ -0,0 +1,135 @@
+"""
+MQTT topic access control list
+
+The list of allowed topic filters is compiled once into a set of exact topics
+and a trie of the filters with the MQTT wildcards ('+' for single level, '#' for multiple levels)
+so that the cost of the lookup does not depend on the number of the filters.
+"""
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+# Characters that cannot appear in a topic name to publish to.
+_INVALID_CHARS = (SINGLE_LEVEL, MULTI_LEVEL, "\0")
+
+# Key used in the trie nodes to mark the end of a filter.
+_END = None
+
+
+class TopicACL:
+    """
+    Index of allowed topic filters with memoized decisions.
+    """
+
+    def __init__(self, topic_filters, max_cached=64):
+        """
+        :param topic_filters: iterable of topic filters, possibly with wildcards
+        :param max_cached: maximum number of memoized decisions
+        Raises ValueError for invalid filter.
+        """
+        self._exact = set()
+        self._trie = {}
+        self._cache = {}
+        self._max_cached = max_cached
+
+        for topic_filter in topic_filters:
+            self.add(topic_filter)
+
+    @staticmethod
+    def _check_filter(levels, topic_filter):
+        """
+        Check the placement of the wildcards. Raises ValueError if invalid.
+        """
+        for i, level in enumerate(levels):
+            if level == MULTI_LEVEL:
+                if i != len(levels) - 1:
+                    raise ValueError(f"'#' has to be the last level: {topic_filter}")
+            elif level != SINGLE_LEVEL and (
+                SINGLE_LEVEL in level or MULTI_LEVEL in level
+            ):
+                raise ValueError(
+                    f"wildcard has to occupy the whole level: {topic_filter}"
+                )
+
+    def add(self, topic_filter):
+        """
+        Add topic filter to the index.
+        Raises ValueError for invalid filter.
+        """
+        if not topic_filter:
+            raise ValueError("empty topic filter")
+
+        self._cache.clear()
+
+        if SINGLE_LEVEL not in topic_filter and MULTI_LEVEL not in topic_filter:
+            self._exact.add(topic_filter)
+            return
+
+        levels = topic_filter.split("/")
+        self._check_filter(levels, topic_filter)
+        node = self._trie
+        for level in levels:
+            node = node.setdefault(level, {})
+        node[_END] = True
+
+    def _match(self, node, levels, idx):
+        """
+        Walk the trie recursively. Only the wildcard branches can cause backtracking.
+        """
+        # '#' matches the parent level as well as any number of child levels.
+        if MULTI_LEVEL in node:
+            # Topics starting with '$' are not matched by wildcards on the first level.
+            if idx > 0 or not levels[0].startswith("$"):
+                return True
+
+        if idx == len(levels):
+            return _END in node
+
+        child = node.get(levels[idx])
+        if child is not None and self._match(child, levels, idx + 1):
+            return True
+
+        child = node.get(SINGLE_LEVEL)
+        if child is not None and (idx > 0 or not levels[0].startswith("$")):
+            return self._match(child, levels, idx + 1)
+
+        return False
+
+    @staticmethod
+    def is_valid_topic(topic):
+        """
+        :return: True if the topic can be published to, i.e. it is not empty
+        and does not contain wildcards or NUL
+        """
+        if not topic:
+            return False
+
+        for char in _INVALID_CHARS:
+            if char in topic:
+                return False
+
+        return True
+
+    def is_allowed(self, topic):
+        """
+        :return: True if the topic is valid and matches any of the filters, False otherwise
+        """
+        allowed = self._cache.get(topic)
+        if allowed is not None:
+            return allowed
+
+        if not self.is_valid_topic(topic):
+            allowed = False
+        elif topic in self._exact:
+            allowed = True
+        else:
+            allowed = bool(self._trie) and self._match(self._trie, topic.split("/"), 0)
+
+        # Simple eviction to keep the memory bounded.
+        if len(self._cache) >= self._max_cached:
+            self._cache.clear()
+        self._cache[topic] = allowed
+
+        return allowed
+
+    def __contains__(self, topic):
+        return self.is_allowed(topic)
@@ -0,0 +1,53 @@
+"""
+Names of the tunables in secrets.py
+"""
+
+BROKER_PORT = "broker_port"
+LOG_TOPIC = "log_topic"
+LOG_BUFFER_SIZE = "log_buffer_size"
+LOG_FLUSH_INTERVAL = "log_flush_interval"
+BROKER = "broker"
+PASSWORD = "password"
+SSID = "ssid"
+WARM_START = "warm_start"
+LOG_LEVEL = "log_level"
+ENCRYPTION_KEY = "encryption_key"
+ALLOWED_TOPICS = "allowed_topics"
+TOPIC_IDS = "topic_ids"
+BATCH_PUBLISH = "batch_publish"
+QUEUE_SIZE = "queue_size"
+QUEUE_OVERFLOW = "queue_overflow"
+PUBLISH_BUDGET = "publish_budget_ms"
+SPOOL_PATH = "spool_path"
+SPOOL_SLOTS = "spool_slots"
+SPOOL_REPLAY_BATCH = "spool_replay_batch"
+SPOOL_REPLAY_INTERVAL = "spool_replay_interval"
+USE_ASYNCIO = "use_asyncio"
+DIO0_PIN = "dio0_pin"
+STATS_TOPIC = "stats_topic"
+STATS_INTERVAL = "stats_interval"
+DEDUP_SIZE = "dedup_size"
+DEDUP_TTL = "dedup_ttl_ms"
+DEADBANDS = "deadbands"
+DEADBAND_HEARTBEAT = "deadband_heartbeat"
+AGGREGATE_TOPICS = "aggregate_topics"
+AGGREGATE_WINDOW = "aggregate_window"
+AGGREGATE_SUFFIX = "aggregate_suffix"
+AGGREGATE_RAW = "aggregate_raw"
+LINK_STATS_SIZE = "link_stats_size"
+RATE_LIMIT = "rate_limit"
+RATE_LIMITS = "rate_limits"
+RATE_LIMIT_BURST = "rate_limit_burst"
+RATE_LIMIT_POLICY = "rate_limit_policy"
+NODE_ADDRESS = "node_address"
+COORDINATION_TOPIC = "coordination_topic"
+GATEWAY_ID = "gateway_id"
+MQTT_QOS = "mqtt_qos"
+INFLIGHT_WINDOW = "inflight_window"
+RETRANSMIT_TIMEOUT = "retransmit_timeout"
+CAPTURE_PATH = "capture_path"
+CAPTURE_TOPIC = "capture_topic"
+CAPTURE_MAX_SIZE = "capture_max_size"
+CAPTURE_INTERVAL = "capture_interval"
+RECONNECT_BACKOFF_MAX = "reconnect_backoff_max"
+RECONNECT_MAX_FAILURES = "reconnect_max_failures"
@@ -0,0 +1,234 @@
+"""
+Warm-restart cache in the non-volatile memory
+
+Small binary record in microcontroller.nvm that survives resets. It holds the WiFi channel
+and BSSID of the access point and the address of the MQTT broker from the last successful
+connection, so that after reset the network can be joined without scanning
+and the broker connected without resolving its name. The cached data is valid only
+for the same configuration (SSID, broker, port) and is invalidated once the fast path fails.
+The record also counts the boots and the causes of the resets.
+"""
+
+import binascii
+import struct
+
+import adafruit_logging as logging
+
+MAGIC = b"R2MW"
+VERSION = 1
+# magic, version, configuration key, flags, WiFi channel, BSSID, broker IPv4 address,
+# duration of the last full connect in milliseconds, boots, fast path hits and misses,
+# and the resets by cause, followed by CRC32 of all that.
+RECORD_FMT = ">4sBIBB6s4sIIIIIIII"
+CRC_FMT = ">I"
+
+FLAG_NETWORK = 0x01
+FLAG_BROKER = 0x02
+
+# Causes of the resets.
+RESET_CONNECTION = "connection"
+RESET_MEMORY = "memory"
+RESET_WATCHDOG = "watchdog"
+RESET_RELOAD = "reload"
+RESET_CAUSES = (RESET_CONNECTION, RESET_MEMORY, RESET_WATCHDOG, RESET_RELOAD)
+
+
+def config_key(ssid, broker, port):
+    """
+    :return: key identifying the configuration the cached data is valid for
+    """
+    return binascii.crc32(f"{ssid}\0{broker}\0{port}".encode("utf-8")) & 0xFFFFFFFF
+
+
+class WarmStart:  # pylint: disable=too-many-instance-attributes
+    """
+    The record in the non-volatile memory. The changes are written by save().
+    """
+
+    def __init__(self, nvm, key, offset=0):
+        """
+        :param nvm: byte array like object backed by non-volatile memory
+        :param key: configuration key, see config_key()
+        :param offset: offset of the record in the non-volatile memory
+        """
+        self._nvm = nvm
+        self._key = key
+        self._offset = offset
+        self._size = struct.calcsize(RECORD_FMT) + struct.calcsize(CRC_FMT)
+
+        self._flags = 0
+        self._channel = 0
+        self._bssid = bytes(6)
+        self._broker_ip = bytes(4)
+        self.full_connect_ms = 0
+        self.boots = 0
+        self.fast_hits = 0
+        self.fast_misses = 0
+        self.resets = dict.fromkeys(RESET_CAUSES, 0)
+        # Duration of the connect and the time saved by the fast path, in this boot.
+        self.connect_ms = None
+        self.saved_ms = 0
+
+        self._load()
+
+    def _load(self):
+        """
+        Read the record. Corrupted or foreign record is ignored, the cached data
+        of different configuration is marked stale.
+        """
+        logger = logging.getLogger("")
+
+        data = bytes(self._nvm[self._offset : self._offset + self._size])
+        record_len = struct.calcsize(RECORD_FMT)
+        (crc,) = struct.unpack(CRC_FMT, data[record_len:])
+        if binascii.crc32(data[:record_len]) & 0xFFFFFFFF != crc:
+            logger.info("no warm-restart record")
+            return
+
+        fields = struct.unpack(RECORD_FMT, data[:record_len])
+        magic, version, key = fields[:3]
+        if magic != MAGIC or version != VERSION:
+            logger.info("ignoring warm-restart record of different format")
+            return
+
+        (
+            self._flags,
+            self._channel,
+            self._bssid,
+            self._broker_ip,
+            self.full_connect_ms,
+            self.boots,
+            self.fast_hits,
+            self.fast_misses,
+        ) = fields[3:11]
+        self.resets = dict(zip(RESET_CAUSES, fields[11:]))
+        if key != self._key:
+            logger.info("warm-restart cache is stale (configuration changed)")
+            self._flags = 0
+            self.full_connect_ms = 0
+
+    def save(self):
+        """
+        Write the record, unless it is unchanged, to avoid wearing the flash.
+        """
+        record = struct.pack(
+            RECORD_FMT,
+            MAGIC,
+            VERSION,
+            self._key,
+            self._flags,
+            self._channel,
+            self._bssid,
+            self._broker_ip,
+            self.full_connect_ms,
+            self.boots,
+            self.fast_hits,
+            self.fast_misses,
+            *(self.resets[cause] for cause in RESET_CAUSES),
+        )
+        data = record + struct.pack(CRC_FMT, binascii.crc32(record) & 0xFFFFFFFF)
+        if bytes(self._nvm[self._offset : self._offset + self._size]) != data:
+            self._nvm[self._offset : self._offset + self._size] = data
+
+    def network(self):
+        """
+        :return: tuple of the cached WiFi channel and BSSID, None if there is none
+        """
+        if not self._flags & FLAG_NETWORK:
+            return None
+
+        return self._channel, self._bssid
+
+    def set_network(self, channel, bssid):
+        """
+        Cache the WiFi channel and the BSSID of the access point.
+        """
+        self._channel = channel
+        self._bssid = bytes(bssid)
+        self._flags |= FLAG_NETWORK
+
+    def broker_address(self):
+        """
+        :return: the cached IPv4 address of the broker as string, None if there is none
+        """
+        if not self._flags & FLAG_BROKER:
+            return None
+
+        return ".".join(str(octet) for octet in self._broker_ip)
+
+    def set_broker_address(self, address):
+        """
+        Cache the IPv4 address (string) of the broker. Other addresses are ignored.
+        """
+        try:
+            octets = bytes(int(octet) for octet in address.split("."))
+        except ValueError:
+            return
+        if len(octets) != 4:
+            return
+        self._broker_ip = octets
+        self._flags |= FLAG_BROKER
+
+    def invalidate(self, flag):
+        """
+        Mark part of the cached data stale, after the fast path using it failed.
+        :param flag: FLAG_NETWORK or FLAG_BROKER
+        """
+        if self._flags & flag:
+            self._flags &= ~flag
+            self.fast_misses += 1
+            self.save()
+
+    def count_boot(self):
+        """
+        Count the boot.
+        """
+        self.boots += 1
+        self.save()
+
+    def count_reset(self, cause):
+        """
+        Count the reset that is about to be performed.
+        :param cause: one of RESET_CAUSES
+        """
+        self.resets[cause] += 1
+        self.save()
+
+    def connected(self, connect_ms, fast):
+        """
+        Record the connection, the duration only for the first one in this boot.
+        :param connect_ms: time spent connecting to the network and the broker,
+        in milliseconds
+        :param fast: whether the cached data was used
+        """
+        logger = logging.getLogger("")
+
+        if self.connect_ms is None:
+            self.connect_ms = connect_ms
+            if fast:
+                self.fast_hits += 1
+                if self.full_connect_ms:
+                    self.saved_ms = max(0, self.full_connect_ms - connect_ms)
+                logger.info(
+                    f"warm restart: connected in {connect_ms} ms, "
+                    f"saved {self.saved_ms} ms"
+                )
+            else:
+                self.full_connect_ms = connect_ms
+                logger.info(f"cold start: connected in {connect_ms} ms")
+        # The cached data might have changed on reconnect as well.
+        self.save()
+
+    def metrics(self):
+        """
+        :return: dictionary with the connect time and the time saved in this boot
+        (in milliseconds), the boot and fast path counters and the resets by cause
+        """
+        return {
+            "connect_ms": self.connect_ms,
+            "saved_ms": self.saved_ms,
+            "boots": self.boots,
+            "fast_hits": self.fast_hits,
+            "fast_misses": self.fast_misses,
+            "resets": self.resets,
+        }